@@ -0,0 +1,344 @@
+'''
+  Local API server that lets any number of front ends (the curses UI,
+  scripts) attach to a running TDaemon and detach again without affecting it.
+
+  Requests and responses are JSON objects, one per line, over a Unix socket
+  (or a localhost TCP port where Unix sockets aren't available):
+
+    {"id": 1, "cmd": "getRoundStr"}  ->  {"id": 1, "result": "Round 2 ..."}
+    {"id": 2, "cmd": "subscribe"}    ->  {"id": 2, "result": {...snapshot}}
+                                         then {"event": "snapshot", ...} on
+                                         every change
+
+  Reads are answered from a snapshot of the daemon's state that is only
+  rebuilt (on the daemon's worker, as an interactive task) after the daemon
+  ran a task, so readers never queue behind the daemon. Commands are queued
+  from an executor thread, so a full queue never holds up the event loop,
+  and are only answered once the snapshot was retaken after every task
+  queued before them, so a client always reads its own writes.
+
+  Usage: python apiserver.py [socket path] to run a daemon with a server.
+'''
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import json
+import os
+import socket
+import sys
+import threading as thrd
+import time
+
+import scheduler
+import tourny_daemon
+
+SOCKET = os.path.join('docs', 'tdaemon.sock')
+PORT = 8613  # Used when Unix sockets aren't available
+INTERVAL = 0.2  # Seconds between checks for daemon changes
+MAX_BUFFER = 1 << 20  # Bytes queued for a subscriber before it's dropped
+
+class ApiServer:
+  '''
+    asyncio server exposing a TDaemon's state and commands, run on its own
+    event loop thread.
+
+    Attributes:
+      daemon: [tourny_daemon.TDaemon] being served.
+      address: [String] socket path, or ([String] host, [Int] port).
+      snapshot: [Dict] of the daemon's state as of its last change.
+      subscribers: [Set] of [asyncio.StreamWriter]s pushed every new snapshot.
+      requests: [Int] number of requests answered.
+  '''
+  def __init__(self, daemon, address = None):
+    '''
+      Starts serving.
+
+      Arguments:
+        daemon: [tourny_daemon.TDaemon] to serve.
+        address: [String] socket path, or ([String] host, [Int] port).
+          Defaults to SOCKET, or localhost:PORT without Unix sockets.
+    '''
+    if address == None:
+      address = SOCKET if hasattr(socket, 'AF_UNIX') else ('127.0.0.1', PORT)
+    self.daemon = daemon
+    self.address = address
+    self.snapshot = {}
+    self.subscribers = set()
+    self.requests = 0
+    self._seen = None
+    self._ready = thrd.Event()
+    self.loop = asyncio.new_event_loop()
+    self.thread = thrd.Thread(target = self.loop.run_forever, name = 'api')
+    self.thread.daemon = True
+    self.thread.start()
+    asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+
+  async def _serve(self):
+    if isinstance(self.address, str):
+      if os.path.exists(self.address): os.remove(self.address)
+      self.server = await asyncio.start_unix_server(self._client, self.address)
+    else:
+      self.server = await asyncio.start_server(self._client, *self.address)
+    self.loop.create_task(self._watch())
+
+  def wait(self, timeout = None):
+    '''
+      Blocks until the first snapshot has been taken.
+
+      Returns: [Boolean] False if the timeout ran out first
+    '''
+    return self._ready.wait(timeout)
+
+  ##############################################################################
+  ## Snapshots                                                                ##
+  ##############################################################################
+  async def _ask(self, fn, *args, priority = scheduler.INTERACTIVE):
+    '''
+      Runs fn on the daemon's worker, as an interactive task by default. The
+      task is queued from an executor thread since bulk puts block while the
+      queue is full.
+
+      Returns: fn's result
+    '''
+    fut = concurrent.futures.Future()
+    await self.loop.run_in_executor(None, self.daemon._putTask,
+                                    functools.partial(self._answer, fut, fn,
+                                                      *args), priority)
+    return await asyncio.wrap_future(fut, loop = self.loop)
+
+  def _answer(self, fut, fn, *args):
+    try:
+      fut.set_result(fn(*args))
+    except Exception as e:
+      fut.set_exception(e)
+
+  def _takeSnapshot(self):
+    '''
+      Collects the daemon's state. Runs on the daemon's worker.
+
+      Returns: [Dict]
+    '''
+    d = self.daemon
+    self._seen = d.changes + 1  # This task is counted once it finishes
+    out = {'tournament': None, 'notified': d.notified}
+    if d.t != None:
+      t = d.t
+      now = d.clock.now()
+      out['tournament'] = {
+        'name': t.name, 'start': t.startdt.isoformat(),
+        'signup': t.signupdt.isoformat(), 'rlength_days': t.rlength.days,
+        'maxplayers': t.maxplayers, 'numrounds': t.numrounds,
+        'started': t.started, 'round': t.getRound(now),
+        'roundStr': t.getRoundStr(now),
+        'next': t.nextEvent(now).isoformat() if t.nextEvent(now) else None}
+    if d.results != None:
+      out['standings'] = d.results.standings()
+      out['pending'] = len(d.results.pending)
+      out['disputes'] = sorted(sorted(m.players)
+                               for m in d.results.disputes.values())
+    return out
+
+  async def _refresh(self):
+    '''
+      Waits until every task queued so far has run, then retakes the snapshot.
+      A bulk task only runs after everything queued before it, whatever its
+      priority (see scheduler.TaskQueue), so it serves as a barrier.
+    '''
+    snap = await self._ask(self._takeSnapshot, priority = scheduler.BULK)
+    if snap != self.snapshot:
+      self.snapshot = snap
+      self._push({'event': 'snapshot', 'snapshot': snap})
+
+  async def _watch(self):
+    '''
+      Retakes the snapshot whenever the daemon has run a task since the last
+      one, and pushes it to subscribers if it changed.
+    '''
+    while True:
+      if self.daemon.changes != self._seen:
+        try:
+          snap = await self._ask(self._takeSnapshot)
+        except Exception:
+          snap = self.snapshot
+        if snap != self.snapshot:
+          self.snapshot = snap
+          self._push({'event': 'snapshot', 'snapshot': snap})
+        self._ready.set()
+      await asyncio.sleep(INTERVAL)
+
+  def _push(self, msg):
+    '''
+      Sends a message to every subscriber, dropping those that fall too far
+      behind.
+    '''
+    data = (json.dumps(msg) + '\n').encode('utf-8')
+    for w in list(self.subscribers):
+      if w.transport.get_write_buffer_size() > MAX_BUFFER or w.is_closing():
+        self.subscribers.discard(w)
+        w.close()
+      else:
+        w.write(data)
+
+  ##############################################################################
+  ## Requests                                                                 ##
+  ##############################################################################
+  async def _client(self, reader, writer):
+    '''
+      Answers a connected client's requests until it disconnects.
+    '''
+    try:
+      while True:
+        line = await reader.readline()
+        if not line: break
+        req = None
+        try:
+          req = json.loads(line)
+          res = {'id': req.get('id'),
+                 'result': await self._handle(req, writer)}
+        except Exception as e:
+          res = {'id': req.get('id') if isinstance(req, dict) else None,
+                 'error': '{}: {}'.format(type(e).__name__, e)}
+        self.requests += 1
+        writer.write((json.dumps(res) + '\n').encode('utf-8'))
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      self.subscribers.discard(writer)
+      writer.close()
+
+  async def _handle(self, req, writer):
+    '''
+      Answers a single request.
+
+      Returns: JSON-friendly result
+    '''
+    d = self.daemon
+    cmd, args = req['cmd'], req.get('args', [])
+    t = self.snapshot.get('tournament')
+    if cmd == 'snapshot': return self.snapshot
+    if cmd == 'subscribe':
+      self.subscribers.add(writer)
+      return self.snapshot
+    if cmd == 'unsubscribe':
+      self.subscribers.discard(writer)
+      return True
+    if cmd == 'getTName': return t['name'] if t else False
+    if cmd == 'getRoundStr': return t['roundStr'] if t else 'No tournament'
+    if cmd == 'getMetricsLines': return d.getMetricsLines()
+    if cmd == 'seedPlayers':
+      return await self._ask(d.ratings.seed, list(args[0]))
+    if cmd not in ('initT', 'saveT', 'resolveMatch', 'addPairings',
+                   'notifyPairings', 'profileTasks', 'archiveT'):
+      raise ValueError('Unknown command ' + cmd)
+    await self.loop.run_in_executor(None, self._command, cmd, args)
+    await self._refresh()
+    return True
+
+  def _command(self, cmd, args):
+    '''
+      Queues a command on the daemon. Runs on an executor thread, as it
+      blocks while the daemon's queue is full.
+    '''
+    d = self.daemon
+    if cmd == 'initT':
+      name, start, days = args[:3]
+      d.initT(name, datetime.datetime.fromisoformat(start),
+              datetime.timedelta(days = days), *args[3:])
+    elif cmd == 'archiveT':
+      d.archiveT()
+    else:
+      getattr(d, cmd)(*args)
+
+class ApiClient:
+  '''
+    Blocking client of an ApiServer. Has the same read and command methods as
+    TDaemon, so a front end can use either.
+  '''
+  def __init__(self, address = None):
+    '''
+      Connects to a server.
+
+      Arguments:
+        address: [String] socket path, or ([String] host, [Int] port).
+          Defaults to SOCKET, or localhost:PORT without Unix sockets.
+    '''
+    if address == None:
+      address = SOCKET if hasattr(socket, 'AF_UNIX') else ('127.0.0.1', PORT)
+    if isinstance(address, str):
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.connect(address)
+    self.f = self.sock.makefile('rw', encoding = 'utf-8')
+    self._ids = 0
+    self.events = []
+
+  def call(self, cmd, *args):
+    '''
+      Sends a request and waits for its answer. Snapshots pushed in the
+      meantime are kept in events.
+
+      Returns: the result
+    '''
+    self._ids += 1
+    self.f.write(json.dumps({'id': self._ids, 'cmd': cmd,
+                             'args': list(args)}) + '\n')
+    self.f.flush()
+    while True:
+      msg = json.loads(self.f.readline())
+      if 'event' in msg:
+        self.events.append(msg)
+        continue
+      if 'error' in msg: raise RuntimeError(msg['error'])
+      return msg['result']
+
+  def subscribe(self):
+    '''
+      Subscribes to snapshot pushes.
+
+      Returns: generator of [Dict] snapshots, the current one first
+    '''
+    yield self.call('subscribe')
+    while True:
+      if self.events:
+        yield self.events.pop(0)['snapshot']
+        continue
+      line = self.f.readline()
+      if not line: return
+      yield json.loads(line)['snapshot']
+
+  def close(self):
+    self.f.close()
+    self.sock.close()
+
+  def getTName(self): return self.call('getTName')
+  def getRoundStr(self): return self.call('getRoundStr')
+  def getMetricsLines(self): return self.call('getMetricsLines')
+  def seedPlayers(self, players): return self.call('seedPlayers', list(players))
+  def saveT(self): return self.call('saveT')
+  def archiveT(self): return self.call('archiveT')
+
+  def initT(self, name, startdt, rlength, maxP = 0, started = False,
+            numRounds = 0):
+    return self.call('initT', name, startdt.isoformat(), rlength.days, maxP,
+                     started, numRounds)
+
+  def resolveMatch(self, player1, player2, winner):
+    return self.call('resolveMatch', player1, player2, winner)
+
+  def addPairings(self, round, pairs, byes = ()):
+    return self.call('addPairings', round, list(pairs), list(byes))
+
+  def notifyPairings(self, round, pairs, byes = ()):
+    return self.call('notifyPairings', round, list(pairs), list(byes))
+
+  def profileTasks(self, count = 1, match = None):
+    return self.call('profileTasks', count, match)
+
+if __name__ == '__main__':
+  server = ApiServer(tourny_daemon.TDaemon(),
+                     sys.argv[1] if len(sys.argv) > 1 else None)
+  print('Serving on', server.address)
+  while True: time.sleep(3600)
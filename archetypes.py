@@ -0,0 +1,202 @@
+import attacks
+import cardex
+import collections
+import numpy as np
+
+PERMUTATIONS = 128  # MinHash signature length
+BANDS = 32  # LSH bands of PERMUTATIONS / BANDS rows each
+THRESHOLD = 0.5  # Estimated similarity a deck needs to join a cluster
+MAX_COPIES = 64  # Copies of a card told apart in a deck's shingles
+
+class ArchetypeClusters:
+  '''
+    Incremental clustering of decklists into archetypes with MinHash and
+    locality sensitive hashing. A deck is the set of its (card, nth copy)
+    pairs, so the Jaccard similarity of two decks weighs card counts and a
+    couple of tech cards barely move it. Each deck's MinHash signature is cut
+    into bands, and only decks sharing a band are compared, so adding a deck
+    costs about the same whatever the number of decks already clustered.
+
+    A deck joins the cluster of its most similar candidate if their
+    estimated similarity reaches the threshold, or starts a new cluster.
+    Clusters are labelled with the most common known archetype
+    (`decks_archetypes`) among their decks, e.g. from the cardex decks.
+
+    Attributes:
+      threshold: [Float] estimated similarity needed to join a cluster.
+      signatures: [Dict] of deck key -> [numpy.ndarray] of uint32 signature.
+      clusters: [Dict] of deck key -> [Int] cluster id.
+      members: [List] of [Set] of deck keys, per cluster id.
+      labels: [List] of [collections.Counter] of known archetype ids, per
+        cluster id.
+      archetypeNames: [Dict] of archetype id -> [String] name.
+  '''
+  def __init__(self, permutations = PERMUTATIONS, bands = BANDS,
+               threshold = THRESHOLD, seed = 0, archetypeNames = None):
+    '''
+      Initializes empty clusters.
+
+      Arguments:
+        permutations: [Int] MinHash signature length, a multiple of bands.
+        bands: [Int] number of LSH bands.
+        threshold: [Float] estimated similarity needed to join a cluster.
+        seed: [Int] of the hash functions. Signatures are only comparable
+          between clusterings with the same seed.
+        archetypeNames: [Dict] of archetype id -> [String] name.
+    '''
+    rng = np.random.default_rng(seed)
+    self.a = rng.integers(1, 2 ** 63, permutations, dtype = np.uint64) | 1
+    self.b = rng.integers(0, 2 ** 63, permutations, dtype = np.uint64)
+    self.rows = permutations // bands
+    self.threshold = threshold
+    self.signatures = {}
+    self.clusters = {}
+    self.members = []
+    self.labels = []
+    self.known = {}
+    self.archetypeNames = archetypeNames or {}
+    self._buckets = [collections.defaultdict(list) for b in range(bands)]
+
+  @classmethod
+  def fromCardex(cls, conn = None, **kwargs):
+    '''
+      Clusters the decks of the cardex dump, whose archetypes then label the
+      clusters decks added later fall into.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+        kwargs: passed on to the constructor.
+
+      Returns: [ArchetypeClusters] with the cardex decks keyed by
+        ('cardex', [Int] deck_id)
+    '''
+    if conn == None: conn = cardex.connect()
+    kwargs.setdefault('archetypeNames', dict(conn.execute(
+                      'SELECT id, name FROM decks_archetypes')))
+    out = cls(**kwargs)
+    decks = collections.defaultdict(dict)
+    for deck, setId, number, qty in conn.execute('SELECT deck_id, set_id, '
+                                                 'card_number, quantity FROM '
+                                                 'decks_lists'):
+      decks[deck][(setId, number)] = decks[deck].get((setId, number), 0) + qty
+    for deck, archetype in conn.execute('SELECT deck_id, archetype_id '
+                                        'FROM decks_results ORDER BY deck_id'):
+      if deck in decks: out.add(('cardex', deck), decks[deck], archetype)
+    return out
+
+  def __len__(self):
+    return len(self.clusters)
+
+  def signature(self, counts):
+    '''
+      MinHash signature of a deck.
+
+      Arguments:
+        counts: [Dict] of ([Int] set_id, [Int] number) -> [Int] quantity, as
+          from decklist.Decklist.counts().
+
+      Returns: [numpy.ndarray] of uint32
+    '''
+    shingles = [attacks.cardKey(s, n) * MAX_COPIES + c
+                for (s, n), qty in counts.items()
+                for c in range(min(qty, MAX_COPIES))]
+    if not shingles: return np.full(len(self.a), 0xffffffff, dtype = np.uint32)
+    x = np.array(shingles, dtype = np.uint64)[:, None]
+    # Multiply-shift hashing: the products wrap modulo 2 ** 64
+    return ((x * self.a + self.b) >> np.uint64(32)).min(axis = 0) \
+           .astype(np.uint32)
+
+  def _bands(self, sig):
+    return [sig[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(len(self._buckets))]
+
+  def add(self, key, counts, archetype = 0):
+    '''
+      Clusters a deck. Adding a key again (e.g. a player resubmitting their
+      list) replaces its previous deck.
+
+      Arguments:
+        key: hashable deck key, e.g. the player's name.
+        counts: [Dict] of ([Int] set_id, [Int] number) -> [Int] quantity.
+        archetype: [Int] known archetype id of the deck, 0 if unknown.
+
+      Returns: [Int] cluster id
+    '''
+    if key in self.clusters: self.remove(key)
+    sig = self.signature(counts)
+    bands = self._bands(sig)
+    candidates = set()
+    for buckets, band in zip(self._buckets, bands):
+      candidates.update(buckets.get(band, ()))
+    best, bestSim = None, self.threshold
+    for other in candidates:
+      sim = np.count_nonzero(self.signatures[other] == sig) / len(sig)
+      if sim >= bestSim: best, bestSim = other, sim
+    if best == None:
+      cluster = len(self.members)
+      self.members.append(set())
+      self.labels.append(collections.Counter())
+    else:
+      cluster = self.clusters[best]
+    self.signatures[key] = sig
+    self.clusters[key] = cluster
+    self.members[cluster].add(key)
+    if archetype:
+      self.known[key] = archetype
+      self.labels[cluster][archetype] += 1
+    for buckets, band in zip(self._buckets, bands): buckets[band].append(key)
+    return cluster
+
+  def remove(self, key):
+    '''
+      Takes a deck out of its cluster.
+    '''
+    sig = self.signatures.pop(key)
+    cluster = self.clusters.pop(key)
+    self.members[cluster].discard(key)
+    archetype = self.known.pop(key, 0)
+    if archetype: self.labels[cluster][archetype] -= 1
+    for buckets, band in zip(self._buckets, self._bands(sig)):
+      buckets[band].remove(key)
+      if not buckets[band]: del buckets[band]
+
+  def archetype(self, key):
+    '''
+      Returns: [Int] the archetype id a deck's cluster is labelled with, 0 if
+        none of its decks has a known archetype
+    '''
+    label = +self.labels[self.clusters[key]]
+    return label.most_common(1)[0][0] if label else 0
+
+  def archetypes(self, keys = None):
+    '''
+      Labels decks, e.g. for TDaemon.archiveT().
+
+      Arguments:
+        keys: iterable of deck keys, or None for every deck.
+
+      Returns: [Dict] of deck key -> [Int] archetype id (0 if unknown)
+    '''
+    return {k: self.archetype(k) for k in (self.clusters if keys == None
+                                           else keys)}
+
+  def lines(self, keys = None, top = 5):
+    '''
+      Summarizes the clustering of some decks.
+
+      Arguments:
+        keys: iterable of deck keys, or None for every deck.
+        top: [Int] number of archetypes to list.
+
+      Returns: [List] of [String]
+    '''
+    keys = list(self.clusters if keys == None else keys)
+    labels = collections.Counter(self.archetypes(keys).values())
+    clusters = len({self.clusters[k] for k in keys})
+    out = ['Archetypes: {} decks in {} clusters, {:.0%} labelled'.format(
+           len(keys), clusters, 1 - labels[0] / max(len(keys), 1))]
+    for a, n in labels.most_common(top):
+      out.append('  {:<30}{:>6}'.format(self.archetypeNames.get(a, 'Unknown'),
+                                        n))
+    return out
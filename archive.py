@@ -0,0 +1,192 @@
+import datetime
+import json
+import numpy as np
+import os
+import re
+
+ARCHIVE_DIR = os.path.join('docs', 'archive')
+NO_WINNER = -1  # match_winner of a double loss
+
+# Column name -> dtype of every column file of a partition
+COLUMNS = {
+  'match_round': np.int16, 'match_player1': np.int32,
+  'match_player2': np.int32, 'match_winner': np.int32,
+  'standing_player': np.int32, 'standing_wins': np.int16,
+  'standing_losses': np.int16, 'standing_place': np.int32,
+  'player_archetype': np.int32,
+  'deck_player': np.int32, 'deck_card': np.int64, 'deck_quantity': np.uint8
+}
+
+def _slug(name):
+  return re.sub(r'\W+', '_', name).strip('_').lower()
+
+def archiveTournament(t, results, decks = None, archetypes = None,
+                      root = ARCHIVE_DIR):
+  '''
+    Writes a finished tournament to its own partition of the archive: one .npy
+    file per column, player names dictionary-encoded in players.txt, and the
+    tournament's settings in meta.json. Double losses are kept as matches won
+    by NO_WINNER.
+
+    Arguments:
+      t: [tournament.Tournament] that finished.
+      results: [results.ResultIngester] holding its matches and standings.
+      decks: [Dict] of player -> [decklist.Decklist], if decklists were taken.
+      archetypes: [Dict] of player -> [Int] archetype id, if known.
+      root: [String] directory of the archive.
+
+    Returns: [String] path of the partition written
+  '''
+  decks = {p.lower(): d for p, d in (decks or {}).items()}
+  archetypes = {p.lower(): a for p, a in (archetypes or {}).items()}
+  matches = results.conn.execute("SELECT round, player1, player2, winner FROM "
+                                 "matches WHERE tournament = ? AND status IN "
+                                 "('confirmed', 'double loss') ORDER BY round",
+                                 (results.tournament,)).fetchall()
+  standings = results.standings()
+  players = sorted({s[0] for s in standings} | set(decks) | set(archetypes))
+  code = {p: i for i, p in enumerate(players)}
+  cols = {
+    'match_round': [m[0] for m in matches],
+    'match_player1': [code[m[1]] for m in matches],
+    'match_player2': [code[m[2]] for m in matches],
+    'match_winner': [NO_WINNER if m[3] == None else code[m[3]]
+                     for m in matches],
+    'standing_player': [code[s[0]] for s in standings],
+    'standing_wins': [s[1] for s in standings],
+    'standing_losses': [s[2] for s in standings],
+    'standing_place': list(range(1, len(standings) + 1)),
+    'player_archetype': [archetypes.get(p, 0) for p in players],
+    'deck_player': [], 'deck_card': [], 'deck_quantity': []
+  }
+  for p, d in decks.items():
+    for (setId, number), qty in d.counts().items():
+      cols['deck_player'].append(code[p])
+      cols['deck_card'].append(setId * 1000 + number)
+      cols['deck_quantity'].append(qty)
+  path = os.path.join(root, '{}_{}'.format(t.startdt.strftime('%Y%m%d'),
+                                           _slug(t.name)))
+  os.makedirs(path, exist_ok = True)
+  for name, values in cols.items():
+    np.save(os.path.join(path, name + '.npy'),
+            np.array(values, dtype = COLUMNS[name]))
+  with open(os.path.join(path, 'players.txt'), 'w') as f:
+    f.write('\n'.join(players))
+  with open(os.path.join(path, 'meta.json'), 'w') as f:
+    json.dump({'name': t.name, 'start': t.startdt.isoformat(),
+               'end': t.timeline[-1].isoformat(),
+               'rlength_days': t.rlength.days, 'numrounds': t.numrounds,
+               'maxplayers': t.maxplayers, 'winner': t.winner}, f)
+  return path
+
+class Partition:
+  '''
+    One archived tournament. Columns are memory-mapped on first use, so a
+    query only reads the columns it touches.
+
+    Attributes:
+      path: [String] directory of the partition.
+      meta: [Dict] of the tournament's settings (see archiveTournament()).
+      start: [datetime.datetime] the tournament started.
+  '''
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as f: self.meta = json.load(f)
+    self.start = datetime.datetime.fromisoformat(self.meta['start'])
+    self._cols = {}
+    self._players = None
+
+  def column(self, name):
+    '''
+      Returns: read-only memory-mapped [numpy.ndarray] of a column
+    '''
+    if name not in self._cols:
+      self._cols[name] = np.load(os.path.join(self.path, name + '.npy'),
+                                 mmap_mode = 'r')
+    return self._cols[name]
+
+  def players(self):
+    '''
+      Returns: [Dict] of lowercased player name -> player code
+    '''
+    if self._players == None:
+      with open(os.path.join(self.path, 'players.txt')) as f:
+        self._players = {p: i for i, p in enumerate(f.read().split('\n'))
+                         if p}
+    return self._players
+
+class Archive:
+  '''
+    Every archived tournament, one partition each, oldest first.
+
+    Attributes:
+      root: [String] directory of the archive.
+      partitions: [List] of [Partition].
+  '''
+  def __init__(self, root = ARCHIVE_DIR):
+    self.root = root
+    self.partitions = []
+    if os.path.isdir(root):
+      for d in sorted(os.listdir(root)):
+        if os.path.isfile(os.path.join(root, d, 'meta.json')):
+          self.partitions.append(Partition(os.path.join(root, d)))
+    self.partitions.sort(key = lambda p: p.start)
+
+  def since(self, dt):
+    '''
+      Returns: [List] of the [Partition]s of tournaments started at or after dt
+    '''
+    return [p for p in self.partitions if p.start >= dt]
+
+  def playerRecord(self, player):
+    '''
+      A player's match record across every archived tournament. Only the
+      match columns of tournaments they played in are read.
+
+      Arguments:
+        player: [String] name of the player.
+
+      Returns: [List] of ([String] tournament name, [Int] wins, [Int] losses,
+        [Int] final place or 0) tuples, plus a final ('Total', wins, losses,
+        0) entry
+    '''
+    player = player.lower()
+    out = []
+    for p in self.partitions:
+      code = p.players().get(player)
+      if code == None: continue
+      p1, p2 = p.column('match_player1'), p.column('match_player2')
+      mine = (p1 == code) | (p2 == code)
+      wins = int(np.count_nonzero(p.column('match_winner')[mine] == code))
+      sp = p.column('standing_player')
+      place = p.column('standing_place')[sp == code]
+      out.append((p.meta['name'], wins, int(np.count_nonzero(mine)) - wins,
+                  int(place[0]) if len(place) else 0))
+    out.append(('Total', sum(r[1] for r in out), sum(r[2] for r in out), 0))
+    return out
+
+  def archetypeWinRate(self, archetype, since = None):
+    '''
+      Match win rate of an archetype, optionally only over tournaments started
+      since a given date (e.g. the last 6 months). Mirror matches are left
+      out.
+
+      Arguments:
+        archetype: [Int] archetype id.
+        since: [datetime.datetime], or None for the whole archive.
+
+      Returns: ([Int] wins, [Int] matches)
+    '''
+    parts = self.partitions if since == None else self.since(since)
+    wins = games = 0
+    for p in parts:
+      arch = np.asarray(p.column('player_archetype'))
+      if not np.any(arch == archetype): continue
+      a1 = arch[p.column('match_player1')] == archetype
+      a2 = arch[p.column('match_player2')] == archetype
+      one = a1 ^ a2
+      w = np.asarray(p.column('match_winner'))
+      winner = (w != NO_WINNER) & (arch[w.clip(0)] == archetype)
+      wins += int(np.count_nonzero(one & winner))
+      games += int(np.count_nonzero(one))
+    return wins, games
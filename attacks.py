@@ -0,0 +1,82 @@
+import cardex
+import numpy as np
+
+class AttackTable:
+  '''
+    Column arrays over cards_attacks, one entry per attack, so that attack
+    based rules and statistics are whole-array operations instead of decoding
+    cards.attacks card by card.
+
+    Attributes:
+      setId: [numpy.ndarray] of int32 set_id of each attack's card.
+      number: [numpy.ndarray] of int16 collector number of each attack's card.
+      slot: [numpy.ndarray] of int8 position of the attack on its card.
+      cost: [numpy.ndarray] of uint8 energy counts, shape (attacks,
+        len(cardex.ENERGY_SYMBOLS)), columns in cardex.ENERGY_SYMBOLS order.
+      converted: [numpy.ndarray] of uint8 converted energy cost of each attack.
+      damage: [numpy.ndarray] of int16 base damage of each attack.
+      cardKey: [numpy.ndarray] of int64 set_id * 1000 + number of each
+        attack's card, for matching against other card arrays.
+  '''
+  def __init__(self, conn = None):
+    '''
+      Loads cards_attacks into arrays.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+    '''
+    if conn == None: conn = cardex.connect()
+    rows = conn.execute('SELECT * FROM cards_attacks '
+                        'ORDER BY set_id, number, slot').fetchall()
+    n = len(cardex.ENERGY_SYMBOLS)
+    data = np.array(rows, dtype = np.int32).reshape(-1, n + 5)
+    self.setId = data[:, 0].copy()
+    self.number = data[:, 1].astype(np.int16)
+    self.slot = data[:, 2].astype(np.int8)
+    self.cost = data[:, 3:3 + n].astype(np.uint8)
+    self.converted = data[:, 3 + n].astype(np.uint8)
+    self.damage = data[:, 4 + n].astype(np.int16)
+    self.cardKey = cardKey(self.setId, self.number)
+
+  def __len__(self):
+    return len(self.slot)
+
+  def perCard(self, values, ufunc = np.maximum):
+    '''
+      Reduces a per-attack array to one value per card.
+
+      Arguments:
+        values: [numpy.ndarray] with one entry per attack.
+        ufunc: [numpy.ufunc] to reduce with. Defaults to the maximum.
+
+      Returns: ([numpy.ndarray] of the card keys, [numpy.ndarray] of the
+        reduced values), both sorted by card key
+    '''
+    keys, starts = np.unique(self.cardKey, return_index = True)
+    return keys, ufunc.reduceat(values, starts)
+
+  def cardsWhere(self, mask):
+    '''
+      Returns: [numpy.ndarray] of the card keys having at least one attack for
+        which mask is True.
+    '''
+    return np.unique(self.cardKey[mask])
+
+  def costsMoreThan(self, n):
+    '''
+      Card keys with an attack whose converted energy cost is over n, e.g. for a
+      "no attacks costing more than 3 energy" rule.
+
+      Returns: [numpy.ndarray]
+    '''
+    return self.cardsWhere(self.converted > n)
+
+def cardKey(setId, number):
+  '''
+    Packs set_id and collector number (scalars or arrays) into a single integer
+    key. Collector numbers never reach 1000.
+
+    Returns: [Int] or [numpy.ndarray] of int64
+  '''
+  return np.asarray(setId, dtype = np.int64) * 1000 + number
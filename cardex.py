@@ -0,0 +1,513 @@
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+
+CARDEX_DIR = os.path.join('docs', 'pokeplayer-master', 'database', 'cardex')
+# Imported from the dumps on first use. Not the empty ptcgo_card_db shipped
+# with pokeplayer, which stays untouched.
+CARD_DB = os.path.join('docs', 'cards.db')
+STRUCTURE = os.path.join(CARDEX_DIR, 'cardex_structure.sql')
+DUMPS = (os.path.join(CARDEX_DIR, 'cardex_data_1.sql'),
+         os.path.join(CARDEX_DIR, 'cardex_data_2.sql'))
+
+POKEDEX_DIR = os.path.join('docs', 'pokeplayer-master', 'database', 'pokedex')
+POKEDEX_DUMPS = tuple(os.path.join(POKEDEX_DIR, 'pokedex_data_{}.sql'.format(i))
+                      for i in range(1, 5))
+
+ENGLISH = 2  # local_language_id of English names
+POKEMON_CATEGORIES = range(1, 100)  # `categories`.`id` of Pokemon cards
+
+# The pokedex has no legendary flag, so legendary and mythical species
+# (generations 1 to 6) are listed by `pokemon_species`.`identifier`.
+LEGENDARY = (
+  'articuno', 'zapdos', 'moltres', 'mewtwo', 'mew', 'raikou', 'entei',
+  'suicune', 'lugia', 'ho-oh', 'celebi', 'regirock', 'regice', 'registeel',
+  'latias', 'latios', 'kyogre', 'groudon', 'rayquaza', 'jirachi', 'deoxys',
+  'uxie', 'mesprit', 'azelf', 'dialga', 'palkia', 'heatran', 'regigigas',
+  'giratina', 'cresselia', 'phione', 'manaphy', 'darkrai', 'shaymin',
+  'arceus', 'victini', 'cobalion', 'terrakion', 'virizion', 'tornadus',
+  'thundurus', 'reshiram', 'zekrom', 'landorus', 'kyurem', 'keldeo',
+  'meloetta', 'genesect', 'xerneas', 'yveltal', 'zygarde', 'diancie', 'hoopa',
+  'volcanion')
+
+# Words naming a forme ahead of (or after) the species in card identifiers,
+# e.g. 'Heat Rotom' or 'Wormadam Sandy Cloak', whose pokedex formes are named
+# species-forme (rotom-heat, wormadam-sandy)
+FORME_WORDS = ('plant', 'sandy', 'trash', 'fan', 'frost', 'heat', 'mow',
+               'wash')
+
+# Species with X and Y Megas, which the card identifiers don't tell apart
+# ('m_charizard-ex'), by the cardex `types`.`identifier` of the X Mega's cards:
+# the X Mega's cards have its second type, the Y Mega's the species' own
+MEGA_X_TYPES = {'charizard': 'dragon', 'mewtwo': 'fighting'}
+
+# Energy symbols used in cards.attacks, in `types`.`id` order (1 to 11)
+ENERGY_SYMBOLS = 'frglpwdmcny'
+
+_createRe = re.compile(r'CREATE TABLE IF NOT EXISTS `(\w+)` \((.*?)\n\)[^;]*;',
+                       re.S)
+_primaryRe = re.compile(r'PRIMARY KEY \(([^)]*)\)')
+_insertRe = re.compile(r'INSERT INTO `(\w+)` \(([^)]*)\) VALUES\s*')
+_tokenRe = re.compile(r"'((?:[^'\\]|\\.|'')*)'|(NULL)|(-?\d+\.\d+)|(-?\d+)|"
+                      r"([(),;])")
+_escapes = {'n': '\n', 'r': '\r', 't': '\t', '0': '\0', 'Z': '\x1a'}
+_escapeRe = re.compile(r"\\(.)|''")
+_attackRe = re.compile(r'([a-z_]*)(\d+)')
+
+def _unescape(s):
+  '''
+    Undoes MySQL string escaping (backslash escapes and doubled quotes).
+
+    Returns: [String]
+  '''
+  if '\\' not in s and "''" not in s: return s
+  return _escapeRe.sub(lambda m: _escapes.get(m.group(1), m.group(1))
+                       if m.group(1) != None else "'", s)
+
+def _sqliteCreate(name, body):
+  '''
+    Converts the body of a MySQL CREATE TABLE statement into SQLite's dialect.
+    Secondary indexes (KEY, UNIQUE KEY, FULLTEXT KEY) are dropped; only the
+    primary key is kept.
+
+    Arguments:
+      name: [String] name of the table.
+      body: [String] of everything between the statement's parentheses.
+
+    Returns: [String]
+  '''
+  lines = []
+  for line in body.strip().split('\n'):
+    line = line.strip().rstrip(',')
+    if re.match(r'(UNIQUE |FULLTEXT )?KEY ', line): continue
+    line = re.sub(r' unsigned| AUTO_INCREMENT', '', line)
+    lines.append(line)
+  return 'CREATE TABLE IF NOT EXISTS `{}` (\n  {}\n)'.format(name,
+                                                           ',\n  '.join(lines))
+
+def readStructure(path = STRUCTURE):
+  '''
+    Reads the CREATE TABLE statements of a MySQL structure dump.
+
+    Arguments:
+      path: [String] of the structure dump.
+
+    Returns: [Dict] of table name -> SQLite CREATE TABLE [String]
+  '''
+  with open(path, encoding = 'utf-8') as f: sql = f.read()
+  return {m.group(1): _sqliteCreate(m.group(1), m.group(2))
+          for m in _createRe.finditer(sql)}
+
+def readInserts(path, tables = None):
+  '''
+    Streams the rows of every INSERT statement in a MySQL data dump.
+
+    Arguments:
+      path: [String] of the data dump.
+      tables: collection of [String] names of the only tables to read, or
+        None for every table. The rows of other tables aren't parsed at all.
+
+    Returns: generator of ([String] table, [Tuple] of column names, [List] of
+      row [Tuple]s), one per INSERT statement
+  '''
+  with open(path, encoding = 'utf-8') as f: sql = f.read()
+  pos = 0
+  while True:
+    m = _insertRe.search(sql, pos)
+    if m == None: return
+    if tables != None and m.group(1) not in tables:
+      pos = m.end()
+      continue
+    cols = tuple(c.strip().strip('`') for c in m.group(2).split(','))
+    rows, row = [], None
+    for t in _tokenRe.finditer(sql, m.end()):
+      s, null, flt, num, punct = t.groups()
+      if punct == '(': row = []
+      elif punct == ')':
+        rows.append(tuple(row))
+        row = None
+      elif punct == ';':
+        pos = t.end()
+        break
+      elif punct == ',': continue
+      elif s != None: row.append(_unescape(s))
+      elif null: row.append(None)
+      elif flt: row.append(float(flt))
+      else: row.append(int(num))
+    else:
+      pos = len(sql)
+    yield m.group(1), cols, rows
+
+def primaryKeys(path = STRUCTURE):
+  '''
+    Reads the primary key columns of every table of a MySQL structure dump.
+
+    Arguments:
+      path: [String] of the structure dump.
+
+    Returns: [Dict] of table name -> [Tuple] of column names
+  '''
+  with open(path, encoding = 'utf-8') as f: sql = f.read()
+  out = {}
+  for m in _createRe.finditer(sql):
+    pk = _primaryRe.search(m.group(2))
+    out[m.group(1)] = tuple(c.strip().strip('`') for c in pk.group(1).split(','))
+  return out
+
+def _rowHash(row):
+  return hashlib.blake2b(repr(row).encode('utf-8'), digest_size = 8).hexdigest()
+
+def _fileHash(path):
+  with open(path, 'rb') as f:
+    return hashlib.blake2b(f.read(), digest_size = 8).hexdigest()
+
+def dataVersion(conn, tables = None):
+  '''
+    Returns the version stamp of the card data, which goes up every time an
+    import or refresh changes it. Caches built from the data should store the
+    stamp and rebuild when it changes.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+      tables: iterable of [String] table names to only track changes to those
+        tables, or None for any change.
+
+    Returns: [Int] if tables is None, else [Tuple] of [Int], one per table
+  '''
+  if conn.execute("SELECT 1 FROM sqlite_master "
+                  "WHERE name = 'cardex_meta'").fetchone() == None:
+    return 0 if tables == None else tuple(0 for t in tables)
+  versions = dict(conn.execute('SELECT key, value FROM cardex_meta'))
+  if tables == None: return int(versions.get('version', 0))
+  return tuple(int(versions.get('version:' + t, 0)) for t in tables)
+
+def refresh(db = CARD_DB, structure = STRUCTURE, dumps = DUMPS):
+  '''
+    Brings the card database up to date with new dumps without reimporting
+    everything. Every row is hashed by primary key and compared with the
+    hashes stored by the last import or refresh, and only inserts, updates
+    and deletes are applied. Derived indexes (see DERIVED) are only rebuilt
+    when one of their source tables or files changed (files are hashed
+    whole), and the version stamps of the changed tables (see dataVersion())
+    are bumped.
+
+    Arguments:
+      db: [String] path of the SQLite database to update.
+      structure: [String] path of the structure dump.
+      dumps: iterable of [String] paths of the new data dumps.
+
+    Returns: [Dict] of changed table name -> ([Int] inserts, [Int] updates,
+      [Int] deletes)
+  '''
+  conn = sqlite3.connect(db)
+  keys = primaryKeys(structure)
+  new = {}
+  for path in dumps:
+    for table, cols, rows in readInserts(path):
+      idx = [cols.index(k) for k in keys[table]]
+      rowsByKey = new.setdefault(table, (cols, {}))[1]
+      for row in rows: rowsByKey[json.dumps([row[i] for i in idx])] = row
+  files = {s: _fileHash(s) for name, sources, build in DERIVED
+           for s in sources if s not in keys}
+  changes = {}
+  with conn:
+    conn.execute('CREATE TABLE IF NOT EXISTS cardex_meta (key TEXT PRIMARY '
+                 'KEY, value TEXT)')
+    conn.execute('CREATE TABLE IF NOT EXISTS cardex_rows (tbl TEXT, pk TEXT, '
+                 'hash TEXT, PRIMARY KEY (tbl, pk))')
+    for create in readStructure(structure).values(): conn.execute(create)
+    for table, (cols, rows) in new.items():
+      old = dict(conn.execute('SELECT pk, hash FROM cardex_rows WHERE tbl = ?',
+                              (table,)))
+      hashes = {pk: _rowHash(row) for pk, row in rows.items()}
+      upserts = [pk for pk, h in hashes.items() if old.get(pk) != h]
+      deletes = [pk for pk in old if pk not in rows]
+      if not upserts and not deletes: continue
+      inserted = sum(pk not in old for pk in upserts)
+      changes[table] = (inserted, len(upserts) - inserted, len(deletes))
+      conn.executemany('DELETE FROM `{}` WHERE {}'.format(table, ' AND '.join(
+                       '`{}` = ?'.format(k) for k in keys[table])),
+                       [json.loads(pk) for pk in deletes])
+      conn.executemany('INSERT OR REPLACE INTO `{}` ({}) VALUES ({})'.format(
+                       table, ', '.join('`{}`'.format(c) for c in cols),
+                       ', '.join('?' * len(cols))),
+                       [rows[pk] for pk in upserts])
+      conn.executemany('DELETE FROM cardex_rows WHERE tbl = ? AND pk = ?',
+                       [(table, pk) for pk in deletes])
+      conn.executemany('INSERT OR REPLACE INTO cardex_rows VALUES (?, ?, ?)',
+                       [(table, pk, hashes[pk]) for pk in upserts])
+    old = dict(conn.execute("SELECT key, value FROM cardex_meta "
+                            "WHERE key LIKE 'hash:%'"))
+    changedFiles = {f for f, h in files.items() if old.get('hash:' + f) != h}
+    if changes or changedFiles:
+      version = dataVersion(conn) + 1
+      conn.executemany('INSERT OR REPLACE INTO cardex_meta VALUES (?, ?)',
+                       [('version', version)] +
+                       [('version:' + t, version) for t in changes] +
+                       [('hash:' + f, files[f]) for f in changedFiles])
+  for name, sources, build in DERIVED:
+    missing = conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?',
+                           (name,)).fetchone() == None
+    if missing or any(s in changes or s in changedFiles for s in sources):
+      build(conn)
+  return changes
+
+def importDump(db = CARD_DB, structure = STRUCTURE, dumps = DUMPS):
+  '''
+    (Re)builds the SQLite card database from the pokeplayer MySQL dumps. Every
+    table is dropped and recreated. The version stamp keeps counting up from
+    where it was, so caches of the old data are still invalidated.
+
+    Arguments:
+      db: [String] path of the SQLite database to write.
+      structure: [String] path of the structure dump.
+      dumps: iterable of [String] paths of the data dumps.
+
+    Returns: [sqlite3.Connection] to the rebuilt database
+  '''
+  conn = sqlite3.connect(db)
+  with conn:
+    for name in readStructure(structure):
+      conn.execute('DROP TABLE IF EXISTS `{}`'.format(name))
+    conn.execute('DROP TABLE IF EXISTS cardex_rows')
+  refresh(db, structure, dumps)
+  return conn
+
+def decodeAttacks(packed):
+  '''
+    Decodes a packed cards.attacks string. Each attack is its energy cost as
+    one ENERGY_SYMBOLS letter per energy ('_' for a free attack) followed by
+    its base damage divided by 10, so 'www004wwww005' is a 40 damage attack
+    costing 3 Water and a 50 damage one costing 4 Water.
+
+    Arguments:
+      packed: [String] from cards.attacks (None or '' for no attacks).
+
+    Returns: [List] of ([List] of [Int] energy counts, one per
+      ENERGY_SYMBOLS entry, [Int] base damage) tuples, one per attack
+  '''
+  out = []
+  for cost, damage in _attackRe.findall(packed or ''):
+    counts = [0] * len(ENERGY_SYMBOLS)
+    for c in cost:
+      if c != '_': counts[ENERGY_SYMBOLS.index(c)] += 1
+    out.append((counts, int(damage) * 10))
+  return out
+
+def buildAttackTable(conn):
+  '''
+    (Re)builds cards_attacks, one row per attack with its per-type energy cost
+    counts, converted energy cost and base damage, so that cards.attacks only
+    has to be decoded once per import.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+  '''
+  costCols = ['cost_' + c for c in ENERGY_SYMBOLS]
+  with conn:
+    conn.execute('DROP TABLE IF EXISTS cards_attacks')
+    conn.execute('CREATE TABLE cards_attacks (set_id int(11) NOT NULL, '
+                 'number smallint(6) NOT NULL, slot tinyint(4) NOT NULL, ' +
+                 ', '.join(c + ' tinyint(4) NOT NULL' for c in costCols) +
+                 ', converted_cost tinyint(4) NOT NULL, '
+                 'damage smallint(6) NOT NULL, '
+                 'PRIMARY KEY (set_id, number, slot))')
+    rows = []
+    for setId, number, packed in conn.execute('SELECT set_id, number, attacks '
+                                              'FROM cards'):
+      for slot, (counts, damage) in enumerate(decodeAttacks(packed)):
+        rows.append([setId, number, slot] + counts + [sum(counts), damage])
+    conn.executemany('INSERT INTO cards_attacks VALUES ({})'.format(
+                     ', '.join('?' * (len(costCols) + 5))), rows)
+
+_speciesTokenRe = re.compile(r'[a-z0-9]+')
+
+def _speciesKey(name):
+  return ''.join(_speciesTokenRe.findall(name.lower().replace('\u2640', '-f')
+                                         .replace('\u2642', '-m')))
+
+def resolveSpecies(identifier, lookup, cardType = None):
+  '''
+    Finds the species of a Pokemon card from its identifier, e.g.
+    'dragonite-ex', 'm_venusaur-ex', 'Houndoom G', 'giovanni_s_magikarp' or
+    'deoxys_attack_forme'. The longest run of words naming a species or forme
+    wins, so card suffixes (EX, G, FB, LV.X...) and owner or dark/light
+    prefixes are skipped, and a leading M stands for Mega. A FORME_WORDS word
+    ahead of the species ('Heat Rotom') names its forme, and the card's type
+    tells X and Y Megas apart (see MEGA_X_TYPES). Formes missing from the
+    pokedex fall back to their base species. Misspelled names are matched to
+    the closest species name.
+
+    Arguments:
+      identifier: [String] `cards`.`identifier`.
+      lookup: [Dict] of squashed name (see _speciesKey()) -> [Int]
+        `pokemon_species`.`id`, formes included.
+      cardType: [String] cardex `types`.`identifier` of the card's first
+        type, or None.
+
+    Returns: [Int] species (or forme) id, or 0 if none was found
+  '''
+  words = _speciesTokenRe.findall(identifier.lower().replace('\u2640', '-f')
+                                  .replace('\u2642', '-m'))
+  if words and words[0] in ('m', 'mega'): words[0] = 'mega'
+  words = [{'female': 'f', 'male': 'm'}.get(w, w) for w in words
+           if w != 'cloak']
+  for i in range(len(words)):
+    for j in range(len(words), i, -1):
+      key = ''.join(words[i:j])
+      if key not in lookup: continue
+      if i > 0 and words[i - 1] in FORME_WORDS:
+        return lookup.get(key + words[i - 1], lookup[key])
+      if i == 1 and words[0] == 'mega' and key in MEGA_X_TYPES:
+        xy = 'x' if cardType == MEGA_X_TYPES[key] else 'y'
+        return lookup.get('mega' + key + xy, lookup[key])
+      return lookup[key]
+  close = difflib.get_close_matches(''.join(words), lookup, 1, 0.8)
+  return lookup[close[0]] if close else 0
+
+def buildSpeciesTable(conn, dumps = POKEDEX_DUMPS):
+  '''
+    (Re)builds cards_species, which joins every card of `cards` to its
+    pokedex species once, so species based rules don't need the pokedex at
+    query time. Every card gets a row (all zeros for Trainers, Energy and
+    unresolved cards) with the base species, the forme (Megas, Primals,
+    Deoxys formes...), the base species' generation, the forme's types in
+    the pokedex's `types` ids, and whether the species is legendary.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+      dumps: iterable of [String] paths of the pokedex data dumps.
+  '''
+  data = {}
+  for path in dumps:
+    for table, cols, rows in readInserts(path, ('pokemon_species',
+                                                'pokemon_names',
+                                                'pokemon_types')):
+      data.setdefault(table, []).extend(dict(zip(cols, r)) for r in rows)
+  species = {r['id']: r for r in data['pokemon_species']}
+  lookup = {_speciesKey(r['identifier']): r['id'] for r in species.values()}
+  for r in data['pokemon_names']:
+    if r['local_language_id'] == ENGLISH and r['name'] != None:
+      lookup.setdefault(_speciesKey(r['name']), r['pokemon_id'])
+  types = {}
+  for r in data['pokemon_types']:
+    if r['slot'] in (1, 2):
+      types.setdefault(r['pokemon_id'], [0, 0])[r['slot'] - 1] = r['type_id']
+  legendary = {_speciesKey(n) for n in LEGENDARY}
+  cardTypes = dict(conn.execute('SELECT id, identifier FROM types'))
+  rows = []
+  for ident, setId, number, category, type1 in conn.execute(
+      'SELECT identifier, set_id, number, category_id, type1_id FROM cards'):
+    form = resolveSpecies(ident, lookup, cardTypes.get(type1)) \
+           if category in POKEMON_CATEGORIES else 0
+    base = form % 100000  # Formes are numbered 100000 * n + base species
+    if base not in species:
+      rows.append((setId, number, 0, 0, 0, 0, 0, 0))
+      continue
+    t1, t2 = types.get(form, types.get(base, [0, 0]))
+    rows.append((setId, number, base, form if form != base else 0,
+                 species[base]['generation_id'], t1, t2,
+                 int(_speciesKey(species[base]['identifier']) in legendary)))
+  with conn:
+    conn.execute('DROP TABLE IF EXISTS cards_species')
+    conn.execute('CREATE TABLE cards_species (set_id int(11) NOT NULL, '
+                 'number smallint(6) NOT NULL, species_id int(11) NOT NULL, '
+                 'form_id int(11) NOT NULL, generation_id int(11) NOT NULL, '
+                 'type1_id int(11) NOT NULL, type2_id int(11) NOT NULL, '
+                 'legendary tinyint(1) NOT NULL, '
+                 'PRIMARY KEY (set_id, number))')
+    conn.executemany('INSERT INTO cards_species VALUES (?, ?, ?, ?, ?, ?, ?, '
+                     '?)', rows)
+
+def buildSearchIndex(conn):
+  '''
+    (Re)builds cards_fts, an FTS5 full-text index over the name and rules text
+    of every row of cards_names (every local_language_id). This stands in for
+    the FULLTEXT keys of the MySQL schema, which SQLite can't declare.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+  '''
+  with conn:
+    conn.execute('DROP TABLE IF EXISTS cards_fts')
+    conn.execute("CREATE VIRTUAL TABLE cards_fts USING fts5(name, text, "
+                 "set_id UNINDEXED, number UNINDEXED, "
+                 "local_language_id UNINDEXED, "
+                 "tokenize = 'unicode61 remove_diacritics 2')")
+    conn.execute('INSERT INTO cards_fts (name, text, set_id, number, '
+                 'local_language_id) SELECT name, text, set_id, number, '
+                 'local_language_id FROM cards_names')
+    conn.execute("INSERT INTO cards_fts (cards_fts) VALUES ('optimize')")
+
+def searchCards(conn, query, column = None, lang = None, limit = 25):
+  '''
+    Ranked full-text search over card names and rules text, best match first.
+    Words in a plain query must all appear (in any order); use FTS5 syntax for
+    anything else, e.g. '"discard your hand"' for a phrase, 'draw OR search',
+    or 'juniper*' for a prefix.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+      query: [String] FTS5 query.
+      column: [String] 'name' or 'text' to only search that column, or None to
+        search both.
+      lang: [Int] local_language_id to restrict the results to, or None for
+        every language.
+      limit: [Int] maximum number of results.
+
+    Returns: [List] of ([Int] set_id, [Int] number, [Int] local_language_id,
+      [String] name, [String] snippet of the matching text) tuples
+  '''
+  if column != None: query = '{}: ({})'.format(column, query)
+  sql = ("SELECT set_id, number, local_language_id, name, "
+         "snippet(cards_fts, 1, '[', ']', '...', 12) FROM cards_fts "
+         "WHERE cards_fts MATCH ?")
+  args = [query]
+  if lang != None:
+    sql += ' AND local_language_id = ?'
+    args.append(lang)
+  sql += ' ORDER BY bm25(cards_fts, 10.0, 1.0) LIMIT ?'
+  args.append(limit)
+  return conn.execute(sql, args).fetchall()
+
+def connect(db = CARD_DB):
+  '''
+    Connects to the card database, importing the dumps first if it is empty.
+
+    Arguments:
+      db: [String] path of the SQLite database.
+
+    Returns: [sqlite3.Connection]
+  '''
+  conn = sqlite3.connect(db)
+  if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'cards'").fetchone():
+    for name, sources, build in DERIVED:
+      if not conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?',
+                          (name,)).fetchone():
+        build(conn)
+    return conn
+  conn.close()
+  return importDump(db)
+
+# Derived indexes: (name, source tables and files, function rebuilding it from
+# conn)
+DERIVED = (('cards_fts', ('cards_names',), buildSearchIndex),
+           ('cards_attacks', ('cards',), buildAttackTable),
+           ('cards_species', ('cards',) + POKEDEX_DUMPS, buildSpeciesTable))
+
+if __name__ == '__main__':
+  # python cardex.py import|refresh [data dumps...]
+  cmd = sys.argv[1] if len(sys.argv) > 1 else 'refresh'
+  dumps = sys.argv[2:] or DUMPS
+  if cmd == 'import':
+    importDump(dumps = dumps)
+    print('Imported, version', dataVersion(connect()))
+  else:
+    for table, (ins, upd, dels) in sorted(refresh(dumps = dumps).items()):
+      print('{}: {} inserted, {} updated, {} deleted'.format(table, ins, upd,
+                                                              dels))
+    print('Version', dataVersion(connect()))
@@ -0,0 +1,329 @@
+'''
+  Record/replay layer for every reddit call the bot makes. A Recorder wraps a
+  real reddit instance and writes each call, its result and how long it took
+  to a gzipped JSON lines cassette. A Player stands in for reddit and serves
+  the same results offline, optionally sleeping for the recorded durations
+  (scaled by a speed factor), so runs can be benchmarked and bisected without
+  the network.
+
+  Calls are matched on the object they were made on, the method name and the
+  arguments, each in the order they were recorded, so calls made from
+  several threads (e.g. the notifier) still replay correctly. Attribute reads
+  on the objects reddit returns are recorded the same way, when they are
+  made, so recording never changes what the bot sees (or fetches).
+
+  Usage: python cassette.py <cassette> to summarize a cassette.
+'''
+import collections
+import gzip
+import json
+import sys
+import threading as thrd
+import time
+import urllib.error
+
+VERSION = 2
+# Version 1 cassettes copied a fixed set of attributes of every returned
+# object up front; their copies are still served in replay.
+READABLE = (1, 2)
+
+# Prefix of the method name of recorded attribute reads
+ATTR = '@'
+
+# Exceptions that are raised again as themselves in replay, by name
+ERRORS = {'URLError': urllib.error.URLError}
+
+# Credentials never written to a cassette: positional arguments by method,
+# and keyword arguments by name. Replay matches on the redacted values, so a
+# cassette replays without the real secrets.
+SECRET_ARGS = {'login': (1,)}
+SECRET_KWARGS = ('password', 'client_secret')
+REDACTED = '<redacted>'
+
+class CassetteMiss(Exception):
+  '''
+    Raised in replay when a call doesn't match anything left on the cassette.
+  '''
+  pass
+
+class ReplayedError(Exception):
+  '''
+    Raised in replay for a recorded exception that isn't in ERRORS.
+  '''
+  pass
+
+def _read(path):
+  '''
+    Reads the calls of a cassette. Cassettes cut short by a crash are read up
+    to their last complete call.
+
+    Returns: generator of [Dict] calls
+  '''
+  with gzip.open(path, 'rt', encoding = 'utf-8') as f:
+    try:
+      header = json.loads(f.readline())
+      if header.get('cassette') not in READABLE:
+        raise ValueError('Unsupported cassette: ' + path)
+      for line in f:
+        if line.endswith('\n'): yield json.loads(line)
+    except EOFError:
+      pass
+
+def _redact(method, args, kwargs):
+  '''
+    Encodes a call's arguments (see _arg()) with credentials replaced by
+    REDACTED.
+
+    Returns: ([List] of args, [Dict] of kwargs)
+  '''
+  secret = SECRET_ARGS.get(method, ())
+  args = [REDACTED if i in secret else _arg(a) for i, a in enumerate(args)]
+  kwargs = {k: REDACTED if k in SECRET_KWARGS else _arg(v)
+            for k, v in kwargs.items()}
+  return args, kwargs
+
+def _key(handle, method, args, kwargs):
+  return json.dumps([handle, method, args, kwargs], sort_keys = True,
+                    separators = (',', ':'))
+
+class Recorder:
+  '''
+    Wraps a reddit instance, recording every method call made on it and on
+    the objects it returns.
+
+    Attributes:
+      path: [String] of the cassette being written.
+      calls: [Int] number of calls recorded.
+  '''
+  def __init__(self, reddit, path, constructor = None):
+    '''
+      Starts a new cassette.
+
+      Arguments:
+        reddit: reddit instance to wrap.
+        path: [String] of the cassette to write (overwritten).
+        constructor: [Dict] of the keyword arguments reddit was created with,
+          recorded as a 'Reddit' call so the Player can check them.
+    '''
+    self.path = path
+    self.calls = 0
+    self._f = gzip.open(path, 'wt', encoding = 'utf-8')
+    self._f.write(json.dumps({'cassette': VERSION}) + '\n')
+    self._lock = thrd.Lock()
+    self._handles = 0
+    self._root = _Recorded(self, 0, reddit)
+    if constructor != None: self._write(0, 'Reddit', [], constructor, 0, None)
+
+  def __getattr__(self, name):
+    if name.startswith('_'): raise AttributeError(name)
+    return getattr(self._root, name)
+
+  def close(self):
+    '''
+      Finishes writing the cassette.
+    '''
+    with self._lock: self._f.close()
+
+  def _wrap(self, obj):
+    '''
+      Encodes a returned value for the cassette, wrapping objects so calls on
+      them are recorded too.
+
+      Returns: (encoded value, value handed back to the caller)
+    '''
+    if obj == None or isinstance(obj, (bool, int, float, str)): return obj, obj
+    if isinstance(obj, (list, tuple)):
+      pairs = [self._wrap(o) for o in obj]
+      return [p[0] for p in pairs], [p[1] for p in pairs]
+    with self._lock:
+      self._handles += 1
+      handle = self._handles
+    return ({'$obj': handle, 'str': str(obj)},
+            _Recorded(self, handle, obj))
+
+  def _read(self, handle, name, value):
+    '''
+      Records an attribute read.
+
+      Returns: the value handed back to the caller
+    '''
+    enc, out = self._wrap(value)
+    self._write(handle, ATTR + name, [], {}, 0, enc)
+    return out
+
+  def _call(self, handle, name, method, args, kwargs):
+    '''
+      Makes and records a single call.
+    '''
+    real = [a._obj if isinstance(a, _Recorded) else a for a in args]
+    start = time.perf_counter()
+    try:
+      result = method(*real, **kwargs)
+    except Exception as e:
+      self._write(handle, name, args, kwargs, time.perf_counter() - start,
+                  None, {'type': type(e).__name__,
+                         'msg': str(getattr(e, 'reason', e))})
+      raise
+    elapsed = time.perf_counter() - start
+    enc, out = self._wrap(result)
+    self._write(handle, name, args, kwargs, elapsed, enc)
+    return out
+
+  def _write(self, handle, method, args, kwargs, elapsed, result,
+             error = None):
+    args, kwargs = _redact(method, args, kwargs)
+    entry = {'h': handle, 'm': method, 'a': args, 'k': kwargs,
+             't': round(elapsed, 6), 'r': result}
+    if error != None: entry['e'] = error
+    line = json.dumps(entry, separators = (',', ':'))
+    with self._lock:
+      self._f.write(line + '\n')
+      self._f.flush()
+      self.calls += 1
+
+def _arg(a):
+  '''
+    Encodes a call argument: wrapped objects by handle, anything else not
+    JSON-friendly as its str().
+  '''
+  if isinstance(a, (_Recorded, _Replayed)): return {'$obj': a._handle}
+  if a == None or isinstance(a, (bool, int, float, str)): return a
+  if isinstance(a, (list, tuple)): return [_arg(x) for x in a]
+  return str(a)
+
+class _Recorded:
+  '''
+    Wrapper around an object returned by reddit while recording.
+  '''
+  def __init__(self, recorder, handle, obj):
+    self._recorder = recorder
+    self._handle = handle
+    self._obj = obj
+
+  def __getattr__(self, name):
+    if name.startswith('__'): raise AttributeError(name)
+    value = getattr(self._obj, name)
+    if not callable(value):
+      return self._recorder._read(self._handle, name, value)
+    def call(*args, **kwargs):
+      return self._recorder._call(self._handle, name, value, args, kwargs)
+    return call
+
+  def __str__(self):
+    return str(self._obj)
+
+class Player:
+  '''
+    Stands in for a reddit instance, serving the results of a cassette.
+
+    Attributes:
+      path: [String] of the cassette being replayed.
+      speed: [Float] factor recorded durations are divided by. 0 replays
+        without sleeping at all.
+      calls: [Int] number of calls served.
+  '''
+  def __init__(self, path, speed = 1.0):
+    '''
+      Loads a cassette.
+
+      Arguments:
+        path: [String] of the cassette to replay.
+        speed: [Float] factor recorded durations are divided by (2 replays
+          twice as fast). 0 replays without sleeping at all.
+    '''
+    self.path = path
+    self.speed = speed
+    self.calls = 0
+    self._entries = collections.defaultdict(collections.deque)
+    self._lock = thrd.Lock()
+    for e in _read(path):
+      self._entries[_key(e['h'], e['m'], e['a'], e['k'])].append(e)
+    self._root = _Replayed(self, 0, {}, '')
+
+  def __getattr__(self, name):
+    if name.startswith('_'): raise AttributeError(name)
+    return getattr(self._root, name)
+
+  def remaining(self):
+    '''
+      Returns: [Int] number of recorded calls not replayed yet
+    '''
+    with self._lock:
+      return sum(len(d) for d in self._entries.values())
+
+  def _unwrap(self, value):
+    if isinstance(value, list): return [self._unwrap(v) for v in value]
+    if isinstance(value, dict) and '$obj' in value:
+      attrs = {k: self._unwrap(v) for k, v in value.get('attrs', {}).items()}
+      text = value.get('str', attrs.get('name', attrs.get('id', '')))
+      return _Replayed(self, value['$obj'], attrs, str(text))
+    return value
+
+  def _read(self, handle, name):
+    '''
+      Serves the next recorded read of an attribute.
+
+      Returns: ([Boolean] flag indicating a read was recorded, value)
+    '''
+    with self._lock:
+      entries = self._entries.get(_key(handle, ATTR + name, [], {}))
+      if not entries: return False, None
+      e = entries.popleft()
+      self.calls += 1
+    return True, self._unwrap(e['r'])
+
+  def _call(self, handle, method, args, kwargs):
+    '''
+      Serves the next recorded result of a call.
+    '''
+    key = _key(handle, method, *_redact(method, args, kwargs))
+    with self._lock:
+      entries = self._entries.get(key)
+      if not entries:
+        raise CassetteMiss('No recorded call left for ' + key)
+      e = entries.popleft()
+      self.calls += 1
+    if self.speed: time.sleep(e['t'] / self.speed)
+    if 'e' in e:
+      raise ERRORS.get(e['e']['type'], ReplayedError)(e['e']['msg'])
+    return self._unwrap(e['r'])
+
+class _Replayed:
+  '''
+    Stand-in for an object returned by reddit, in replay.
+  '''
+  def __init__(self, player, handle, attrs, text):
+    self._player = player
+    self._handle = handle
+    self._attrs = attrs
+    self._text = text
+
+  def __getattr__(self, name):
+    if name.startswith('__'): raise AttributeError(name)
+    found, value = self._player._read(self._handle, name)
+    if found: return value
+    if name in self._attrs: return self._attrs[name]
+    def call(*args, **kwargs):
+      return self._player._call(self._handle, name, args, kwargs)
+    return call
+
+  def __str__(self):
+    return self._text
+
+def summary(path):
+  '''
+    Summarizes a cassette: calls and recorded time per method.
+
+    Returns: [List] of [String]
+  '''
+  counts, total = collections.Counter(), collections.Counter()
+  for e in _read(path):
+    counts[e['m']] += 1
+    total[e['m']] += e['t']
+  out = ['{:<20}{:>8}{:>12}'.format('Method', 'Calls', 'Time (s)')]
+  for m, n in counts.most_common():
+    out.append('{:<20}{:>8}{:>12.3f}'.format(m, n, total[m]))
+  return out
+
+if __name__ == '__main__':
+  print('\n'.join(summary(sys.argv[1])))
@@ -0,0 +1,76 @@
+import datetime
+import threading as thrd
+import time
+
+from config_bot import TZ_OFFSET
+
+class Clock:
+  '''
+    Wall clock used by the daemon and tournaments. Swapped for a VirtualClock
+    in simulations.
+  '''
+  def now(self):
+    '''
+      Returns: [datetime.datetime] of the current time in TZ_OFFSET.
+    '''
+    return datetime.datetime.now(TZ_OFFSET)
+
+  def sleep(self, seconds):
+    '''
+      Blocks the calling thread for the given number of seconds.
+    '''
+    time.sleep(seconds)
+
+class VirtualClock(Clock):
+  '''
+    Clock whose time only moves when advance() or set() is called, so a whole
+    tournament can run in seconds. Threads sleeping on it wake up as soon as
+    the virtual time they're waiting for is reached (or after at most
+    maxRealSleep real seconds, so their loops keep ticking).
+
+    Attributes:
+      maxRealSleep: [Float] longest real time a single sleep() blocks for.
+  '''
+  def __init__(self, start = None, maxRealSleep = 0.05):
+    '''
+      Initializes the clock.
+
+      Arguments:
+        start: [datetime.datetime] to start at. Defaults to the real now.
+        maxRealSleep: [Float] longest real time a single sleep() blocks for.
+    '''
+    self._now = start if start != None else datetime.datetime.now(TZ_OFFSET)
+    self.maxRealSleep = maxRealSleep
+    self._cond = thrd.Condition()
+
+  def now(self):
+    with self._cond:
+      return self._now
+
+  def set(self, dt):
+    '''
+      Moves the clock to dt (never backwards) and wakes every sleeper.
+
+      Arguments:
+        dt: [datetime.datetime]
+    '''
+    with self._cond:
+      if dt > self._now: self._now = dt
+      self._cond.notify_all()
+
+  def advance(self, delta):
+    '''
+      Moves the clock forward by delta and wakes every sleeper.
+
+      Arguments:
+        delta: [datetime.timedelta]
+    '''
+    with self._cond:
+      self._now += delta
+      self._cond.notify_all()
+
+  def sleep(self, seconds):
+    with self._cond:
+      target = self._now + datetime.timedelta(seconds = seconds)
+      self._cond.wait_for(lambda: self._now >= target,
+                          timeout = self.maxRealSleep)
@@ -0,0 +1,97 @@
+import datetime
+import heapq
+import itertools
+import threading as thrd
+
+# How long before a round's deadline players of unreported matches are
+# reminded, earliest first
+REMINDERS = (datetime.timedelta(days = 1), datetime.timedelta(hours = 6))
+
+REMIND = 'remind'
+EXPIRE = 'expire'
+
+class DeadlineIndex:
+  '''
+    Min-heap of the upcoming actions on unreported matches (reminders before
+    their round's deadline, then expiry at the deadline), so the daemon only
+    ever looks at the k matches that are due: a sweep costs O(k log n) for n
+    indexed actions instead of a scan of every match of every tournament.
+
+    Matches are never taken out when they get reported; their entries are
+    left in the heap and the caller drops them when they come up (lazy
+    deletion), which keeps reporting O(1).
+
+    Attributes:
+      reminders: [Tuple] of [datetime.timedelta] before the deadline at which
+        to remind.
+  '''
+  def __init__(self, reminders = REMINDERS):
+    '''
+      Initializes an empty index.
+
+      Arguments:
+        reminders: [Tuple] of [datetime.timedelta] before the deadline at
+          which to remind.
+    '''
+    self.reminders = reminders
+    self._heap = []
+    self._seq = itertools.count()  # Ties break in insertion order
+    self._lock = thrd.Lock()
+
+  def __len__(self):
+    return len(self._heap)
+
+  def add(self, key, deadline, now = None):
+    '''
+      Indexes a match's reminders and expiry.
+
+      Arguments:
+        key: hashable match key, e.g. (tournament, round, player1, player2).
+        deadline: [datetime.datetime] the match must be reported by.
+        now: [datetime.datetime] reminders due before which are skipped, or
+          None to index every reminder.
+    '''
+    with self._lock:
+      for before in self.reminders:
+        when = deadline - before
+        if now == None or when > now:
+          heapq.heappush(self._heap, (when, next(self._seq), REMIND, key))
+      heapq.heappush(self._heap, (deadline, next(self._seq), EXPIRE, key))
+
+  def rebuild(self, matches, now = None):
+    '''
+      Replaces the whole index in O(n), e.g. after loading a tournament.
+
+      Arguments:
+        matches: iterable of (key, [datetime.datetime] deadline).
+        now: [datetime.datetime] reminders due before which are skipped.
+    '''
+    entries = []
+    for key, deadline in matches:
+      for before in self.reminders:
+        if now == None or deadline - before > now:
+          entries.append((deadline - before, next(self._seq), REMIND, key))
+      entries.append((deadline, next(self._seq), EXPIRE, key))
+    heapq.heapify(entries)
+    with self._lock: self._heap = entries
+
+  def next(self):
+    '''
+      Returns: [datetime.datetime] of the earliest indexed action, or None
+    '''
+    with self._lock:
+      return self._heap[0][0] if self._heap else None
+
+  def popDue(self, now):
+    '''
+      Takes every action due by now.
+
+      Returns: [List] of ([String] REMIND or EXPIRE, key, [datetime.datetime]
+        due), earliest first
+    '''
+    out = []
+    with self._lock:
+      while self._heap and self._heap[0][0] <= now:
+        when, seq, kind, key = heapq.heappop(self._heap)
+        out.append((kind, key, when))
+    return out
@@ -0,0 +1,318 @@
+import cardex
+import re
+import unicodedata
+
+# Set codes used by PTCGO deck exports, by `sets`.`identifier`. Sets missing
+# from here are matched on the initials of their English name instead.
+PTCGO_SET_CODES = {
+  'hgss': 'HS', 'unleashed': 'UL', 'undaunted': 'UD', 'triumphant': 'TM',
+  'call_of_legends': 'CL', 'black_white': 'BLW', 'emerging_powers': 'EPO',
+  'noble_victories': 'NVI', 'next_destinies': 'NXD', 'dark_explorers': 'DEX',
+  'dragons_exalted': 'DRX', 'dragon_vault': 'DRV',
+  'boundaries_crossed': 'BCR', 'plasma_storm': 'PLS', 'plasma_freeze': 'PLF',
+  'plasma_blast': 'PLB', 'legendary_treasures': 'LTR', 'xy': 'XY',
+  'kalos_starter': 'KSS', 'flashfire': 'FLF', 'furious_fists': 'FFI',
+  'phantom_forces': 'PHF', 'primal_clash': 'PRC', 'double_crisis': 'DCR',
+  'roaring_skies': 'ROS', 'ancient_origins': 'AOR', 'bw_promos': 'BWP',
+  'xy_promos': 'XYP'
+}
+
+# "* 4 Shaymin-EX ROS 77", "4 Professor Juniper PLF 116", "* 9 Water Energy"
+_lineRe = re.compile(r'^\s*\*?\s*(\d+)\s*x?\s+(.+?)(?:\s+([A-Za-z][A-Za-z0-9-]*)'
+                     r'\s+([A-Za-z]*\d+[a-z]?))?\s*$')
+_skipRe = re.compile(r'^\s*(#|\*\*|total cards|pok[eé]mon\s*-|trainer cards\s*-'
+                     r'|energy\s*-|$)', re.I)
+# Pokemon-EX ("Shaymin-EX", "Shaymin EX") as opposed to the older Pokemon ex
+# ("Rayquaza ex"), and Mega Evolutions of them ("M Rayquaza-EX")
+_exRe = re.compile(r'(?:[\s-]EX|-ex)\s*$')
+_megaRe = re.compile(r'^\s*(?:m|mega)\s+(?=.*[\s-]ex\s*$)', re.I)
+
+def editDistance(a, b):
+  '''
+    Returns: [Int] of the Levenshtein distance between strings a and b.
+  '''
+  prev = list(range(len(b) + 1))
+  for i, x in enumerate(a):
+    row = [i + 1]
+    for j, y in enumerate(b):
+      row.append(min(row[j] + 1, prev[j + 1] + 1, prev[j] + (x != y)))
+    prev = row
+  return prev[-1]
+
+def normalize(name):
+  '''
+    Reduces a card name to the key it's indexed under: accents stripped,
+    lowercased, and everything but letters and digits removed, so "Shaymin-EX"
+    and "Shaymin EX" both map to "shaymin-EX". The Mega prefix and EX suffix
+    are kept as "M " and "-EX", which can't appear anywhere else in a key, so
+    "M Rayquaza-EX", "Rayquaza-EX" and "Rayquaza ex" (the older Pokemon ex)
+    are at least two edits apart and never taken for one another's typos.
+
+    Returns: [String]
+  '''
+  name = unicodedata.normalize('NFKD', name)
+  mega = _megaRe.match(name)
+  if mega: name = name[mega.end():]
+  ex = _exRe.search(name)
+  if ex: name = name[:ex.start()]
+  key = ''.join(c for c in name.lower() if c.isalnum() and c.isascii())
+  return ('M ' if mega else '') + key + ('-EX' if ex else '')
+
+class CardTrie:
+  '''
+    Prefix trie mapping normalized card names to values. Lookups cost
+    O(length of the name) no matter how many names are stored.
+
+    Attributes:
+      root: [Dict] of character -> child node. Values are stored in a node
+        under the None key.
+      size: [Int] of the number of distinct keys stored.
+  '''
+  def __init__(self):
+    '''
+      Initializes an empty trie.
+    '''
+    self.root = {}
+    self.size = 0
+
+  def add(self, key, value):
+    '''
+      Adds value to the set of values stored under key.
+
+      Arguments:
+        key: [String] normalized name.
+        value: hashable value to store.
+    '''
+    node = self.root
+    for c in key: node = node.setdefault(c, {})
+    if None not in node:
+      node[None] = set()
+      self.size += 1
+    node[None].add(value)
+
+  def get(self, key):
+    '''
+      Returns: [Set] of the values stored under exactly key (empty if none).
+    '''
+    node = self.root
+    for c in key:
+      node = node.get(c)
+      if node == None: return set()
+    return node.get(None, set())
+
+  def near(self, key, maxEdits = 1):
+    '''
+      Returns the values of the closest keys within maxEdits insertions,
+      deletions or substitutions of key, walking the trie with one row of the
+      edit distance table per node so that whole branches are pruned as soon
+      as they drift too far.
+
+      Arguments:
+        key: [String] normalized name.
+        maxEdits: [Int] of the largest edit distance accepted.
+
+      Returns: [Set] of values (empty if nothing is close enough)
+    '''
+    best = [maxEdits + 1, set()]
+
+    def walk(node, prev):
+      if None in node and prev[-1] <= best[0]:
+        if prev[-1] < best[0]: best[:] = [prev[-1], set()]
+        best[1] |= node[None]
+      if min(prev) > min(best[0], maxEdits): return
+      for c, child in node.items():
+        if c == None: continue
+        row = [prev[0] + 1]
+        for i, k in enumerate(key):
+          row.append(min(row[i] + 1, prev[i + 1] + 1, prev[i] + (k != c)))
+        walk(child, row)
+
+    walk(self.root, list(range(len(key) + 1)))
+    return best[1] if best[0] <= maxEdits else set()
+
+class DeckEntry:
+  '''
+    A single line of a decklist.
+
+    Attributes:
+      quantity: [Int] number of copies.
+      name: [String] card name as written by the player.
+      setCode: [String] set code as written by the player, or None.
+      number: [String] collector number as written by the player, or None.
+      card: ([Int] set_id, [Int] number) of the resolved card, or None if the
+        line couldn't be resolved.
+      exact: [Boolean] False if the card was found through a spelling
+        correction (or only by name when the set and number didn't match).
+  '''
+  def __init__(self, quantity, name, setCode = None, number = None):
+    self.quantity = quantity
+    self.name = name
+    self.setCode = setCode
+    self.number = number
+    self.card = None
+    self.exact = False
+
+  def __repr__(self):
+    return 'DeckEntry({}, {!r}, {!r}, {!r}, card = {})'.format(self.quantity,
+           self.name, self.setCode, self.number, self.card)
+
+class Decklist:
+  '''
+    A parsed decklist.
+
+    Attributes:
+      entries: [List] of every [DeckEntry], in the order they were written.
+      unresolved: [List] of the [DeckEntry]s whose card couldn't be found.
+      ignored: [List] of the [String] lines that weren't card lines at all.
+  '''
+  def __init__(self):
+    self.entries = []
+    self.unresolved = []
+    self.ignored = []
+
+  def total(self):
+    '''
+      Returns: [Int] of the number of cards in the deck.
+    '''
+    return sum(e.quantity for e in self.entries)
+
+  def counts(self):
+    '''
+      Returns: [Dict] of ([Int] set_id, [Int] number) -> [Int] quantity for
+        every resolved card.
+    '''
+    out = {}
+    for e in self.entries:
+      if e.card != None: out[e.card] = out.get(e.card, 0) + e.quantity
+    return out
+
+class CardIndex:
+  '''
+    In-memory indexes used to resolve decklist lines without touching the
+    database: a trie of every card name (in every language) and a hash of set
+    code and collector number.
+
+    Attributes:
+      names: [CardTrie] of normalized name -> ([Int] set_id, [Int] number).
+      sets: [Dict] of upper case set code -> [Int] set_id.
+      printings: [Dict] of ([Int] set_id, [Int] number) -> normalized English
+        name.
+      setOrder: [Dict] of set_id -> [Int] release order of the set.
+      version: [Tuple] of the cardex.dataVersion() of the tables the indexes
+        were built from.
+  '''
+  # Tables the indexes are built from
+  TABLES = ('cards_names', 'sets', 'sets_names')
+
+  def __init__(self, conn = None):
+    '''
+      Builds the indexes from cards_names, sets and sets_names.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+    '''
+    if conn == None: conn = cardex.connect()
+    self.version = cardex.dataVersion(conn, self.TABLES)
+    self.names = CardTrie()
+    self.sets = {}
+    self.printings = {}
+    for setId, number, lang, name in conn.execute(
+        'SELECT set_id, number, local_language_id, name FROM cards_names'):
+      key = normalize(name)
+      self.names.add(key, (setId, number))
+      if lang == cardex.ENGLISH or (setId, number) not in self.printings:
+        self.printings[(setId, number)] = key
+    identifiers = {}
+    self.setOrder = {}
+    for setId, ident, order in conn.execute('SELECT id, identifier, set_order '
+                                            'FROM sets'):
+      identifiers[setId] = ident
+      self.setOrder[setId] = order
+    for setId, name in conn.execute('SELECT id, name FROM sets_names '
+                                    'WHERE local_language_id = ?',
+                                    (cardex.ENGLISH,)):
+      initials = ''.join(w[0] for w in re.findall(r'\w+', name)).upper()
+      self.sets.setdefault(initials, setId)
+      self.sets.setdefault(normalize(name).upper(), setId)
+    for setId, ident in identifiers.items():
+      if ident in PTCGO_SET_CODES: self.sets[PTCGO_SET_CODES[ident]] = setId
+
+  def isStale(self, conn):
+    '''
+      Returns: [Boolean] indicating the tables the indexes were built from
+        changed since (see cardex.refresh())
+    '''
+    return cardex.dataVersion(conn, self.TABLES) != self.version
+
+  def resolve(self, entry):
+    '''
+      Resolves entry.card in place. The set code and number are tried first
+      (and accepted if the printed name agrees, give or take a typo), then the
+      name on its own, then the name with a single typo (see normalize() for
+      why a typo never turns one card into its Mega or EX). When only the name
+      is known, the newest printing is picked. entry.exact is left False for
+      anything but an exact match, for deck validation to report.
+
+      Arguments:
+        entry: [DeckEntry] to resolve.
+
+      Returns: [Boolean] indicating success
+    '''
+    key = normalize(entry.name)
+    if entry.setCode != None and entry.number != None:
+      setId = self.sets.get(entry.setCode.upper())
+      number = re.sub(r'\D', '', entry.number)
+      card = (setId, int(number)) if setId != None and number else None
+      printed = self.printings.get(card)
+      if printed != None and (printed == key or editDistance(printed, key) <= 1):
+        entry.card = card
+        entry.exact = printed == key
+        return True
+    found = self.names.get(key)
+    entry.exact = bool(found) and entry.setCode == None
+    if not found: found = self.names.near(key)
+    if not found: return False
+    entry.card = max(found, key = lambda c: (self.setOrder.get(c[0], 0), c))
+    return True
+
+  def parse(self, text):
+    '''
+      Parses a single decklist (e.g. a PTCGO export pasted into a comment).
+
+      Arguments:
+        text: [String] of the decklist, one card per line.
+
+      Returns: [Decklist]
+    '''
+    deck = Decklist()
+    for line in text.splitlines():
+      if _skipRe.match(line):
+        if line.strip(): deck.ignored.append(line)
+        continue
+      m = _lineRe.match(line)
+      if m == None:
+        deck.ignored.append(line)
+        continue
+      entry = DeckEntry(int(m.group(1)), m.group(2).strip(), m.group(3),
+                        m.group(4))
+      deck.entries.append(entry)
+      if not self.resolve(entry) and entry.setCode != None:
+        # The last two words might have been part of the name after all
+        entry.name = ' '.join((entry.name, entry.setCode, entry.number))
+        entry.setCode = entry.number = None
+        self.resolve(entry)
+      if entry.card == None: deck.unresolved.append(entry)
+    return deck
+
+  def parseAll(self, texts):
+    '''
+      Parses a batch of decklists lazily, one at a time, so that a large batch
+      never has to be held in memory at once.
+
+      Arguments:
+        texts: iterable of decklist [String]s.
+
+      Returns: generator of [Decklist]
+    '''
+    for text in texts: yield self.parse(text)
@@ -0,0 +1,207 @@
+import attacks
+import cardex
+import numpy as np
+import re
+
+TYPES = 12  # `types`.`id` 0 (none) to 11 (fairy)
+
+# Typical attack damage, so that a x2 weakness counts like +DAMAGE and +20 or
+# -20 count as 20 / DAMAGE of an attack
+DAMAGE = 60.0
+
+_amountRe = re.compile(r'([+-]?)(\d+)')
+
+def amount(text):
+  '''
+    Reads a weakness or resistance amount ('×2', '*2', '&times', '+20',
+    '-30') as a fraction of a typical attack's damage.
+
+    Returns: [Float], 0 if empty
+  '''
+  text = text.strip()
+  if not text: return 0.0
+  m = _amountRe.search(text)
+  if text[0] in '×*&' or m == None:  # Multiplier: doubles the damage
+    return (int(m.group(2)) if m else 2) - 1.0
+  return abs(int(m.group(2))) / DAMAGE
+
+class MatchupMatrix:
+  '''
+    Deck-vs-deck type advantage, kept as a matrix that grows one deck at a
+    time. Each deck is summed into an attack profile (the share of its
+    Pokemon of each type) and an exposure profile (its Pokemon's mean
+    weakness minus resistance to each type). The advantage of deck i over
+    deck j is how much i's types hit j's weaknesses, minus the reverse:
+
+      edge = A @ E.T - (A @ E.T).T
+
+    Adding a deck only computes its row and column (O(n) instead of O(n^2)).
+
+    Attributes:
+      cardKey: [numpy.ndarray] of int64 card keys (see attacks.cardKey) of
+        every Pokemon card, sorted.
+      cardAttack: [numpy.ndarray] of float32, shape (cards, TYPES), 1 for
+        each type of each card.
+      cardExposure: [numpy.ndarray] of float32, shape (cards, TYPES), of each
+        card's weakness minus resistance to each type (see amount()).
+      keys: [List] of the deck keys, in matrix order.
+      index: [Dict] of deck key -> [Int] row.
+  '''
+  def __init__(self, conn = None):
+    '''
+      Loads the type, weakness and resistance columns of every Pokemon card.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+    '''
+    if conn == None: conn = cardex.connect()
+    rows = conn.execute('SELECT set_id, number, type1_id, type2_id, '
+                        'weakness1_id, weakness1_amount, weakness2_id, '
+                        'weakness2_amount, resistance1_id, resistance1_amount, '
+                        'resistance2_id, resistance2_amount FROM cards '
+                        'WHERE type1_id > 0 ORDER BY set_id, number').fetchall()
+    n = len(rows)
+    self.cardKey = attacks.cardKey([r[0] for r in rows], [r[1] for r in rows])
+    self.cardAttack = np.zeros((n, TYPES), dtype = np.float32)
+    self.cardExposure = np.zeros((n, TYPES), dtype = np.float32)
+    for i, r in enumerate(rows):
+      for t in r[2:4]:
+        if t: self.cardAttack[i, t] = 1
+      for t, a in (r[4:6], r[6:8]):
+        if t: self.cardExposure[i, t] += amount(a)
+      for t, a in (r[8:10], r[10:12]):
+        if t: self.cardExposure[i, t] -= amount(a)
+    self.keys = []
+    self.index = {}
+    self._attack = np.zeros((0, TYPES), dtype = np.float32)
+    self._exposure = np.zeros((0, TYPES), dtype = np.float32)
+    self._hits = np.zeros((0, 0), dtype = np.float32)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def profile(self, counts):
+    '''
+      Attack and exposure profiles of a deck, weighted by copies.
+
+      Arguments:
+        counts: [Dict] of ([Int] set_id, [Int] number) -> [Int] quantity, as
+          from decklist.Decklist.counts().
+
+      Returns: ([numpy.ndarray] attack, [numpy.ndarray] exposure), both of
+        shape (TYPES,)
+    '''
+    cards = list(counts)
+    keys = attacks.cardKey([c[0] for c in cards], [c[1] for c in cards])
+    idx = np.searchsorted(self.cardKey, keys).clip(0, len(self.cardKey) - 1)
+    found = self.cardKey[idx] == keys
+    qty = np.array([counts[c] for c in cards], dtype = np.float32)[found]
+    idx = idx[found]
+    total = max(qty.sum(), 1)
+    return (qty @ self.cardAttack[idx] / total,
+            qty @ self.cardExposure[idx] / total)
+
+  def add(self, key, counts):
+    '''
+      Adds a deck (or replaces the deck of a key already added), updating
+      only its row and column.
+
+      Arguments:
+        key: hashable deck key, e.g. the player's name.
+        counts: [Dict] of ([Int] set_id, [Int] number) -> [Int] quantity.
+
+      Returns: [Int] row of the deck
+    '''
+    a, e = self.profile(counts)
+    i = self.index.get(key)
+    if i == None:
+      i = len(self.keys)
+      self.keys.append(key)
+      self.index[key] = i
+      if i == len(self._attack):  # Grow the arrays by doubling
+        size = max(2 * i, 16)
+        for name in ('_attack', '_exposure'):
+          grown = np.zeros((size, TYPES), dtype = np.float32)
+          grown[:i] = getattr(self, name)[:i]
+          setattr(self, name, grown)
+        hits = np.zeros((size, size), dtype = np.float32)
+        hits[:i, :i] = self._hits[:i, :i]
+        self._hits = hits
+    n = len(self.keys)
+    self._attack[i], self._exposure[i] = a, e
+    self._hits[i, :n] = self._exposure[:n] @ a
+    self._hits[:n, i] = self._attack[:n] @ e
+    return i
+
+  def matrix(self):
+    '''
+      Returns: [numpy.ndarray] of float32, shape (decks, decks), whose entry
+        (i, j) is the type edge of deck keys[i] over keys[j] (antisymmetric)
+    '''
+    n = len(self.keys)
+    hits = self._hits[:n, :n]
+    return hits - hits.T
+
+  def edge(self, key1, key2):
+    '''
+      Returns: [Float] type edge of one deck over another, positive if the
+        first one is favoured
+    '''
+    i, j = self.index[key1], self.index[key2]
+    return float(self._hits[i, j] - self._hits[j, i])
+
+  def preview(self, player1, player2, threshold = 0.1):
+    '''
+      One-line matchup preview for a pairings post.
+
+      Returns: [String], empty if either deck is unknown
+    '''
+    if player1 not in self.index or player2 not in self.index: return ''
+    e = self.edge(player1, player2)
+    if abs(e) < threshold: return 'even type matchup'
+    return 'type edge to /u/{}, {:+.2f}'.format(player1 if e > 0 else player2,
+                                               abs(e))
+
+  def byGroup(self, labels):
+    '''
+      Averages the matrix over groups of decks, e.g. archetypes.
+
+      Arguments:
+        labels: [Dict] of deck key -> group (e.g. an archetype id). Decks
+          without a label are left out.
+
+      Returns: ([List] of the groups, [numpy.ndarray] of their mean edges)
+    '''
+    groups = sorted({labels[k] for k in self.keys if k in labels})
+    col = {g: i for i, g in enumerate(groups)}
+    g = np.zeros((len(groups), len(self.keys)), dtype = np.float32)
+    for i, k in enumerate(self.keys):
+      if k in labels: g[col[labels[k]], i] = 1
+    g /= g.sum(axis = 1, keepdims = True).clip(1)
+    return groups, g @ self.matrix() @ g.T
+
+  def report(self, labels, names = None, top = 5):
+    '''
+      Formats the type matchups of the most played groups (e.g. archetypes)
+      as a reddit markdown table, for meta reports.
+
+      Arguments:
+        labels: [Dict] of deck key -> group.
+        names: [Dict] of group -> [String] name.
+        top: [Int] number of groups to list.
+
+      Returns: [String]
+    '''
+    names = names or {}
+    groups, edges = self.byGroup(labels)
+    edges = edges.round(2) + 0.0  # No -0.00
+    played = [sum(1 for k in self.keys if labels.get(k) == g) for g in groups]
+    order = np.argsort(played, kind = 'stable')[::-1][:top]
+    heads = [str(names.get(groups[i], groups[i])) for i in order]
+    out = ['**Type matchups** (row vs column)\n',
+           ' | '.join([''] + heads), '|'.join([':--'] + ['--:'] * len(order))]
+    for h, i in zip(heads, order):
+      out.append(' | '.join([h] + ['{:+.2f}'.format(edges[i, j])
+                                   for j in order]))
+    return '\n'.join(out)
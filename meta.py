@@ -0,0 +1,233 @@
+import attacks
+import cardex
+import numpy as np
+
+class Meta:
+  '''
+    Column arrays over a set of decks (their archetype, event and placement)
+    and their card lists, for metagame statistics computed as whole-array
+    operations. Decks can come from the cardex dump (decks_results and
+    decks_lists) or from our own tournaments' submitted decklists.
+
+    Attributes:
+      deckId: [numpy.ndarray] of int32 id of each deck.
+      archetype: [numpy.ndarray] of int32 archetype id of each deck (0 if
+        unknown).
+      event: [numpy.ndarray] of int32 event id of each deck.
+      place: [numpy.ndarray] of int32 placement of each deck.
+      cards: [numpy.ndarray] of int64 card keys (see attacks.cardKey), sorted.
+      counts: [numpy.ndarray] of uint8, shape (decks, cards), of the number of
+        copies of each card in each deck.
+      archetypeNames: [Dict] of archetype id -> [String] name.
+      cardNames: [Dict] of card key -> [String] English name.
+  '''
+  def __init__(self, deckId, archetype, event, place, listDeck, listCard,
+               listQty, archetypeNames = None, cardNames = None):
+    '''
+      Builds the arrays from per-deck columns and per-list-row columns.
+
+      Arguments:
+        deckId, archetype, event, place: sequences with one entry per deck.
+        listDeck: sequence of the deck id of each card list row.
+        listCard: sequence of the card key of each card list row.
+        listQty: sequence of the quantity of each card list row.
+        archetypeNames: [Dict] of archetype id -> [String] name.
+        cardNames: [Dict] of card key -> [String] name.
+    '''
+    self.deckId = np.asarray(deckId, dtype = np.int32)
+    self.archetype = np.asarray(archetype, dtype = np.int32)
+    self.event = np.asarray(event, dtype = np.int32)
+    self.place = np.asarray(place, dtype = np.int32)
+    self.archetypeNames = archetypeNames or {}
+    self.cardNames = cardNames or {}
+    # Row of each list entry's deck; entries of decks we don't have are dropped
+    listDeck = np.asarray(listDeck, dtype = np.int32)
+    known = np.zeros(len(listDeck), dtype = bool)
+    rows = np.zeros(len(listDeck), dtype = np.intp)
+    if len(self.deckId):
+      order = np.argsort(self.deckId)
+      pos = np.searchsorted(self.deckId, listDeck, sorter = order)
+      rows = order[pos.clip(0, len(order) - 1)]
+      known = self.deckId[rows] == listDeck
+    self.cards, cols = np.unique(np.asarray(listCard, dtype = np.int64)[known],
+                                 return_inverse = True)
+    self.counts = np.zeros((len(self.deckId), len(self.cards)),
+                           dtype = np.uint8)
+    np.add.at(self.counts, (rows[known], cols),
+              np.asarray(listQty, dtype = np.uint8)[known])
+
+  @classmethod
+  def fromCardex(cls, conn = None, events = None):
+    '''
+      Loads the decks of the cardex dump.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+        events: iterable of [Int] event ids to restrict to, or None for all.
+
+      Returns: [Meta]
+    '''
+    if conn == None: conn = cardex.connect()
+    decks = np.array(conn.execute('SELECT deck_id, archetype_id, event_id, '
+                                  'place FROM decks_results').fetchall(),
+                     dtype = np.int32).reshape(-1, 4)
+    if events != None: decks = decks[np.isin(decks[:, 2], list(events))]
+    lists = np.array(conn.execute('SELECT deck_id, set_id, card_number, '
+                                  'quantity FROM decks_lists').fetchall(),
+                     dtype = np.int32).reshape(-1, 4)
+    return cls(decks[:, 0], decks[:, 1], decks[:, 2], decks[:, 3],
+               lists[:, 0], attacks.cardKey(lists[:, 1], lists[:, 2]),
+               lists[:, 3], *names(conn))
+
+  @classmethod
+  def fromDecklists(cls, decks, places, archetypes = None, event = 0,
+                    conn = None):
+    '''
+      Loads our own tournament's submitted decks.
+
+      Arguments:
+        decks: sequence of [decklist.Decklist].
+        places: sequence of [Int] final placement of each deck.
+        archetypes: sequence of [Int] archetype id of each deck, or None if
+          unknown.
+        event: [Int] id to give the tournament.
+        conn: [sqlite3.Connection] to the card database, used for names.
+          Defaults to cardex.connect().
+
+      Returns: [Meta]
+    '''
+    if conn == None: conn = cardex.connect()
+    if archetypes == None: archetypes = [0] * len(decks)
+    listDeck, listCard, listQty = [], [], []
+    for i, deck in enumerate(decks):
+      for (setId, number), qty in deck.counts().items():
+        listDeck.append(i)
+        listCard.append(attacks.cardKey(setId, number))
+        listQty.append(qty)
+    return cls(range(len(decks)), archetypes, [event] * len(decks), places,
+               listDeck, listCard, listQty, *names(conn))
+
+  def __len__(self):
+    return len(self.deckId)
+
+  def archetypeShare(self):
+    '''
+      Returns: ([numpy.ndarray] of archetype ids, [numpy.ndarray] of the
+        fraction of decks of each), most played first
+    '''
+    ids, n = np.unique(self.archetype, return_counts = True)
+    order = np.argsort(-n, kind = 'stable')
+    return ids[order], n[order] / max(len(self), 1)
+
+  def averagePlace(self):
+    '''
+      Returns: ([numpy.ndarray] of archetype ids, [numpy.ndarray] of the mean
+        placement of each), best first
+    '''
+    ids, inv = np.unique(self.archetype, return_inverse = True)
+    mean = (np.bincount(inv, weights = self.place) /
+            np.bincount(inv).clip(1))
+    order = np.argsort(mean, kind = 'stable')
+    return ids[order], mean[order]
+
+  def inclusion(self, archetype = None):
+    '''
+      Card inclusion rates, optionally within a single archetype.
+
+      Arguments:
+        archetype: [Int] archetype id, or None for every deck.
+
+      Returns: ([numpy.ndarray] of card keys, [numpy.ndarray] of the fraction
+        of decks playing each, [numpy.ndarray] of the mean copies among the
+        decks playing it), most included first
+    '''
+    counts = self.counts
+    if archetype != None: counts = counts[self.archetype == archetype]
+    present = counts > 0
+    played = present.sum(axis = 0)
+    rate = played / max(len(counts), 1)
+    copies = counts.sum(axis = 0, dtype = np.int64) / played.clip(1)
+    order = np.argsort(-rate, kind = 'stable')
+    return self.cards[order], rate[order], copies[order]
+
+  def cooccurrence(self, top = None):
+    '''
+      Card co-occurrence matrix: entry (i, j) is the number of decks playing
+      both card i and card j (the diagonal is each card's deck count).
+
+      Arguments:
+        top: [Int] to only keep the top most included cards, or None for all.
+
+      Returns: ([numpy.ndarray] of card keys, [numpy.ndarray] square matrix of
+        int32)
+    '''
+    present = (self.counts > 0).astype(np.int32)
+    keys = self.cards
+    if top != None:
+      cols = np.argsort(-present.sum(axis = 0), kind = 'stable')[:top]
+      present, keys = present[:, cols], keys[cols]
+    return keys, present.T @ present
+
+  def merge(self, other):
+    '''
+      Combines two sets of decks (e.g. the cardex history and our latest
+      tournament). Deck ids of other are offset past ours to keep them unique.
+
+      Returns: [Meta]
+    '''
+    offset = int(self.deckId.max()) + 1 if len(self) else 0
+    lists = []
+    for m, off in ((self, 0), (other, offset)):
+      rows, cols = np.nonzero(m.counts)
+      lists.append((m.deckId[rows] + off, m.cards[cols], m.counts[rows, cols]))
+    names = {**self.archetypeNames, **other.archetypeNames}
+    cards = {**self.cardNames, **other.cardNames}
+    return Meta(np.concatenate((self.deckId, other.deckId + offset)),
+                np.concatenate((self.archetype, other.archetype)),
+                np.concatenate((self.event, other.event)),
+                np.concatenate((self.place, other.place)),
+                *[np.concatenate(c) for c in zip(*lists)],
+                archetypeNames = names, cardNames = cards)
+
+  def report(self, top = 10):
+    '''
+      Formats a meta report as reddit markdown tables, ready to be posted after
+      an event.
+
+      Arguments:
+        top: [Int] number of archetypes and cards to list.
+
+      Returns: [String]
+    '''
+    out = ['**Archetypes** ({} decks)\n'.format(len(self)),
+           'Archetype | Share | Avg. place', ':--|--:|--:']
+    ids, share = self.archetypeShare()
+    aids, mean = self.averagePlace()
+    avg = dict(zip(aids.tolist(), mean.tolist()))
+    for a, s in zip(ids[:top].tolist(), share[:top].tolist()):
+      out.append('{} | {:.1%} | {:.1f}'.format(
+                 self.archetypeNames.get(a, 'Unknown'), s, avg[a]))
+    out += ['', '**Most played cards**\n', 'Card | Decks | Avg. copies',
+            ':--|--:|--:']
+    keys, rate, copies = self.inclusion()
+    for k, r, c in zip(keys[:top].tolist(), rate[:top].tolist(),
+                       copies[:top].tolist()):
+      out.append('{} | {:.1%} | {:.1f}'.format(self.cardNames.get(k, k), r, c))
+    return '\n'.join(out)
+
+def names(conn):
+  '''
+    Reads archetype and English card names.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+
+    Returns: ([Dict] of archetype id -> [String], [Dict] of card key ->
+      [String])
+  '''
+  archetypes = dict(conn.execute('SELECT id, name FROM decks_archetypes'))
+  cards = {int(attacks.cardKey(s, n)): name for s, n, name in conn.execute(
+           'SELECT set_id, number, name FROM cards_names '
+           'WHERE local_language_id = ?', (cardex.ENGLISH,))}
+  return archetypes, cards
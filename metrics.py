@@ -0,0 +1,224 @@
+import os
+import threading as thrd
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket
+# catches everything slower than the second-to-last bound.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, float('inf'))
+
+class Histogram:
+  '''
+    Fixed-bucket latency histogram. Cheap enough to update on every task.
+
+    Attributes:
+      counts: [List] of [Int] counts, one per bucket in BUCKETS.
+      total: [Float] sum of every recorded value, in seconds.
+      maximum: [Float] slowest recorded value, in seconds.
+  '''
+  def __init__(self):
+    '''
+      Initializes an empty histogram.
+    '''
+    self.counts = [0] * len(BUCKETS)
+    self.total = 0.0
+    self.maximum = 0.0
+
+  def add(self, value):
+    '''
+      Records a single value.
+
+      Arguments:
+        value: [Float] latency in seconds.
+    '''
+    for i, bound in enumerate(BUCKETS):
+      if value <= bound:
+        self.counts[i] += 1
+        break
+    self.total += value
+    if value > self.maximum: self.maximum = value
+
+  def count(self):
+    '''
+      Returns: [Int] of the number of recorded values.
+    '''
+    return sum(self.counts)
+
+  def mean(self):
+    '''
+      Returns: [Float] of the mean recorded value, or 0 if there are none.
+    '''
+    n = self.count()
+    return self.total / n if n else 0.0
+
+  def percentile(self, p):
+    '''
+      Estimates a percentile from the bucket counts. The upper bound of the
+      bucket the percentile falls into is returned (the maximum for the last
+      bucket).
+
+      Arguments:
+        p: [Float] percentile between 0 and 100.
+
+      Returns: [Float] in seconds
+    '''
+    n = self.count()
+    if n == 0: return 0.0
+    rank = n * p / 100
+    seen = 0
+    for i, c in enumerate(self.counts):
+      seen += c
+      if seen >= rank and c > 0:
+        return min(BUCKETS[i], self.maximum)
+    return self.maximum
+
+class TaskStats:
+  '''
+    Per-task-name stats.
+
+    Attributes:
+      wait: [Histogram] of time spent waiting in the queue.
+      run: [Histogram] of time spent executing.
+      errors: [Int] number of runs that raised an exception.
+      lastError: [String] repr of the most recent exception, if any.
+  '''
+  def __init__(self):
+    '''
+      Initializes empty stats.
+    '''
+    self.wait = Histogram()
+    self.run = Histogram()
+    self.errors = 0
+    self.lastError = ''
+
+class TaskMetrics:
+  '''
+    In-memory collection of daemon task metrics. Every method is safe to call
+    from any thread, so the UI can read metrics without going through (and
+    waiting behind) the daemon's queue.
+
+    Attributes:
+      path: [String] of the file metrics are periodically written to.
+      interval: [Int] minimum number of seconds between two writes.
+      tasks: [Dict] of task name -> [TaskStats].
+      priorities: [Dict] of priority name -> [TaskStats] of every task run at
+        that priority.
+      depths: [Dict] of queue name -> current depth as an [Int].
+      maxDepths: [Dict] of queue name -> highest depth seen as an [Int].
+  '''
+  def __init__(self, path = os.path.join('docs', 'metrics.txt'),
+               interval = 60):
+    '''
+      Initializes the metrics.
+
+      Arguments:
+        path: [String] of the file to periodically write metrics to.
+        interval: [Int] minimum number of seconds between two writes.
+    '''
+    self.path = path
+    self.interval = interval
+    self.tasks = {}
+    self.priorities = {}
+    self.depths = {}
+    self.maxDepths = {}
+    self._started = time.time()
+    self._lastSave = time.monotonic()
+    self._lock = thrd.Lock()
+
+  def record(self, name, wait, run, error = None):
+    '''
+      Records a single finished task.
+
+      Arguments:
+        name: [String] name of the task.
+        wait: [Float] seconds the task spent in the queue.
+        run: [Float] seconds the task spent executing.
+        error: the [Exception] the task raised, or None if it succeeded.
+    '''
+    with self._lock:
+      stats = self.tasks.get(name)
+      if stats == None: stats = self.tasks[name] = TaskStats()
+      stats.wait.add(wait)
+      stats.run.add(run)
+      if error != None:
+        stats.errors += 1
+        stats.lastError = repr(error)
+
+  def recordPriority(self, priority, wait, run):
+    '''
+      Records a single finished task in the stats of its priority.
+
+      Arguments:
+        priority: [String] name of the priority the task was queued at.
+        wait: [Float] seconds the task spent in the queue.
+        run: [Float] seconds the task spent executing.
+    '''
+    with self._lock:
+      stats = self.priorities.get(priority)
+      if stats == None: stats = self.priorities[priority] = TaskStats()
+      stats.wait.add(wait)
+      stats.run.add(run)
+
+  def setDepth(self, qname, depth):
+    '''
+      Updates the current depth gauge of a queue.
+
+      Arguments:
+        qname: [String] name of the queue.
+        depth: [Int] number of items currently in the queue.
+    '''
+    with self._lock:
+      self.depths[qname] = depth
+      self.maxDepths[qname] = max(depth, self.maxDepths.get(qname, 0))
+
+  def lines(self):
+    '''
+      Formats the current metrics as a list of lines, one per queue, one per
+      priority and one per task name (slowest tasks first).
+
+      Returns: [List] of [String]
+    '''
+    with self._lock:
+      up = int(time.time() - self._started)
+      out = ['Uptime: {}s'.format(up)]
+      for qname in sorted(self.depths):
+        out.append('Queue {}: depth {} (max {})'.format(qname,
+                   self.depths[qname], self.maxDepths[qname]))
+      for name, s in sorted(self.priorities.items()):
+        out.append('Priority {}: {} tasks, wait avg {:.1f}ms, p95 {:.1f}ms, '
+                   'max {:.1f}ms'.format(name, s.wait.count(),
+                   s.wait.mean() * 1000, s.wait.percentile(95) * 1000,
+                   s.wait.maximum * 1000))
+      out.append('{:<24}{:>7}{:>5}{:>10}{:>10}{:>10}{:>10}'.format('Task',
+                 'Runs', 'Err', 'Wait avg', 'Wait p95', 'Run avg', 'Run p95'))
+      ordered = sorted(self.tasks.items(), key = lambda kv: -kv[1].run.total)
+      for name, s in ordered:
+        out.append('{:<24}{:>7}{:>5}{:>9.1f}ms{:>8.1f}ms{:>8.1f}ms{:>8.1f}ms'
+                   .format(name[:23], s.run.count(), s.errors,
+                           s.wait.mean() * 1000,
+                           s.wait.percentile(95) * 1000,
+                           s.run.mean() * 1000, s.run.percentile(95) * 1000))
+      return out
+
+  def save(self):
+    '''
+      Writes the current metrics to the metrics file, including the raw
+      histogram bucket counts.
+    '''
+    lines = self.lines()
+    with self._lock:
+      lines.append('')
+      lines.append('Buckets (s): ' + ' '.join(str(b) for b in BUCKETS))
+      for name, s in sorted(self.tasks.items()):
+        lines.append(name + ' wait ' + ' '.join(map(str, s.wait.counts)))
+        lines.append(name + ' run ' + ' '.join(map(str, s.run.counts)))
+        if s.lastError: lines.append(name + ' lastError ' + s.lastError)
+      self._lastSave = time.monotonic()
+    with open(self.path, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+
+  def saveIfDue(self):
+    '''
+      Writes the metrics file if at least interval seconds have passed since
+      the last write.
+    '''
+    if time.monotonic() - self._lastSave >= self.interval: self.save()
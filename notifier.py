@@ -0,0 +1,265 @@
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import threading as thrd
+import time
+import traceback
+
+RATE = 1.0  # Messages per second reddit lets the bot send
+CONCURRENCY = 4  # Messages in flight at once
+MAX_ATTEMPTS = 3
+BACKOFF = 2.0  # Seconds before the first retry, doubled for every later one
+
+# Every message ends with its outbox key, so a send interrupted by a crash can
+# be looked up in the bot's sent messages instead of being sent twice.
+FOOTER = '\n\n^(ref: {})'
+_refRe = re.compile(r'\^\(ref: ([^)]+)\)\s*$')
+
+def _log(what, error):
+  '''
+    Prints an error of the notifier, with its traceback, to stderr.
+  '''
+  print('notifier: ' + what, file = sys.stderr, flush = True)
+  traceback.print_exception(type(error), error, error.__traceback__)
+
+class RateLimiter:
+  '''
+    Token bucket shared by every send of the notifier.
+
+    Attributes:
+      rate: [Float] tokens added per second.
+      burst: [Float] most tokens that can be saved up.
+  '''
+  def __init__(self, rate, burst = 1.0):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.last = time.monotonic()
+
+  async def acquire(self):
+    '''
+      Waits until a token is available and takes it.
+    '''
+    while True:
+      now = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+      self.last = now
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return
+      await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Notifier:
+  '''
+    Sends private messages concurrently from its own asyncio event loop, under
+    a global rate limit, so the daemon's worker never waits on reddit.
+    Messages go through a durable SQLite outbox keyed by message: queueing the
+    same key twice sends it once, and after a crash sending resumes where it
+    left off. Failed sends are retried with exponential backoff, and should
+    the sender itself stop on an error it is logged and started again.
+
+    Attributes:
+      r: reddit instance messages are sent through.
+      conn: [sqlite3.Connection] to the outbox (table outbox).
+      limiter: [RateLimiter] every send waits on.
+      concurrency: [Int] number of messages in flight at once.
+      progress: callable given a [Dict] of status -> [Int] count after every
+        batch of sends, or None.
+      sender: [concurrent.futures.Future] of the running sender.
+  '''
+  def __init__(self, reddit, db = os.path.join('docs', 'outbox.db'),
+               rate = RATE, concurrency = CONCURRENCY, progress = None):
+    '''
+      Opens the outbox and starts the event loop thread, which picks up any
+      messages left unsent by a previous run.
+
+      Arguments:
+        reddit: reddit instance to send through.
+        db: [String] path of the SQLite outbox.
+        rate: [Float] messages per second allowed.
+        concurrency: [Int] number of messages in flight at once.
+        progress: callable given a [Dict] of status -> [Int] count after every
+          batch of sends.
+    '''
+    self.r = reddit
+    self.conn = sqlite3.connect(db, check_same_thread = False)
+    self.lock = thrd.Lock()
+    with self.lock, self.conn:
+      self.conn.execute('CREATE TABLE IF NOT EXISTS outbox (key TEXT PRIMARY '
+                        'KEY, recipient TEXT, subject TEXT, body TEXT, '
+                        'status TEXT, attempts INTEGER DEFAULT 0, sent REAL, '
+                        'due REAL DEFAULT 0)')
+      columns = [c[1] for c in self.conn.execute('PRAGMA table_info(outbox)')]
+      if 'due' not in columns:  # Outbox of a version without retry backoff
+        self.conn.execute('ALTER TABLE outbox ADD COLUMN due REAL DEFAULT 0')
+    self.limiter = RateLimiter(rate)
+    self.concurrency = concurrency
+    self.progress = progress
+    self.loop = asyncio.new_event_loop()
+    self._wake = asyncio.Event()
+    self._idle = thrd.Event()
+    self.thread = thrd.Thread(target = self.loop.run_forever, name = 'notifier')
+    self.thread.daemon = True
+    self.thread.start()
+    self._start()
+
+  def send(self, messages):
+    '''
+      Queues messages to be sent. Keys that are already in the outbox are
+      ignored, so queueing a round's pairings again doesn't resend them.
+
+      Arguments:
+        messages: iterable of ([String] key, [String] recipient, [String]
+          subject, [String] body).
+    '''
+    rows = [m + ('queued',) for m in messages]
+    with self.lock, self.conn:
+      self.conn.executemany('INSERT OR IGNORE INTO outbox (key, recipient, '
+                            'subject, body, status) VALUES (?, ?, ?, ?, ?)',
+                            rows)
+      self._idle.clear()
+    self.loop.call_soon_threadsafe(self._wake.set)
+
+  def counts(self):
+    '''
+      Returns: [Dict] of status ('queued', 'sending', 'sent' or 'failed') ->
+        [Int] number of messages
+    '''
+    with self.lock:
+      return dict(self.conn.execute('SELECT status, COUNT(*) FROM outbox '
+                                    'GROUP BY status'))
+
+  def wait(self, timeout = None):
+    '''
+      Blocks until every queued message has been sent or has failed.
+
+      Returns: [Boolean] False if the timeout ran out first
+    '''
+    return self._idle.wait(timeout)
+
+  def _start(self):
+    '''
+      Starts the sender on the event loop, watched by _stopped().
+    '''
+    self.sender = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+    self.sender.add_done_callback(self._stopped)
+
+  def _stopped(self, future):
+    '''
+      Called when the sender stops, which it only does on an error: logs the
+      error and starts the sender again after BACKOFF seconds.
+    '''
+    if future.cancelled(): return
+    _log('sender stopped, restarting', future.exception())
+    self.loop.call_soon_threadsafe(self.loop.call_later, BACKOFF, self._start)
+
+  def _execute(self, sql, params = ()):
+    with self.lock, self.conn:
+      return self.conn.execute(sql, params).fetchall()
+
+  def _recover(self):
+    '''
+      Settles the messages a crash left in 'sending': those that show up in
+      the bot's sent messages are marked sent, the rest are queued again.
+    '''
+    if not self._execute("SELECT 1 FROM outbox WHERE status = 'sending'"):
+      return
+    sent = set()
+    if hasattr(self.r, 'get_sent'):
+      for m in self.r.get_sent(limit = None):
+        ref = _refRe.search(m.body)
+        if ref: sent.add(ref.group(1))
+    for key, in self._execute("SELECT key FROM outbox "
+                              "WHERE status = 'sending'"):
+      self._execute('UPDATE outbox SET status = ? WHERE key = ?',
+                    ('sent' if key in sent else 'queued', key))
+
+  def _claim(self):
+    '''
+      Marks the next batch of queued messages that are due as being sent.
+
+      Returns: [List] of ([String] key, recipient, subject, body, [Int]
+        attempts)
+    '''
+    with self.lock, self.conn:
+      rows = self.conn.execute("SELECT key, recipient, subject, body, attempts "
+                               "FROM outbox WHERE status = 'queued' AND "
+                               "due <= ? ORDER BY rowid LIMIT ?",
+                               (time.time(), self.concurrency * 4)).fetchall()
+      self.conn.executemany("UPDATE outbox SET status = 'sending' "
+                            "WHERE key = ?", [(r[0],) for r in rows])
+    return rows
+
+  def _nextDue(self):
+    '''
+      Flags the notifier idle if no message is queued.
+
+      Returns: [Float] time the next queued message is due at, or None
+    '''
+    with self.lock:  # send() may have queued more since _claim()
+      due, = self.conn.execute("SELECT MIN(due) FROM outbox "
+                               "WHERE status = 'queued'").fetchone()
+      if due == None: self._idle.set()
+    return due
+
+  def _retry(self, key, attempts):
+    '''
+      Records a failed attempt at sending a message: it is queued again, due
+      BACKOFF * 2 ** attempts seconds from now, or marked failed once it has
+      had MAX_ATTEMPTS.
+
+      Arguments:
+        key: [String] outbox key of the message.
+        attempts: [Int] number of attempts made before this one.
+    '''
+    status = 'failed' if attempts + 1 >= MAX_ATTEMPTS else 'queued'
+    self._execute('UPDATE outbox SET status = ?, attempts = ?, due = ? '
+                  'WHERE key = ?', (status, attempts + 1,
+                                    time.time() + BACKOFF * 2 ** attempts, key))
+
+  async def _run(self):
+    '''
+      Sends due messages batch by batch, sleeping until the next one is due
+      (or indefinitely while the outbox is empty). An error handling one
+      message is logged and the message retried; it doesn't hold up the rest.
+    '''
+    await self.loop.run_in_executor(None, self._recover)
+    sem = asyncio.Semaphore(self.concurrency)
+    while True:
+      self._wake.clear()
+      rows = self._claim()
+      if not rows:
+        due = self._nextDue()
+        try:
+          await asyncio.wait_for(self._wake.wait(), None if due == None
+                                 else max(0, due - time.time()))
+        except asyncio.TimeoutError: pass
+        continue
+      errors = await asyncio.gather(*(self._deliver(sem, row) for row in rows),
+                                    return_exceptions = True)
+      for row, error in zip(rows, errors):
+        if isinstance(error, Exception):
+          _log('delivering {} failed'.format(row[0]), error)
+          self._retry(row[0], row[4])
+      if self.progress != None:
+        try: self.progress(self.counts())
+        except Exception as e: _log('progress callback failed', e)
+
+  async def _deliver(self, sem, row):
+    '''
+      Sends one message, retrying it later (see _retry()) if reddit fails.
+    '''
+    key, recipient, subject, body, attempts = row
+    async with sem:
+      await self.limiter.acquire()
+      try:
+        await self.loop.run_in_executor(None, self.r.send_message, recipient,
+                                        subject, body + FOOTER.format(key))
+      except Exception:
+        self._retry(key, attempts)
+      else:
+        self._execute("UPDATE outbox SET status = 'sent', attempts = ?, "
+                      "sent = ? WHERE key = ?", (attempts + 1, time.time(),
+                                                 key))
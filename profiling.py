@@ -0,0 +1,133 @@
+import cProfile
+import datetime
+import os
+import pstats
+import re
+import threading as thrd
+
+# Deepest stack written to the collapsed-stack file, and cutoff below which a
+# stack's share of a function's time is dropped.
+MAX_DEPTH = 64
+MIN_SHARE = 1e-7
+
+class TaskProfiler:
+  '''
+    Runtime-switchable cProfile hook for daemon tasks. While disarmed, the only
+    cost per task is a single attribute check in wants().
+
+    Attributes:
+      outDir: [String] of the directory profiles are written to.
+      remaining: [Int] of the number of matching tasks still to be profiled.
+      pattern: compiled [re.Pattern] a task name must match to be profiled, or
+        None to profile any task.
+      written: [List] of the base paths (without extension) of every profile
+        written so far.
+  '''
+  def __init__(self, outDir = os.path.join('docs', 'profiles')):
+    '''
+      Initializes a disarmed profiler.
+
+      Arguments:
+        outDir: [String] of the directory profiles are written to.
+    '''
+    self.outDir = outDir
+    self.remaining = 0
+    self.pattern = None
+    self.written = []
+    self._lock = thrd.Lock()
+
+  def arm(self, count = 1, match = None):
+    '''
+      Profiles the next count tasks whose name matches match.
+
+      Arguments:
+        count: [Int] of the number of tasks to profile. 0 disarms.
+        match: [String] regular expression searched for in the task name, or
+          None to match every task.
+    '''
+    with self._lock:
+      self.pattern = re.compile(match) if match else None
+      self.remaining = count
+
+  def wants(self, name):
+    '''
+      Checks whether the task with the given name should be profiled, and if
+      so uses up one of the remaining profiles.
+
+      Arguments:
+        name: [String] name of the task about to run.
+
+      Returns: [Boolean]
+    '''
+    if not self.remaining: return False
+    with self._lock:
+      if not self.remaining: return False
+      if self.pattern != None and not self.pattern.search(name): return False
+      self.remaining -= 1
+      return True
+
+  def run(self, name, task):
+    '''
+      Runs task under cProfile, then writes <name>-<timestamp>.pstats and a
+      .collapsed text file of semicolon-joined stacks with their self time in
+      microseconds (the format flame graph tools read). Exceptions raised by
+      task are passed on after the profile is written.
+
+      Arguments:
+        name: [String] name of the task.
+        task: callable taking no arguments.
+    '''
+    prof = cProfile.Profile()
+    try:
+      prof.runcall(task)
+    finally:
+      os.makedirs(self.outDir, exist_ok = True)
+      stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+      base = os.path.join(self.outDir, '{}-{}'.format(
+                          re.sub(r'\W+', '_', name), stamp))
+      prof.dump_stats(base + '.pstats')
+      with open(base + '.collapsed', 'w') as f:
+        for stack, us in sorted(collapsedStacks(prof).items()):
+          f.write('{} {}\n'.format(stack, us))
+      self.written.append(base)
+
+def _label(func):
+  '''
+    Returns: [String] of "file:line(function)" for a pstats function key,
+    without any semicolons.
+  '''
+  filename, line, fname = func
+  return '{}:{}({})'.format(os.path.basename(filename), line,
+                            fname).replace(';', ',')
+
+def collapsedStacks(prof):
+  '''
+    Approximates full call stacks from a profile. cProfile only keeps
+    caller -> callee edges, so each function's self time is split between its
+    callers in proportion to the cumulative time of each edge, all the way up
+    to the root.
+
+    Arguments:
+      prof: [cProfile.Profile] that has finished running.
+
+    Returns: [Dict] of "root;...;leaf" [String] -> self time in microseconds
+      as an [Int]
+  '''
+  stats = pstats.Stats(prof).stats
+  out = {}
+
+  def climb(func, path, weight):
+    callers = stats[func][4] if func in stats else {}
+    parents = [(c, e[3]) for c, e in callers.items() if c not in path]
+    total = sum(ct for _, ct in parents)
+    if not parents or total <= 0 or len(path) >= MAX_DEPTH:
+      key = ';'.join(_label(f) for f in reversed(path))
+      out[key] = out.get(key, 0) + weight
+      return
+    for c, ct in parents:
+      share = weight * ct / total
+      if share >= MIN_SHARE: climb(c, path + [c], share)
+
+  for func, (cc, nc, tt, ct, callers) in stats.items():
+    if tt > 0: climb(func, [func], tt)
+  return {k: int(v * 1e6) for k, v in out.items() if int(v * 1e6) > 0}
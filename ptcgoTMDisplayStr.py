@@ -12,6 +12,8 @@ strMenuTourny = """    S - View current tournament status
     M - Manual tournament adjustments
     X - End tournament early
     Q - Quit bot"""
+strStatusMetrics = "Daemon task metrics"
+strStatusMetricsExit = "    (Press any key to return to the main menu...)"
 strCreateTournyName = """    Hello there! Glad to meet you! Welcome to the /r/ PTCGO Tournament Manager! I'll be helping you manage your next tournament. At any time during this tournament setup, you can press 'Esc' to cancel and return to the main menu.
 
     But first, tell me a little about the tournament you're planning. Now tell me: what will the tournament's name be? (name will be formatted as "[name] Tournament")
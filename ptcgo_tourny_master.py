@@ -6,7 +6,9 @@
 """
 import curses
 import datetime
+import apiserver
 import os
+import sys
 import tourny_daemon
 
 from ptcgoTMDisplayStr import *
@@ -98,9 +100,33 @@ def mainMenu():
     c = body.getkey()
     if c.lower() == 'n':
       newTournament()
+    elif c.lower() == 's' and n:
+      statusScreen()
     elif c.lower() == 'q':
       exit(1)
     
+def statusScreen():
+  '''
+    Displays the daemon's task metrics (queue depths and task latencies) in the
+    body, refreshing every second until a key is pressed.
+  '''
+  body.timeout(1000)
+  while True:
+    body.clear()
+    body.addstr(0, (curses.COLS - len(strStatusMetrics)) // 2 - 1,
+                strStatusMetrics)
+    for i, line in enumerate(daemon.getMetricsLines()[:curses.LINES - 11]):
+      body.addstr(i + 2, 0, line[:curses.COLS - 1])
+    body.addstr(curses.LINES - 8, 0, strStatusMetricsExit)
+    body.refresh()
+    try:
+      body.getkey()
+      break
+    except curses.error:  # No key pressed before the timeout
+      continue
+  body.timeout(-1)
+  returnToMain()
+    
 def paintHeader():
   '''
     Displays the header in the header.
@@ -174,7 +200,15 @@ def newTournament():
   body.addstr(printLong(strCreateTournyName, width = curses.COLS))
   new_name = inputText(strCreateTournyNameConfirm) + " Tournament"
   
-def main(stdscr):
+def main(stdscr, attach = False):
+  '''
+    Runs the UI.
+
+    Arguments:
+      stdscr: [curses.window] from curses.wrapper().
+      attach: False to run the daemon in this process, or the address of a
+        daemon started with apiserver.py (None for the default socket).
+  '''
   global daemon, header, body
   
   stdscr = curses.initscr()
@@ -188,16 +222,23 @@ def main(stdscr):
   setCursor(0)
   curses.cbreak()
   
-  daemon = tourny_daemon.TDaemon()
+  if attach != False: daemon = apiserver.ApiClient(attach)
+  else: daemon = tourny_daemon.TDaemon()
   mainMenu()  #TODO: Add dropdown menus to the body (or header?)
   
   curses.nocbreak()
   stdscr.keypad(0)
   setCursor(1)
   curses.endwin()
-  daemon.answerQ.join()
-  daemon.q.join()
+  if attach != False: daemon.close()
+  else:
+    daemon.answerQ.join()
+    daemon.q.join()
     
 if __name__ == '__main__':
+  # --attach [socket path] runs the UI as a client of a daemon started with
+  # apiserver.py instead of running the daemon in this process.
+  attach = False
+  if sys.argv[1:2] == ['--attach']: attach = (sys.argv[2:3] or [None])[0]
   setShorterEscDelay()
-  curses.wrapper(main)
\ No newline at end of file
+  curses.wrapper(main, attach)
\ No newline at end of file
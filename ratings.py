@@ -0,0 +1,279 @@
+import itertools
+import numpy as np
+import os
+import sqlite3
+
+# Glicko-2 constants
+SCALE = 173.7178
+DEFAULT_RATING = 1500.0
+DEFAULT_RD = 350.0
+DEFAULT_VOL = 0.06
+TAU = 0.5  # Constrains how quickly volatility can change
+EPSILON = 1e-6
+
+def splitResults(matches):
+  '''
+    Splits match rows into what ratePeriod() takes.
+
+    Arguments:
+      matches: iterable of ([String] player1, [String] player2, [String]
+        winner or None for a double loss).
+
+    Returns: ([List] of (winner, loser), [List] of (player1, player2) double
+      losses)
+  '''
+  results, doubleLosses = [], []
+  for p1, p2, w in matches:
+    if w == None: doubleLosses.append((p1, p2))
+    else: results.append((w, p1 if w == p2 else p2))
+  return results, doubleLosses
+
+def _g(phi):
+  return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+class RatingStore:
+  '''
+    Glicko-2 ratings of every player who ever played, kept across tournaments.
+    Ratings are held as arrays indexed by player, and a whole rating period
+    (a round) is rated in one vectorized update.
+
+    Attributes:
+      conn: [sqlite3.Connection] to the ratings database.
+      index: [Dict] of lowercased player name -> row in the arrays.
+      names: [List] of player names, by row.
+      mu: [numpy.ndarray] of Glicko-2 scale ratings.
+      phi: [numpy.ndarray] of Glicko-2 scale rating deviations.
+      sigma: [numpy.ndarray] of volatilities.
+      games: [numpy.ndarray] of the number of rated games played.
+      rated: [Set] of the (tournament, round) rating periods already applied.
+  '''
+  def __init__(self, db = os.path.join('docs', 'ratings.db')):
+    '''
+      Loads the ratings database (creating it if needed).
+
+      Arguments:
+        db: [String] path of the SQLite ratings database.
+    '''
+    self.conn = sqlite3.connect(db, check_same_thread = False)
+    with self.conn:
+      self.conn.execute('CREATE TABLE IF NOT EXISTS ratings (player TEXT '
+                        'PRIMARY KEY, rating REAL, rd REAL, volatility REAL, '
+                        'games INTEGER)')
+      self.conn.execute('CREATE TABLE IF NOT EXISTS periods (tournament TEXT, '
+                        'round INTEGER, PRIMARY KEY (tournament, round))')
+    self.rated = set(self.conn.execute('SELECT tournament, round '
+                                       'FROM periods'))
+    rows = self.conn.execute('SELECT player, rating, rd, volatility, games '
+                             'FROM ratings').fetchall()
+    self.names = [r[0] for r in rows]
+    self.index = {n: i for i, n in enumerate(self.names)}
+    data = np.array([r[1:] for r in rows], dtype = float).reshape(-1, 4)
+    self.mu = (data[:, 0] - DEFAULT_RATING) / SCALE
+    self.phi = data[:, 1] / SCALE
+    self.sigma = data[:, 2].copy()
+    self.games = data[:, 3].astype(np.int64)
+
+  def _rows(self, players):
+    '''
+      Returns the array rows of players, adding new players at the default
+      rating.
+
+      Arguments:
+        players: iterable of [String] names.
+
+      Returns: [numpy.ndarray] of row indices
+    '''
+    rows = []
+    new = 0
+    for p in players:
+      p = p.lower()
+      i = self.index.get(p)
+      if i == None:
+        i = self.index[p] = len(self.names)
+        self.names.append(p)
+        new += 1
+      rows.append(i)
+    if new:
+      self.mu = np.concatenate((self.mu, np.zeros(new)))
+      self.phi = np.concatenate((self.phi, np.full(new, DEFAULT_RD / SCALE)))
+      self.sigma = np.concatenate((self.sigma, np.full(new, DEFAULT_VOL)))
+      self.games = np.concatenate((self.games, np.zeros(new, dtype = np.int64)))
+    return np.array(rows, dtype = np.intp)
+
+  def rating(self, player):
+    '''
+      Returns: ([Float] rating, [Float] rating deviation) of player, or the
+        defaults if they've never played
+    '''
+    i = self.index.get(player.lower())
+    if i == None: return DEFAULT_RATING, DEFAULT_RD
+    return (float(self.mu[i] * SCALE + DEFAULT_RATING),
+            float(self.phi[i] * SCALE))
+
+  def seed(self, players):
+    '''
+      Orders players for seeding, best first, by conservative rating (rating
+      minus twice the deviation) so unproven players aren't seeded high.
+
+      Arguments:
+        players: iterable of [String] names.
+
+      Returns: [List] of [String]
+    '''
+    players = list(players)
+    conservative = [r - 2 * rd for r, rd in map(self.rating, players)]
+    order = sorted(range(len(players)), key = lambda i: -conservative[i])
+    return [players[i] for i in order]
+
+  def ratePeriod(self, results, save = True, doubleLosses = (),
+                 period = None):
+    '''
+      Applies one rating period (e.g. a round) of results in a single
+      vectorized Glicko-2 update. Every known player who didn't play has their
+      deviation grow.
+
+      Arguments:
+        results: iterable of ([String] winner, [String] loser) pairs.
+        save: [Boolean] flag indicating if the ratings should be written to
+          the database afterwards.
+        doubleLosses: iterable of ([String], [String]) pairs of players who
+          both lost their match (nobody reported it), scored as a loss for
+          each.
+        period: ([String] tournament, [Int] round) the results are from,
+          recorded in rated so it is only ever applied once, or None.
+    '''
+    if period != None: self.rated.add(tuple(period))
+    results = list(results)
+    doubleLosses = list(doubleLosses)
+    if not results and not doubleLosses:
+      if save: self.save()
+      return
+    w = self._rows([r[0] for r in results] + [d[0] for d in doubleLosses])
+    l = self._rows([r[1] for r in results] + [d[1] for d in doubleLosses])
+    n = len(self.names)
+    # Every game seen from both sides: player, opponent, score
+    me = np.concatenate((w, l))
+    opp = np.concatenate((l, w))
+    score = np.concatenate((np.ones(len(results)),
+                            np.zeros(len(w) - len(results)), np.zeros(len(l))))
+    mu, phi, sigma = self.mu, self.phi, self.sigma
+    g = _g(phi[opp])
+    e = 1 / (1 + np.exp(-g * (mu[me] - mu[opp])))
+    played = np.bincount(me, minlength = n) > 0
+    vinv = np.bincount(me, weights = g * g * e * (1 - e), minlength = n)
+    v = 1 / np.where(played, vinv, 1)  # Only meaningful where played
+    gain = np.bincount(me, weights = g * (score - e), minlength = n)
+    delta = v * gain
+    newSigma = sigma.copy()
+    p = np.nonzero(played)[0]
+    newSigma[p] = self._volatility(phi[p], sigma[p], v[p], delta[p])
+    phiStar = np.sqrt(phi ** 2 + newSigma ** 2)
+    newPhi = np.where(played, 1 / np.sqrt(1 / phiStar ** 2 + 1 / v), phiStar)
+    self.mu = mu + np.where(played, newPhi ** 2 * gain, 0)
+    self.phi = np.minimum(newPhi, DEFAULT_RD / SCALE)
+    self.sigma = newSigma
+    self.games = self.games + np.bincount(me, minlength = n)
+    if save: self.save()
+
+  def _volatility(self, phi, sigma, v, delta):
+    '''
+      Vectorized Illinois iteration of step 5 of Glicko-2 for every player
+      who played this period.
+
+      Returns: [numpy.ndarray] of new volatilities
+    '''
+    a = np.log(sigma ** 2)
+    def f(x):
+      ex = np.exp(x)
+      return (ex * (delta ** 2 - phi ** 2 - v - ex) /
+              (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / TAU ** 2)
+    A = a.copy()
+    big = delta ** 2 > phi ** 2 + v
+    B = np.where(big, np.log(np.maximum(delta ** 2 - phi ** 2 - v, 1e-300)),
+                 a - TAU)
+    k = np.ones_like(a)
+    for _ in range(100):  # Bracket B for the players that didn't take the log
+      todo = ~big & (f(a - k * TAU) < 0)
+      if not todo.any(): break
+      k += todo
+    B = np.where(big, B, a - k * TAU)
+    fA, fB = f(A), f(B)
+    for _ in range(100):
+      todo = np.abs(B - A) > EPSILON
+      if not todo.any(): break
+      C = A + (A - B) * fA / (fB - fA)
+      fC = f(C)
+      swap = fC * fB <= 0
+      A = np.where(todo, np.where(swap, B, A), A)
+      fA = np.where(todo, np.where(swap, fB, fA / 2), fA)
+      B = np.where(todo, C, B)
+      fB = np.where(todo, fC, fB)
+    return np.exp(A / 2)
+
+  def save(self):
+    '''
+      Writes every rating and rated period to the database in one
+      transaction.
+    '''
+    rows = zip(self.names, (self.mu * SCALE + DEFAULT_RATING).tolist(),
+               (self.phi * SCALE).tolist(), self.sigma.tolist(),
+               self.games.tolist())
+    with self.conn:
+      self.conn.executemany('INSERT OR REPLACE INTO ratings VALUES '
+                            '(?, ?, ?, ?, ?)', rows)
+      self.conn.executemany('INSERT OR IGNORE INTO periods VALUES (?, ?)',
+                            self.rated)
+
+  def reset(self):
+    '''
+      Forgets every rating, e.g. before replaying the whole history.
+    '''
+    self.names, self.index = [], {}
+    self.mu, self.phi, self.sigma = np.zeros(0), np.zeros(0), np.zeros(0)
+    self.games = np.zeros(0, dtype = np.int64)
+    self.rated = set()
+    with self.conn:
+      self.conn.execute('DELETE FROM ratings')
+      self.conn.execute('DELETE FROM periods')
+
+  def replay(self, periods, keys = ()):
+    '''
+      Rebuilds every rating from scratch from the full history of results,
+      saving only once at the end.
+
+      Arguments:
+        periods: iterable of rating periods in chronological order, each an
+          iterable of ([String] winner, [String] loser) pairs, or a
+          (results, doubleLosses) tuple of two such iterables (see
+          ratePeriod()).
+        keys: iterable of the (tournament, round) of each period, recorded
+          in rated.
+    '''
+    self.reset()
+    for results in periods:
+      if isinstance(results, tuple):
+        self.ratePeriod(results[0], save = False, doubleLosses = results[1])
+      else:
+        self.ratePeriod(results, save = False)
+    self.rated.update(map(tuple, keys))
+    self.save()
+
+  def replayResults(self, conn):
+    '''
+      Rebuilds every rating from the confirmed matches and double losses of a
+      results database (see results.ResultIngester), one rating period per
+      tournament round. Rounds with matches still pending or disputed are
+      left out, as the daemon only rates a round once it is settled.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the results database.
+    '''
+    rows = conn.execute('SELECT tournament, round, player1, player2, winner, '
+                        'status FROM matches ORDER BY rowid')
+    keys, periods = [], []
+    for key, games in itertools.groupby(rows, key = lambda r: (r[0], r[1])):
+      games = list(games)
+      if any(g[5] in ('pending', 'disputed') for g in games): continue
+      keys.append(key)
+      periods.append(splitResults(g[2:5] for g in games))
+    self.replay(periods, keys)
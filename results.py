@@ -0,0 +1,388 @@
+import os
+import re
+import sqlite3
+
+_userRe = re.compile(r'/?u/([\w-]+)', re.I)
+_beatRe = re.compile(r'/?u/([\w-]+)\s+(?:beat|defeated|won against)\s+/?u/'
+                     r'([\w-]+)', re.I)
+_lostRe = re.compile(r'\b(lost|lose|loss|defeated by|beaten by)\b', re.I)
+_wonRe = re.compile(r'\b(won|win|beat|defeated|victory)\b', re.I)
+
+class Report:
+  '''
+    A single player's claim about the result of their match.
+
+    Attributes:
+      reporter: [String] lowercased name of the player who reported.
+      winner: [String] lowercased name of the claimed winner.
+      loser: [String] lowercased name of the claimed loser.
+      source: id of the comment the report came from.
+      created: [Float] created_utc of the comment, or None if unknown.
+  '''
+  def __init__(self, reporter, winner, loser, source = None, created = None):
+    self.reporter = reporter
+    self.winner = winner
+    self.loser = loser
+    self.source = source
+    self.created = created
+
+  def pair(self):
+    '''
+      Returns: [frozenset] of the two players of the match.
+    '''
+    return frozenset((self.winner, self.loser))
+
+def parseReport(author, body, source = None, created = None):
+  '''
+    Reads a match report out of a comment. Understands "/u/a beat /u/b" as
+    well as the author's own "won against /u/b" or "lost to /u/b".
+
+    Arguments:
+      author: [String] name of the commenter.
+      body: [String] text of the comment.
+      source: id of the comment.
+      created: [Float] created_utc of the comment.
+
+    Returns: [Report], or None if the comment isn't a match report
+  '''
+  author = author.lower()
+  m = _beatRe.search(body)
+  if m:
+    return Report(author, m.group(1).lower(), m.group(2).lower(), source,
+                  created)
+  others = [u.lower() for u in _userRe.findall(body) if u.lower() != author]
+  if not others: return None
+  if _lostRe.search(body):
+    return Report(author, others[0], author, source, created)
+  if _wonRe.search(body):
+    return Report(author, author, others[0], source, created)
+  return None
+
+class Match:
+  '''
+    A pending match and the reports received for it so far.
+
+    Attributes:
+      round: [Int] round the match is part of.
+      players: ([String], [String]) lowercased names of the two players.
+      claims: [Dict] of reporter -> [String] claimed winner.
+      reported: [Dict] of reporter -> [Float] created_utc of their report, or
+        None if unknown.
+  '''
+  def __init__(self, round, player1, player2):
+    self.round = round
+    self.players = (player1.lower(), player2.lower())
+    self.claims = {}
+    self.reported = {}
+
+  def key(self):
+    '''
+      Returns: ([Int] round, [frozenset] of the two players)
+    '''
+    return self.round, frozenset(self.players)
+
+class ResultIngester:
+  '''
+    Batched match result pipeline. Pending matches are indexed by round and
+    player pair, along with the open rounds of each pair, so each report is
+    matched in constant time (to the pair's earliest open match, should they
+    meet again in a later round); matches where both players agree are
+    confirmed, disagreements are queued for judges, and every confirmed
+    result of a batch is written to the standings in a single transaction.
+    Claims are stored too, so a match reported by one player still goes
+    their way at the deadline after a restart or failover.
+
+    Attributes:
+      tournament: [String] name of the tournament results are recorded for.
+      conn: [sqlite3.Connection] to the results database (tables matches,
+        standings and claims).
+      pending: [Dict] of ([Int] round, [frozenset] player pair) -> [Match]
+        not yet confirmed.
+      disputes: [Dict] of ([Int] round, [frozenset] player pair) -> [Match]
+        whose reports disagree, waiting for a judge.
+      unmatched: [List] of [Report]s that didn't belong to any pending match.
+  '''
+  def __init__(self, tournament, db = os.path.join('docs', 'results.db')):
+    '''
+      Opens (or creates) the results database.
+
+      Arguments:
+        tournament: [String] name of the tournament.
+        db: [String] path of the SQLite results database.
+    '''
+    self.tournament = tournament
+    self.conn = sqlite3.connect(db, check_same_thread = False)
+    with self.conn:
+      self.conn.execute('CREATE TABLE IF NOT EXISTS matches (tournament TEXT, '
+                        'round INTEGER, player1 TEXT, player2 TEXT, '
+                        'winner TEXT, status TEXT, '
+                        'PRIMARY KEY (tournament, round, player1, player2))')
+      self.conn.execute('CREATE TABLE IF NOT EXISTS standings ('
+                        'tournament TEXT, player TEXT, '
+                        'wins INTEGER DEFAULT 0, losses INTEGER DEFAULT 0, '
+                        'PRIMARY KEY (tournament, player))')
+      self.conn.execute('CREATE TABLE IF NOT EXISTS claims (tournament TEXT, '
+                        'round INTEGER, player1 TEXT, player2 TEXT, '
+                        'reporter TEXT, winner TEXT, created REAL, '
+                        'PRIMARY KEY (tournament, round, player1, player2, '
+                        'reporter))')
+    self.unmatched = []
+    self._loadOpen()
+
+  def _loadOpen(self):
+    '''
+      (Re)builds pending and disputes, with their claims, from the matches
+      and claims tables.
+    '''
+    self.pending = {}
+    self.disputes = {}
+    self._rounds = {}
+    for rnd, p1, p2, status in self.conn.execute(
+        'SELECT round, player1, player2, status FROM matches '
+        "WHERE tournament = ? AND status IN ('pending', 'disputed')",
+        (self.tournament,)):
+      m = Match(rnd, p1, p2)
+      (self.disputes if status == 'disputed' else self.pending)[m.key()] = m
+      self._rounds.setdefault(m.key()[1], set()).add(rnd)
+    for rnd, p1, p2, reporter, winner, created in self.claimRows():
+      key = (rnd, frozenset((p1, p2)))
+      m = self.pending.get(key) or self.disputes.get(key)
+      if m == None: continue
+      m.claims[reporter] = winner
+      m.reported[reporter] = created
+
+  def _first(self, matches, pair):
+    '''
+      Returns: [Match] of the earliest round of a player pair in matches
+        (pending or disputes), or None
+    '''
+    for rnd in sorted(self._rounds.get(pair, ())):
+      if (rnd, pair) in matches: return matches[(rnd, pair)]
+    return None
+
+  def _close(self, m):
+    '''
+      Takes a settled match out of pending or disputes.
+    '''
+    key = m.key()
+    self.pending.pop(key, None)
+    self.disputes.pop(key, None)
+    rounds = self._rounds.get(key[1])
+    if rounds != None:
+      rounds.discard(m.round)
+      if not rounds: del self._rounds[key[1]]
+
+  def claimRows(self):
+    '''
+      Returns: [List] of (round, player1, player2, reporter, winner, created)
+        claim rows of the tournament
+    '''
+    return self.conn.execute('SELECT round, player1, player2, reporter, '
+                             'winner, created FROM claims WHERE tournament = ?',
+                             (self.tournament,)).fetchall()
+
+  def rows(self):
+    '''
+      Returns: ([List] of (round, player1, player2, winner, status) match
+        rows, [List] of (player, wins, losses) standings rows) of the
+        tournament
+    '''
+    matches = self.conn.execute('SELECT round, player1, player2, winner, '
+                                'status FROM matches WHERE tournament = ?',
+                                (self.tournament,)).fetchall()
+    standings = self.conn.execute('SELECT player, wins, losses FROM standings '
+                                  'WHERE tournament = ?',
+                                  (self.tournament,)).fetchall()
+    return matches, standings
+
+  def restore(self, matches, standings, claims = ()):
+    '''
+      Replaces the tournament's matches, standings and claims, e.g. with a
+      copy replicated from another daemon (see standby.py).
+
+      Arguments:
+        matches: iterable of (round, player1, player2, winner, status).
+        standings: iterable of (player, wins, losses).
+        claims: iterable of (round, player1, player2, reporter, winner,
+          created), see claimRows().
+    '''
+    t = self.tournament
+    with self.conn:
+      for table in ('matches', 'standings', 'claims'):
+        self.conn.execute('DELETE FROM {} WHERE tournament = ?'.format(table),
+                          (t,))
+      self.conn.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?)',
+                            [(t,) + tuple(m) for m in matches])
+      self.conn.executemany('INSERT INTO standings VALUES (?, ?, ?, ?)',
+                            [(t,) + tuple(s) for s in standings])
+      self.conn.executemany('INSERT INTO claims VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [(t,) + tuple(c) for c in claims])
+    self._loadOpen()
+
+  def addPairings(self, round, pairs):
+    '''
+      Registers a round's pairings as pending matches.
+
+      Arguments:
+        round: [Int] round number.
+        pairs: iterable of ([String], [String]) player pairs.
+    '''
+    matches = [Match(round, a, b) for a, b in pairs]
+    with self.conn:
+      self.conn.executemany('INSERT OR IGNORE INTO matches VALUES '
+                            "(?, ?, ?, ?, NULL, 'pending')",
+                            [(self.tournament, round) + m.players
+                             for m in matches])
+      self.conn.executemany('INSERT OR IGNORE INTO standings (tournament, '
+                            'player) VALUES (?, ?)',
+                            [(self.tournament, p) for m in matches
+                             for p in m.players])
+    for m in matches:
+      self.pending[m.key()] = m
+      self._rounds.setdefault(m.key()[1], set()).add(round)
+
+  def ingest(self, reports):
+    '''
+      Processes a batch of reports. Matches both players agree on are
+      confirmed and written to the standings together at the end; those they
+      disagree on move to disputes.
+
+      Arguments:
+        reports: iterable of [Report].
+
+      Returns: [List] of ([Match], [String] winner) confirmed by this batch
+    '''
+    confirmed, disputed, claims = [], [], []
+    for r in reports:
+      pair = r.pair()
+      m = self._first(self.pending, pair)
+      if m == None or r.reporter not in m.players:
+        m = self._first(self.disputes, pair)
+        if m != None:
+          m.claims[r.reporter] = r.winner
+          claims.append((m, r))
+        else:
+          self.unmatched.append(r)
+        continue
+      m.claims[r.reporter] = r.winner
+      m.reported[r.reporter] = r.created
+      claims.append((m, r))
+      if len(m.claims) < 2: continue
+      del self.pending[m.key()]
+      if len(set(m.claims.values())) == 1:
+        self._close(m)
+        confirmed.append((m, r.winner))
+      else:
+        self.disputes[m.key()] = m
+        disputed.append(m)
+    self._apply(confirmed, disputed, claims = claims)
+    return confirmed
+
+  def ingestComments(self, comments):
+    '''
+      Parses and ingests a batch of comments (anything with author, body and
+      id attributes). Comments that aren't match reports are skipped.
+
+      Returns: [List] of ([Match], [String] winner) confirmed by this batch
+    '''
+    reports = (parseReport(str(c.author), c.body, c.id,
+                           getattr(c, 'created_utc', None)) for c in comments)
+    return self.ingest(r for r in reports if r != None)
+
+  def resolve(self, player1, player2, winner, round = None):
+    '''
+      Records a judge's ruling on a disputed (or still pending) match.
+
+      Arguments:
+        player1, player2: [String] names of the match's players.
+        winner: [String] name of the player the judge awarded the match to.
+        round: [Int] round of the match, or None for the pair's earliest
+          open match.
+
+      Returns: [Boolean] indicating a matching match was found
+    '''
+    pair = frozenset((player1.lower(), player2.lower()))
+    winner = winner.lower()
+    if winner not in pair:
+      raise ValueError('{} is not a player of the match of {} and {}'.format(
+                       winner, player1, player2))
+    if round == None:
+      m = self._first(self.disputes, pair) or self._first(self.pending, pair)
+    else:
+      m = self.disputes.get((round, pair)) or self.pending.get((round, pair))
+    if m == None: return False
+    self._close(m)
+    self._apply([(m, winner)], [])
+    return True
+
+  def expire(self, matches):
+    '''
+      Settles pending matches that weren't confirmed by their round's
+      deadline, all in one transaction. A player whose report was made by the
+      deadline (going by the comment's created_utc, not by when it was
+      processed) was active, so the match goes the way they claimed; a match
+      nobody reported in time is a double loss.
+
+      Arguments:
+        matches: iterable of ([Match] still pending, [Float] deadline as a
+          UTC timestamp).
+
+      Returns: ([List] of ([Match], [String] winner) awarded, [List] of
+        [Match] double losses)
+    '''
+    awarded, doubleLosses = [], []
+    for m, deadline in matches:
+      if m.key() not in self.pending: continue
+      self._close(m)
+      onTime = [w for p, w in m.claims.items()
+                if m.reported.get(p) == None or m.reported[p] <= deadline]
+      if onTime: awarded.append((m, onTime[0]))
+      else: doubleLosses.append(m)
+    self._apply(awarded, [], doubleLosses)
+    return awarded, doubleLosses
+
+  def _apply(self, confirmed, disputed, doubleLosses = (), claims = ()):
+    '''
+      Writes a batch of confirmed results, newly disputed matches, double
+      losses and ([Match], [Report]) claims in one transaction.
+    '''
+    if not confirmed and not disputed and not doubleLosses and not claims:
+      return
+    t = self.tournament
+    with self.conn:
+      self.conn.executemany('INSERT OR REPLACE INTO claims VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?)',
+                            [(t, m.round) + m.players +
+                             (r.reporter, r.winner, r.created)
+                             for m, r in claims])
+      self.conn.executemany("UPDATE matches SET status = 'double loss' WHERE "
+                            "tournament = ? AND round = ? AND player1 = ? AND "
+                            "player2 = ?",
+                            [(t, m.round) + m.players for m in doubleLosses])
+      self.conn.executemany('UPDATE standings SET losses = losses + 1 WHERE '
+                            'tournament = ? AND player = ?',
+                            [(t, p) for m in doubleLosses for p in m.players])
+      self.conn.executemany("UPDATE matches SET winner = ?, "
+                            "status = 'confirmed' WHERE tournament = ? AND "
+                            "round = ? AND player1 = ? AND player2 = ?",
+                            [(w, t, m.round) + m.players for m, w in confirmed])
+      self.conn.executemany("UPDATE matches SET status = 'disputed' WHERE "
+                            "tournament = ? AND round = ? AND player1 = ? AND "
+                            "player2 = ?",
+                            [(t, m.round) + m.players for m in disputed])
+      self.conn.executemany('UPDATE standings SET wins = wins + 1 WHERE '
+                            'tournament = ? AND player = ?',
+                            [(t, w) for m, w in confirmed])
+      self.conn.executemany('UPDATE standings SET losses = losses + 1 WHERE '
+                            'tournament = ? AND player = ?',
+                            [(t, p) for m, w in confirmed for p in m.players
+                             if p != w])
+
+  def standings(self):
+    '''
+      Returns: [List] of ([String] player, [Int] wins, [Int] losses), best
+        record first
+    '''
+    return self.conn.execute('SELECT player, wins, losses FROM standings '
+                             'WHERE tournament = ? ORDER BY wins DESC, '
+                             'losses ASC, player', (self.tournament,)).fetchall()
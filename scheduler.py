@@ -0,0 +1,129 @@
+import collections
+import queue
+import threading as thrd
+import time
+
+# Task priorities, most urgent first
+INTERACTIVE = 0  # UI queries someone is waiting on
+# Time-critical tournament events (round starts, pairings, deadline sweeps),
+# and tasks of threads that must never block (the watcher's archiving,
+# progress updates while the queue is full)
+ROUND = 1
+BULK = 2  # Everything else (result batches, rulings, requested archiving)
+PRIORITIES = ('interactive', 'round', 'bulk')
+
+# Seconds a task of each priority has to wait to be treated as one priority
+# level more urgent, so bulk work is never starved. 0 means no aging.
+AGING = (0, 5.0, 30.0)
+
+class TaskQueue:
+  '''
+    Priority queue of daemon tasks with the queue.Queue task_done()/join()
+    interface. Tasks of the same priority run in the order they were queued.
+    Between priorities the most urgent one wins, after aging: every AGING
+    seconds a task has waited makes it count as one level more urgent.
+
+    The queue is bounded for bulk work only: once maxsize tasks are queued,
+    bulk producers block until the worker catches up. Interactive and round
+    tasks, and tasks queued by the worker itself (which would deadlock), are
+    always accepted.
+
+    Attributes:
+      maxsize: [Int] number of queued tasks at which bulk producers block.
+      aging: [Tuple] of [Float] seconds, per priority (see AGING).
+      queues: [List] of [collections.deque] of ([Float] perf_counter() queued
+        at, task), one per priority.
+      blocked: [Int] number of times a producer had to wait for room.
+  '''
+  def __init__(self, maxsize = 10000, aging = AGING):
+    '''
+      Initializes an empty queue.
+
+      Arguments:
+        maxsize: [Int] number of queued tasks at which bulk producers block.
+        aging: [Tuple] of [Float] seconds, per priority (see AGING).
+    '''
+    self.maxsize = maxsize
+    self.aging = aging
+    self.queues = [collections.deque() for p in PRIORITIES]
+    self.blocked = 0
+    self._size = 0
+    self._unfinished = 0
+    self._consumer = None
+    self._mutex = thrd.Lock()
+    self._notEmpty = thrd.Condition(self._mutex)
+    self._notFull = thrd.Condition(self._mutex)
+    self._allDone = thrd.Condition(self._mutex)
+
+  def put(self, task, priority = BULK, block = True, timeout = None):
+    '''
+      Queues a task.
+
+      Arguments:
+        task: callable taking no arguments.
+        priority: [Int] one of INTERACTIVE, ROUND or BULK.
+        block: [Boolean] flag indicating if a bulk put should wait for room
+          when the queue is full, instead of raising queue.Full.
+        timeout: [Float] most seconds to wait for room, or None.
+    '''
+    with self._notFull:
+      if (priority == BULK and self._size >= self.maxsize and
+          thrd.get_ident() != self._consumer):
+        if not block: raise queue.Full
+        self.blocked += 1
+        if not self._notFull.wait_for(lambda: self._size < self.maxsize,
+                                      timeout):
+          raise queue.Full
+      self.queues[priority].append((time.perf_counter(), task))
+      self._size += 1
+      self._unfinished += 1
+      self._notEmpty.notify()
+
+  def get(self):
+    '''
+      Takes the most urgent task, waiting for one if the queue is empty.
+
+      Returns: (task, [Int] priority, [Float] perf_counter() it was queued at)
+    '''
+    with self._notEmpty:
+      self._consumer = thrd.get_ident()
+      self._notEmpty.wait_for(lambda: self._size)
+      now = time.perf_counter()
+      best = bestScore = None
+      for p, q in enumerate(self.queues):
+        if not q: continue
+        score = p - (now - q[0][0]) / self.aging[p] if self.aging[p] else p
+        if best == None or score < bestScore: best, bestScore = p, score
+      queued, task = self.queues[best].popleft()
+      self._size -= 1
+      self._notFull.notify()
+      return task, best, queued
+
+  def task_done(self):
+    '''
+      Marks a task taken with get() as finished.
+    '''
+    with self._allDone:
+      self._unfinished -= 1
+      if self._unfinished == 0: self._allDone.notify_all()
+
+  def join(self):
+    '''
+      Blocks until every queued task has been taken and marked done.
+    '''
+    with self._allDone:
+      self._allDone.wait_for(lambda: self._unfinished == 0)
+
+  def qsize(self):
+    '''
+      Returns: [Int] number of queued tasks
+    '''
+    with self._mutex:
+      return self._size
+
+  def depths(self):
+    '''
+      Returns: [List] of [Int] number of queued tasks, per priority
+    '''
+    with self._mutex:
+      return [len(q) for q in self.queues]
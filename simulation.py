@@ -0,0 +1,414 @@
+'''
+  End-to-end tournament load generator. Runs TDaemon on a virtual clock
+  against an in-memory fake of reddit, generating synthetic signups,
+  decklists and match reports, and reports throughput and per-stage latency.
+
+  Usage: python simulation.py [players] [seed]
+'''
+import archetypes
+import cardex
+import clock
+import datetime
+import decklist
+import functools
+import itertools
+import matchups
+import random
+import results
+import scheduler
+import sys
+import time
+import tourny_daemon
+import validation
+
+from config_bot import TZ_OFFSET
+
+class FakeComment:
+  '''
+    In-memory stand-in for a reddit comment.
+
+    Attributes:
+      id: [String] unique id.
+      author: [String] name of the commenter.
+      body: [String] text of the comment.
+      created: [datetime.datetime] virtual time the comment was made.
+      created_utc: [Float] the same as a UTC timestamp, as reddit gives it.
+  '''
+  def __init__(self, id, author, body, created):
+    self.id = id
+    self.author = author
+    self.body = body
+    self.created = created
+    self.created_utc = created.timestamp()
+
+class FakeMessage:
+  '''
+    In-memory stand-in for a sent private message.
+  '''
+  def __init__(self, dest, subject, body):
+    self.dest = dest
+    self.subject = subject
+    self.body = body
+
+class FakeSubmission:
+  '''
+    In-memory stand-in for a reddit self post.
+
+    Attributes:
+      id: [String] unique id.
+      title: [String] title of the post.
+      selftext: [String] body of the post.
+      comments: [List] of [FakeComment].
+  '''
+  def __init__(self, reddit, id, title, selftext):
+    self.reddit = reddit
+    self.id = id
+    self.title = title
+    self.selftext = selftext
+    self.comments = []
+
+  def add_comment(self, text, author = None):
+    '''
+      Comments on the post, as the bot unless author is given.
+
+      Returns: [FakeComment]
+    '''
+    c = FakeComment(self.reddit._newId(), author or self.reddit.user, text,
+                    self.reddit.clock.now())
+    self.comments.append(c)
+    self.reddit._call('add_comment')
+    return c
+
+  def edit(self, text):
+    self.selftext = text
+    self.reddit._call('edit')
+
+class FakeReddit:
+  '''
+    In-memory stand-in for the praw.Reddit calls the bot makes. Every call is
+    counted, and can be given an artificial latency to mimic the network.
+
+    Attributes:
+      clock: [clock.Clock] used to timestamp posts and comments.
+      latency: [Float] seconds every call sleeps for (real time).
+      calls: [Dict] of call name -> [Int] number of calls made.
+      submissions: [Dict] of id -> [FakeSubmission].
+      inbox: [List] of (recipient, subject, message) [Tuple]s sent.
+  '''
+  def __init__(self, clock = clock.Clock(), latency = 0.0):
+    self.clock = clock
+    self.latency = latency
+    self.calls = {}
+    self.submissions = {}
+    self.inbox = []
+    self.user = None
+    self._ids = itertools.count(1)
+
+  def _newId(self):
+    return format(next(self._ids), 'x')
+
+  def _call(self, name):
+    self.calls[name] = self.calls.get(name, 0) + 1
+    if self.latency: time.sleep(self.latency)
+
+  def login(self, username, password):
+    self._call('login')
+    self.user = username
+
+  def is_logged_in(self):
+    self._call('is_logged_in')
+    return self.user != None
+
+  def submit(self, subreddit, title, text = None):
+    '''
+      Returns: [FakeSubmission] of the new self post.
+    '''
+    self._call('submit')
+    s = FakeSubmission(self, self._newId(), title, text or '')
+    self.submissions[s.id] = s
+    return s
+
+  def get_submission(self, submission_id):
+    self._call('get_submission')
+    return self.submissions[submission_id]
+
+  def send_message(self, recipient, subject, message):
+    self._call('send_message')
+    self.inbox.append((recipient, subject, message))
+
+  def get_sent(self, limit = 25):
+    '''
+      Returns: [List] of [FakeMessage]s sent, newest first
+    '''
+    self._call('get_sent')
+    sent = [FakeMessage(*m) for m in reversed(self.inbox)]
+    return sent if limit == None else sent[:limit]
+
+def syntheticDecklists(conn, index, rng):
+  '''
+    Endless generator of PTCGO-export formatted decklists, built from random
+    decks of the cardex dump.
+
+    Arguments:
+      conn: [sqlite3.Connection] to the card database.
+      index: [decklist.CardIndex] whose set codes are used.
+      rng: [random.Random] to draw decks with.
+
+    Returns: generator of [String]
+  '''
+  codes = {}
+  for code, setId in sorted(index.sets.items(), key = lambda kv: len(kv[0])):
+    codes.setdefault(setId, code)
+  for code, setId in index.sets.items():
+    if code in decklist.PTCGO_SET_CODES.values(): codes[setId] = code
+  names = {(s, n): name for s, n, name in conn.execute(
+           'SELECT set_id, number, name FROM cards_names '
+           'WHERE local_language_id = 2')}
+  decks = {}
+  for deck, setId, number, qty in conn.execute('SELECT deck_id, set_id, '
+                                               'card_number, quantity FROM '
+                                               'decks_lists'):
+    if (setId, number) in names:
+      decks.setdefault(deck, []).append('* {} {} {} {}'.format(qty,
+                       names[(setId, number)], codes.get(setId, 'UNK'), number))
+  decks = list(decks.values())
+  while True: yield '\n'.join(rng.choice(decks))
+
+class Simulation:
+  '''
+    A full simulated tournament.
+
+    Attributes:
+      players: [Int] number of players that sign up.
+      batch: [Int] number of signups or reports handled per daemon task.
+      disagree: [Float] probability that the loser of a match reports the
+        opposite result.
+      noshow: [Float] probability that nobody reports a match, and again that
+        only its winner does.
+      daemon: [tourny_daemon.TDaemon] under test.
+      reddit: [FakeReddit] the daemon talks to.
+      clock: [clock.VirtualClock] driving the tournament.
+      decks: [Dict] of player -> parsed [decklist.Decklist] (empty when
+        decklists are off).
+      validations: [validation.ValidationCache] the decklists are validated
+        through (None when decklists are off).
+      archetypes: [archetypes.ArchetypeClusters] the decklists are clustered
+        into as they are submitted, seeded with the cardex decks (None when
+        decklists are off).
+      matchups: [matchups.MatchupMatrix] of the type matchups between the
+        submitted decks, previewed in pairings posts (None when decklists are
+        off).
+      alive: [List] of the [String] names of the players still in.
+      round: [Int] current round.
+      pairs: [List] of the current round's ([String], [String]) pairings.
+      counts: [Dict] of stage name -> [Int] items processed.
+  '''
+  def __init__(self, players = 1000, seed = 0, decklists = True, batch = 50,
+               disagree = 0.02, noshow = 0.01,
+               rlength = datetime.timedelta(days = 3), latency = 0.0):
+    '''
+      Sets up the daemon, fake reddit and virtual clock.
+
+      Arguments:
+        players: [Int] number of players that sign up.
+        seed: [Int] seed for every random choice.
+        decklists: [Boolean] flag indicating if signups include decklists
+          (needs the card database).
+        batch: [Int] number of signups or reports handled per daemon task.
+        disagree: [Float] probability that the loser of a match reports the
+          opposite result.
+        noshow: [Float] probability that nobody reports a match, and again
+          that only its winner does. Those are settled by the deadline sweep.
+        rlength: [datetime.timedelta] of a round.
+        latency: [Float] real seconds every fake reddit call takes.
+    '''
+    self.players = players
+    self.batch = batch
+    self.disagree = disagree
+    self.noshow = noshow
+    self.rng = random.Random(seed)
+    start = datetime.datetime(2015, 7, 19, 10, tzinfo = TZ_OFFSET)
+    self.clock = clock.VirtualClock(start - datetime.timedelta(weeks = 4))
+    self.reddit = FakeReddit(self.clock, latency)
+    self.reddit.login('ptcgo_tourny_bot', '')
+    self.daemon = tourny_daemon.TDaemon(self.reddit, self.clock, load = False,
+                                        resultsDb = ':memory:',
+                                        ratingsDb = ':memory:',
+                                        archiveDir = None,
+                                        statusFile = None,
+                                        outboxDb = ':memory:',
+                                        notifyRate = 1e6)
+    self.daemon.initT('Simulated Tournament', start, rlength, players)
+    self.decklists = decklists
+    self.decks = {}
+    self.alive = []
+    self.round = 0
+    self.pairs = []
+    self.counts = {}
+    self._index = None
+    self.validations = None
+    self.archetypes = None
+    self.matchups = None
+
+  def _count(self, stage, n):
+    '''
+      Adds n to the number of items processed by stage.
+    '''
+    self.counts[stage] = self.counts.get(stage, 0) + n
+
+  ##############################################################################
+  ## Stages. These run as daemon tasks so the daemon's metrics time them.     ##
+  ##############################################################################
+  def signupStage(self, comments):
+    '''
+      Signs up the authors of a batch of signup comments, parsing their
+      decklists.
+    '''
+    for c in comments:
+      self.alive.append(c.author)
+      if self._index != None:
+        self.decks[c.author] = self._index.parse(c.body)
+        if self.validations.validate(self.decks[c.author]):
+          self._count('illegalDecks', 1)
+        self.archetypes.add(c.author, self.decks[c.author].counts())
+        self.matchups.add(c.author, self.decks[c.author].counts())
+    self._count('signupStage', len(comments))
+
+  def pairStage(self, post):
+    '''
+      Pairs the remaining players and edits the pairings into the round's
+      post. The first round is seeded by rating (best against worst), later
+      rounds pair winners at random. The last player gets a bye if there's an
+      odd number.
+    '''
+    if self.round == 1:
+      seeded = self.daemon.ratings.seed(self.alive)
+      half = (len(seeded) + 1) // 2
+      top, bottom = seeded[:half], seeded[half:][::-1]
+      self.alive = [p for pair in zip(top, bottom) for p in pair]
+      self.alive += top[len(bottom):]
+    else:
+      self.rng.shuffle(self.alive)
+    self.pairs = list(zip(self.alive[::2], self.alive[1::2]))
+    lines = ['/u/{} vs /u/{}'.format(a, b) for a, b in self.pairs]
+    if self.matchups != None:
+      lines = [l + ' ({})'.format(self.matchups.preview(a, b))
+               if a in self.matchups.index and b in self.matchups.index else l
+               for l, (a, b) in zip(lines, self.pairs)]
+    if len(self.alive) % 2: lines.append('/u/{} has a bye'.format(
+                                         self.alive[-1]))
+    post.edit('\n'.join(lines))
+    self.daemon._addPairingsQ(self.round, self.pairs,
+                              self.alive[len(self.pairs) * 2:])
+    self.daemon.notifyPairings(self.round, self.pairs,
+                               self.alive[len(self.pairs) * 2:])
+    self._count('pairStage', len(self.pairs))
+
+  def judgeStage(self, comments, byes):
+    '''
+      Stands in for the judges at the end of a round: every disputed match is
+      awarded to whoever reported first, then the winners move on.
+    '''
+    res = self.daemon.results
+    first = {}
+    for c in comments:
+      r = results.parseReport(c.author, c.body)
+      first.setdefault(r.pair(), r.winner)
+    self._count('disputes', len(res.disputes))
+    for (rnd, pair), m in list(res.disputes.items()):
+      res.resolve(m.players[0], m.players[1], first[pair], rnd)
+    winners = res.conn.execute('SELECT winner FROM matches WHERE tournament = ? '
+                               'AND round = ?', (res.tournament, self.round))
+    self.alive = [w for w, in winners if w != None] + byes
+
+  def run(self):
+    '''
+      Runs the whole tournament: signups, then every round's pairings and
+      match reports, until one player is left or the rounds run out.
+
+      Returns: [List] of [String] report lines (see report())
+    '''
+    d = self.daemon
+    real = time.perf_counter()
+    if self.decklists:
+      conn = cardex.connect()
+      self._index = decklist.CardIndex(conn)
+      self.validations = validation.ValidationCache(
+                           validation.Validator(conn))
+      self.archetypes = archetypes.ArchetypeClusters.fromCardex(conn)
+      self.matchups = matchups.MatchupMatrix(conn)
+      lists = syntheticDecklists(conn, self._index, self.rng)
+    d.q.join()
+    t = d.t
+    self.clock.set(t.signupdt)
+    post = self.reddit.submit('ptcgo', 'Signups for the ' + t.name)
+    signups = [post.add_comment(next(lists) if self.decklists else 'In!',
+                                author = 'player{}'.format(i))
+               for i in range(self.players)]
+    for i in range(0, len(signups), self.batch):
+      d._putTask(functools.partial(self.signupStage,
+                                   signups[i:i + self.batch]))
+    d.q.join()
+    for r in range(1, t.numrounds + 1):
+      if len(self.alive) < 2: break
+      self.round = r
+      self.clock.set(t.timeline[r - 1])
+      post = self.reddit.submit('ptcgo', 'Round {} of the {}'.format(r, t.name))
+      d._putTask(functools.partial(self.pairStage, post))
+      d.q.join()
+      byes = self.alive[len(self.pairs) * 2:]
+      reports = []
+      for a, b in self.pairs:
+        w, l = (a, b) if self.rng.random() < 0.5 else (b, a)
+        self.clock.advance(t.rlength / (len(self.pairs) * 2 + 1))
+        show = self.rng.random()
+        if show < self.noshow: continue
+        reports.append(post.add_comment('Won against /u/{} 2-1'.format(l),
+                                        author = w))
+        if show < 2 * self.noshow: continue
+        if self.rng.random() < self.disagree: text = 'Won against /u/{} 2-0'
+        else: text = 'Lost to /u/{} 1-2'
+        reports.append(post.add_comment(text.format(w), author = l))
+      for i in range(0, len(reports), self.batch):
+        d.reportResults(reports[i:i + self.batch])
+      d.q.join()
+      self.clock.set(t.timeline[r])  # Unreported matches expire
+      d._putTask(d._sweepQ, scheduler.ROUND)
+      d._putTask(functools.partial(self.judgeStage, reports, byes))
+      d.q.join()
+      self._count('_reportResultsQ', len(reports))
+    self.clock.set(t.timeline[-1])
+    d.notifier.wait()
+    d.q.join()
+    self.realSeconds = time.perf_counter() - real
+    return self.report()
+
+  def report(self):
+    '''
+      Formats throughput and per-stage latency of the last run().
+
+      Returns: [List] of [String]
+    '''
+    d = self.daemon
+    span = self.clock.now() - d.t.signupdt
+    out = ['{} players, {} virtual days in {:.2f}s real time'.format(
+           self.players, span.days, self.realSeconds),
+           'Reddit calls: ' + ', '.join('{} {}'.format(k, v) for k, v in
+                                        sorted(self.reddit.calls.items()))]
+    for stage, n in sorted(self.counts.items()):
+      if stage not in d.metrics.tasks:
+        out.append('{}: {}'.format(stage, n))
+        continue
+      out.append('{}: {} items, {:.0f} items/s'.format(stage, n,
+                 n / max(d.metrics.tasks[stage].run.total, 1e-9)))
+    if self.validations != None: out += self.validations.lines()
+    if self.archetypes != None:
+      out += self.archetypes.lines(self.decks)
+      out += self.matchups.report(self.archetypes.archetypes(self.decks),
+                                  self.archetypes.archetypeNames).split('\n')
+    return out + d.getMetricsLines()
+
+if __name__ == '__main__':
+  players = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+  print('\n'.join(Simulation(players, seed).run()))
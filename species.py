@@ -0,0 +1,83 @@
+import attacks
+import cardex
+import numpy as np
+
+class SpeciesTable:
+  '''
+    Column arrays over cards_species, one entry per card sorted by card key,
+    so that species based rules (no legendaries, Gen 1 only, no dual types...)
+    are array masks instead of pokedex lookups card by card.
+
+    Attributes:
+      cardKey: [numpy.ndarray] of int64 card keys (see attacks.cardKey), sorted.
+      species: [numpy.ndarray] of int32 base species id, 0 for cards that
+        aren't Pokemon.
+      form: [numpy.ndarray] of int32 forme id (Megas, Primals...), 0 for the
+        base forme.
+      generation: [numpy.ndarray] of int8 generation of the base species.
+      types: [numpy.ndarray] of int16 pokedex type ids, shape (cards, 2), 0
+        for no second type.
+      legendary: [numpy.ndarray] of bool.
+  '''
+  def __init__(self, conn = None):
+    '''
+      Loads cards_species into arrays.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+    '''
+    if conn == None: conn = cardex.connect()
+    rows = conn.execute('SELECT * FROM cards_species '
+                        'ORDER BY set_id, number').fetchall()
+    data = np.array(rows, dtype = np.int32).reshape(-1, 8)
+    self.cardKey = attacks.cardKey(data[:, 0], data[:, 1])
+    self.species = data[:, 2].copy()
+    self.form = data[:, 3].copy()
+    self.generation = data[:, 4].astype(np.int8)
+    self.types = data[:, 5:7].astype(np.int16)
+    self.legendary = data[:, 7].astype(bool)
+
+  def __len__(self):
+    return len(self.cardKey)
+
+  def rows(self, keys):
+    '''
+      Finds the entries of card keys.
+
+      Arguments:
+        keys: [numpy.ndarray] of int64 card keys.
+
+      Returns: ([numpy.ndarray] of indices into the columns, [numpy.ndarray]
+        of bool flagging the keys that were found)
+    '''
+    idx = np.searchsorted(self.cardKey, keys)
+    idx[idx == len(self.cardKey)] = 0
+    return idx, self.cardKey[idx] == keys
+
+  def cardsWhere(self, mask):
+    '''
+      Returns: [numpy.ndarray] of the card keys for which mask is True.
+    '''
+    return self.cardKey[mask]
+
+  def pokemon(self):
+    '''
+      Returns: [numpy.ndarray] of bool, True for Pokemon cards
+    '''
+    return self.species != 0
+
+  def outsideGenerations(self, generations):
+    '''
+      Mask of the Pokemon not from the given generations, e.g. (1,) for a
+      "Gen 1 only" rule.
+
+      Returns: [numpy.ndarray] of bool
+    '''
+    return self.pokemon() & ~np.isin(self.generation, list(generations))
+
+  def dualType(self):
+    '''
+      Returns: [numpy.ndarray] of bool, True for Pokemon with two types
+    '''
+    return self.types[:, 1] != 0
@@ -0,0 +1,368 @@
+'''
+  Hot standby for TDaemon. The primary streams every change of its
+  tournament state (settings, matches, standings and claims) to any connected
+  standby over a local socket, with a heartbeat in between. A standby keeps a
+  warm in-memory copy and, once heartbeats stop for TIMEOUT seconds, starts
+  its own daemon from it.
+
+  Fencing: every daemon that talks to reddit holds an epoch from a shared
+  lease file, and every reddit call first checks that its epoch is still the
+  latest. A standby taking over bumps the epoch, so a primary that is merely
+  stuck (not dead) can never post again once it wakes up.
+
+  Usage:
+    python standby.py primary [host:port] [lease file] [--fake]
+    python standby.py standby [host:port] [lease file] [--fake]
+  --fake talks to simulation.FakeReddit with in-memory databases, for
+  testing the failover with two local processes.
+'''
+import concurrent.futures
+import functools
+import json
+import os
+import socket
+import sys
+import threading as thrd
+import time
+
+import scheduler
+import tourny_daemon
+
+try:
+  import fcntl
+except ImportError:  # Windows: lease updates are only atomic, not locked
+  fcntl = None
+
+LEASE = os.path.join('docs', 'lease.txt')
+ADDRESS = ('127.0.0.1', 8614)
+HEARTBEAT = 0.5  # Seconds between two messages from the primary
+TIMEOUT = 3.0  # Seconds without a message after which the standby takes over
+
+# Replicated row tables, by the number of leading columns keying a row
+ROWS = {'matches': 3, 'standings': 1, 'claims': 4}
+
+class Fenced(Exception):
+  '''
+    Raised by a reddit call of a daemon whose epoch has been superseded.
+  '''
+  pass
+
+class Lease:
+  '''
+    Epoch counter shared through a file. The daemon holding the highest epoch
+    is the only one allowed to talk to reddit.
+
+    Attributes:
+      path: [String] of the lease file.
+  '''
+  def __init__(self, path = LEASE):
+    self.path = path
+
+  def current(self):
+    '''
+      Returns: [Int] the latest epoch handed out, 0 if none
+    '''
+    try:
+      with open(self.path) as f: return int(f.read() or 0)
+    except FileNotFoundError:
+      return 0
+
+  def acquire(self):
+    '''
+      Hands out a new epoch, fencing off every holder of an older one.
+
+      Returns: [Int] the new epoch
+    '''
+    with open(self.path + '.lock', 'w') as lock:
+      if fcntl != None: fcntl.flock(lock, fcntl.LOCK_EX)
+      epoch = self.current() + 1
+      with open(self.path + '.tmp', 'w') as f: f.write(str(epoch))
+      os.replace(self.path + '.tmp', self.path)
+      return epoch
+
+class Fence:
+  '''
+    Wraps a reddit instance (and every object it returns) so that each call
+    raises Fenced instead of going out once the lease has moved past epoch.
+  '''
+  def __init__(self, obj, lease, epoch):
+    self._obj = obj
+    self._lease = lease
+    self._epoch = epoch
+
+  def __getattr__(self, name):
+    if name.startswith('__'): raise AttributeError(name)
+    value = getattr(self._obj, name)
+    if not callable(value): return value
+    def call(*args, **kwargs):
+      if self._lease.current() != self._epoch:
+        raise Fenced('Epoch {} was superseded'.format(self._epoch))
+      result = value(*args, **kwargs)
+      if result == None or isinstance(result, (bool, int, float, str, list,
+                                               tuple, dict)):
+        return result
+      return Fence(result, self._lease, self._epoch)
+    return call
+
+  def __str__(self):
+    return str(self._obj)
+
+def fence(lease):
+  '''
+    Acquires a new epoch, fencing off every older daemon, for a daemon about
+    to be started. The daemon must be handed the returned wrapper as its
+    fence argument, so that its reddit instance is fenced before anything
+    (its notifier's outbox recovery included) can post with it.
+
+    Returns: ([Int] the epoch, callable wrapping a reddit instance in a
+      [Fence] of that epoch)
+  '''
+  epoch = lease.acquire()
+  return epoch, lambda reddit: Fence(reddit, lease, epoch)
+
+def captureState(daemon):
+  '''
+    Copies a daemon's tournament state. Must run on the daemon's worker.
+
+    Returns: [Dict] with 't' (settings, or None), 'matches', 'standings' and
+      'claims'
+  '''
+  t = daemon.t
+  if t == None or daemon.results == None:
+    return {'t': None, 'matches': [], 'standings': [], 'claims': []}
+  matches, standings = daemon.results.rows()
+  return {'t': {'name': t.name, 'start': t.startdt.isoformat(),
+                'rlength': t.rlength.total_seconds(),
+                'maxplayers': t.maxplayers, 'started': t.started,
+                'numrounds': t.numrounds},
+          'matches': [list(m) for m in matches],
+          'standings': [list(s) for s in standings],
+          'claims': [list(c) for c in daemon.results.claimRows()]}
+
+def _empty():
+  return dict({table: {} for table in ROWS}, t = None)
+
+def _rows(state):
+  '''
+    Returns: [Dict] of table -> [List] of the rows of a replicated copy
+  '''
+  return {table: list(state[table].values()) for table in ROWS}
+
+def _send(sock, msg):
+  sock.sendall((json.dumps(msg, separators = (',', ':')) + '\n').encode())
+
+class Primary:
+  '''
+    Streams a daemon's state to connected standbys: the full state when one
+    connects, then only the rows that changed, with heartbeats in between.
+
+    Attributes:
+      daemon: [tourny_daemon.TDaemon] replicated.
+      lease: [Lease] the daemon's epoch comes from.
+      epoch: [Int] of the daemon.
+      standbys: [List] of connected [socket.socket]s.
+  '''
+  def __init__(self, address = ADDRESS, lease = None, daemonArgs = None):
+    '''
+      Takes a new epoch, starts a daemon fenced with it and starts listening
+      for standbys.
+
+      Arguments:
+        address: ([String] host, [Int] port) to listen on.
+        lease: [Lease] shared with the standbys. Defaults to Lease().
+        daemonArgs: [Dict] of keyword arguments for the TDaemon to replicate.
+    '''
+    self.lease = lease if lease != None else Lease()
+    self.epoch, wrap = fence(self.lease)
+    self.daemon = tourny_daemon.TDaemon(fence = wrap, **(daemonArgs or {}))
+    self.standbys = []
+    self._state = _empty()
+    self._seq = 0
+    self._seen = None
+    self._lock = thrd.Lock()
+    self.sock = socket.create_server(address)
+    for target, name in ((self._accept, 'replication accept'),
+                         (self._replicate, 'replication')):
+      th = thrd.Thread(target = target, name = name)
+      th.daemon = True
+      th.start()
+
+  def _accept(self):
+    while True:
+      conn, addr = self.sock.accept()
+      with self._lock:
+        s = self._state
+        try:
+          _send(conn, dict(_rows(s), type = 'state', epoch = self.epoch,
+                           seq = self._seq, full = True, t = s['t']))
+        except OSError:
+          continue
+        self.standbys.append(conn)
+
+  def _capture(self):
+    '''
+      Runs captureState() on the daemon's worker, as an interactive task.
+    '''
+    fut = concurrent.futures.Future()
+    self.daemon._putTask(functools.partial(self._captureQ, fut),
+                         scheduler.INTERACTIVE)
+    return fut.result(TIMEOUT)
+
+  def _captureQ(self, fut):
+    try:
+      fut.set_result(captureState(self.daemon))
+    except Exception as e:
+      fut.set_exception(e)
+
+  def _diff(self, state):
+    '''
+      Updates the replicated copy with a new capture.
+
+      Returns: [Dict] message of what changed, or None
+    '''
+    old = self._state
+    new = _empty()
+    new['t'] = state['t']
+    for table, n in ROWS.items():
+      for row in state[table]: new[table][tuple(row[:n])] = row
+    full = (old['t'] or {}).get('name') != (new['t'] or {}).get('name')
+    msg = {'type': 'state', 'full': full, 't': new['t']}
+    for table in ROWS:
+      msg[table] = [r for k, r in new[table].items()
+                    if full or old[table].get(k) != r]
+    self._state = new
+    if not full and new['t'] == old['t'] and \
+       not any(msg[table] for table in ROWS):
+      return None
+    return msg
+
+  def _replicate(self):
+    '''
+      Sends what changed after every daemon task, or a heartbeat, every
+      HEARTBEAT seconds until the daemon is fenced.
+    '''
+    while self.lease.current() == self.epoch:
+      msg = None
+      changes = self.daemon.changes
+      if changes != self._seen:
+        try:
+          state = self._capture()
+          self._seen = changes + 1  # The capture is a task too
+          with self._lock: msg = self._diff(state)
+        except Exception:
+          msg = None
+      with self._lock:
+        self._seq += 1
+        if msg == None: msg = {'type': 'heartbeat'}
+        msg.update(epoch = self.epoch, seq = self._seq)
+        for conn in list(self.standbys):
+          try:
+            _send(conn, msg)
+          except OSError:
+            self.standbys.remove(conn)
+      time.sleep(HEARTBEAT)
+    for conn in self.standbys: conn.close()  # Fenced: go quiet
+
+class Standby:
+  '''
+    Warm copy of a primary's state that takes over when the primary goes
+    silent.
+
+    Attributes:
+      state: [Dict] with 't' (settings), 'matches' ((round, player1, player2)
+        -> row), 'standings' (player -> row) and 'claims' ((round, player1,
+        player2, reporter) -> row) as last replicated.
+      epoch: [Int] of the primary being followed.
+      seq: [Int] of the last message received.
+      daemon: [tourny_daemon.TDaemon] started on takeover, else None.
+      promoted: [threading.Event] set once the standby has taken over.
+  '''
+  def __init__(self, address = ADDRESS, lease = None, timeout = TIMEOUT,
+               daemonArgs = None):
+    '''
+      Starts following the primary.
+
+      Arguments:
+        address: ([String] host, [Int] port) the primary listens on.
+        lease: [Lease] shared with the primary. Defaults to Lease().
+        timeout: [Float] seconds of silence after which to take over.
+        daemonArgs: [Dict] of keyword arguments for the TDaemon started on
+          takeover.
+    '''
+    self.address = address
+    self.lease = lease if lease != None else Lease()
+    self.timeout = timeout
+    self.daemonArgs = dict(daemonArgs or {}, load = False)
+    self.state = _empty()
+    self.epoch = None
+    self.seq = 0
+    self.daemon = None
+    self.promoted = thrd.Event()
+    self._last = time.monotonic()
+    th = thrd.Thread(target = self._follow, name = 'standby')
+    th.daemon = True
+    th.start()
+
+  def _apply(self, msg):
+    '''
+      Applies a message from the primary to the copy.
+    '''
+    self.epoch, self.seq = msg['epoch'], msg['seq']
+    if msg['type'] != 'state': return
+    if msg['full']: self.state = _empty()
+    self.state['t'] = msg['t']
+    for table, n in ROWS.items():
+      for row in msg.get(table, ()): self.state[table][tuple(row[:n])] = row
+
+  def _follow(self):
+    '''
+      Reads the primary's messages, reconnecting when the connection drops,
+      and takes over once nothing has arrived for timeout seconds.
+    '''
+    while time.monotonic() - self._last < self.timeout:
+      try:
+        with socket.create_connection(self.address, self.timeout) as sock:
+          f = sock.makefile('r')
+          for line in f:
+            self._apply(json.loads(line))
+            self._last = time.monotonic()
+      except OSError:  # Refused, reset or timed out
+        pass
+      time.sleep(HEARTBEAT / 5)
+    self.promote()
+
+  def promote(self):
+    '''
+      Takes over: fences the primary off with a new epoch, then starts a
+      daemon fenced with it from the replicated state.
+    '''
+    epoch, wrap = fence(self.lease)
+    d = tourny_daemon.TDaemon(fence = wrap, **self.daemonArgs)
+    if self.state['t'] != None:
+      d.restoreT(dict(_rows(self.state), t = self.state['t']))
+    self.daemon = d
+    self.promoted.set()
+
+if __name__ == '__main__':
+  args = [a for a in sys.argv[1:] if a != '--fake']
+  role = args[0] if args else 'standby'
+  address = ADDRESS
+  if len(args) > 1:
+    host, port = args[1].rsplit(':', 1)
+    address = (host, int(port))
+  lease = Lease(args[2]) if len(args) > 2 else Lease()
+  daemonArgs = {}
+  if '--fake' in sys.argv:
+    import simulation
+    daemonArgs = {'reddit': simulation.FakeReddit(), 'resultsDb': ':memory:',
+                  'ratingsDb': ':memory:', 'outboxDb': ':memory:',
+                  'archiveDir': None, 'statusFile': None}
+  if role == 'primary':
+    p = Primary(address, lease, daemonArgs)
+    print('Primary, epoch', p.epoch, flush = True)
+  else:
+    s = Standby(address, lease, daemonArgs = daemonArgs)
+    print('Standby following', address, flush = True)
+    s.promoted.wait()
+    print('Took over at seq', s.seq, flush = True)
+  while True: time.sleep(3600)
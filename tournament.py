@@ -1,11 +1,16 @@
+import bisect
+import clock
 import datetime
 #import formats
-import time
+import math
+import os
 
 from config_bot import TZ_OFFSET
 
 formats = ('Round robin', 'Single elimination', 'Double elimination')
 
+SIGNUP_LEAD = datetime.timedelta(weeks = 3)  # Signups open this long before
+
 class Tournament:
   '''
     Tournament object class that handles all of the finer details.
@@ -15,12 +20,19 @@ class Tournament:
     startdt: The starting date and time of the tournament. [datetime.datetime]
     rlength: Length of one round in the tournament. [datetime.timedelta]
     maxplayers: The maximum number of players allowed. 0 for no max. [Int]
+    numrounds: The number of rounds in the tournament, 0 while it isn't known
+      yet (no max, see sizeRounds()). [Int]
     winner: [String] of the name of the tournament's winner. Typically empty
       until after the tournament has ended.
+    signupdt: When signups open. [datetime.datetime]
+    timeline: Start of every round followed by the end of the last one, so
+      round n runs from timeline[n - 1] to timeline[n]. Only holds the start
+      while numrounds is 0. [List] of [datetime.datetime]
+    clock: [clock.Clock] the current time is read from.
   '''
   def __init__(self, name, startdt = datetime.datetime.now(TZ_OFFSET),
                rlength = datetime.timedelta(days = 7), maxplayers = 0, 
-               started = False):
+               started = False, numrounds = 0, clock = clock.Clock()):
     '''
       Initializes Tournament object settings.
 
@@ -32,19 +44,137 @@ class Tournament:
         maxplayers: maximum number of players allowed to join as an [int].
           0 means no max.
         started: [bool] flag indicating if the tourny has started.
+        numrounds: number of rounds as an [int]. 0 means as many as a single
+          elimination bracket of maxplayers needs or, with no max, rounds
+          keep going until sizeRounds() is given the signup count.
+        clock: [clock.Clock] to read the current time from. Simulations pass a
+          [clock.VirtualClock].
     '''
     self.name = name
     self.startdt = startdt
     self.rlength = rlength
     self.maxplayers = maxplayers
     self.started = started
+    self.numrounds = numrounds
+    if self.numrounds <= 0:
+      self.numrounds = 0
+      if maxplayers > 0: self.sizeRounds(maxplayers, False)
     self.winner = ''
+    self.clock = clock
+    self.buildTimeline()
+
+  def sizeRounds(self, players, build = True):
+    '''
+      Sets the number of rounds, if it isn't known yet, to what a single
+      elimination bracket of players needs. Tournaments with no max call this
+      with their actual signup count once they start.
+
+      Arguments:
+        players: [Int] number of players.
+        build: [bool] flag indicating if the timeline should be rebuilt.
+    '''
+    if self.numrounds > 0: return
+    self.numrounds = max(1, math.ceil(math.log2(max(players, 2))))
+    if build: self.buildTimeline()
+
+  def roundEnd(self, round):
+    '''
+      Returns: [datetime.datetime] a round ends at, even before the number of
+        rounds is known
+    '''
+    return self.startdt + self.rlength * round
+
+  def buildTimeline(self):
+    '''
+      Precomputes the start and end of every round, and when signups open and
+      close, from startdt, rlength and numrounds. Must be called again if any
+      of those change.
+    '''
+    self.signupdt = self.startdt - SIGNUP_LEAD
+    self.timeline = [self.startdt + self.rlength * i
+                     for i in range(self.numrounds + 1)]
+
+  def getEvents(self):
+    '''
+      Returns every scheduled event of the tournament in order: signups
+      opening and closing, then each round.
+
+      Returns: [List] of ([datetime.datetime] start, [datetime.datetime] end,
+        [String] summary) tuples
+    '''
+    events = [(self.signupdt, self.startdt, 'Signups for the ' + self.name)]
+    for i in range(self.numrounds):
+      events.append((self.timeline[i], self.timeline[i + 1],
+                     'Round {} of the {}'.format(i + 1, self.name)))
+    return events
+
+  def nextEvent(self, now = None):
+    '''
+      Returns the next time the current round changes (signups opening, a
+      round starting, or the last round ending), or None if the tournament is
+      over.
+
+      Arguments:
+        now: [datetime.datetime] to use as the current time. Defaults to
+          clock.now().
 
-  def save(self):
+      Returns: [datetime.datetime] or None
+    '''
+    if now == None: now = self.clock.now()
+    if now < self.signupdt: return self.signupdt
+    i = bisect.bisect_right(self.timeline, now)
+    if i < len(self.timeline): return self.timeline[i]
+    if self.numrounds == 0: return self.roundEnd(self.getRound(now))
+    return None
+
+  def toICal(self):
+    '''
+      Exports the tournament's schedule (signups and every round) as an
+      iCalendar file players can import into their calendars.
+
+      Returns: [String]
+    '''
+    fmt = '%Y%m%dT%H%M%SZ'
+    utc = datetime.timezone.utc
+    stamp = datetime.datetime.now(utc).strftime(fmt)
+    uid = ''.join(c for c in self.name.lower() if c.isalnum())
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0',
+             'PRODID:-//r/PTCGO//Tournament Manager//EN']
+    for i, (start, end, summary) in enumerate(self.getEvents()):
+      lines += ['BEGIN:VEVENT',
+                'UID:{}-{}-{}@ptcgo-tourny-master'.format(uid,
+                  self.startdt.astimezone(utc).strftime(fmt), i),
+                'DTSTAMP:' + stamp,
+                'DTSTART:' + start.astimezone(utc).strftime(fmt),
+                'DTEND:' + end.astimezone(utc).strftime(fmt),
+                'SUMMARY:' + summary.replace(',', '\\,').replace(';', '\\;'),
+                'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+  def saveICal(self, path = None):
+    '''
+      Writes toICal() to a file, by default docs/<name>.ics.
+
+      Arguments:
+        path: [String] of the file to write.
+
+      Returns: [String] of the path written to
+    '''
+    if path == None:
+      path = os.path.join('docs', self.name.replace(' ', '_') + '.ics')
+    with open(path, 'w', newline = '') as f: f.write(self.toICal())
+    return path
+
+  def save(self, path = None):
     '''
       Saves the status of the tournament to an external file.
+
+      Arguments:
+        path: [String] of the file to write. Defaults to docs/status.txt.
     '''
-    with open(os.path.join('docs', 'status.txt'), 'w') as f:
+    if path == None: path = os.path.join('docs', 'status.txt')
+    with open(path, 'w') as f:
       f.write(self.name + '\n')
       utco = self.startdt.tzinfo.utcoffset(None)
       tzo = utco.days * 24 + utco.seconds // 3600
@@ -54,25 +184,38 @@ class Tournament:
                     ' ' + str(tzo) + '\n')
       f.write(str(self.rlength.days) + '\n')
       f.write(str(self.maxplayers) + '\n')
+      f.write(str(self.numrounds) + '\n')
 
-  def getRound(self):
+  def getRound(self, now = None):
     '''
       Returns the round number as an int. If the tournament hasn't started yet,
-      returns 0.
+      returns 0. Once the last round is over, returns numrounds + 1. While
+      numrounds is 0, rounds keep counting up every rlength.
+
+      Arguments:
+        now: [datetime.datetime] to use as the current time. Defaults to
+          clock.now().
             
       Returns: [Int]
     '''
-    t = datetime.datetime.now(TZ_OFFSET)
-    if self.startdt > t: return 0
-    else: return (t - self.startdt).days // 3 + 1
+    if now == None: now = self.clock.now()
+    r = bisect.bisect_right(self.timeline, now)
+    if self.numrounds == 0 and r: return (now - self.startdt) // self.rlength + 1
+    return r
     
-  def getRoundStr(self):
+  def getRoundStr(self, now = None):
     '''
       Returns the round number as a string. If the tournament hasn't started
       yet, it's in preparation.
+
+      Arguments:
+        now: [datetime.datetime] to use as the current time. Defaults to
+          clock.now().
             
       Returns: [String]
     '''
-    r = self.getRound()
+    r = self.getRound(now)
     if r == 0: return "Prepping for the " + self.name
+    elif self.numrounds and r > self.numrounds:
+      return "The " + self.name + " is over"
     else: return "Round " + str(r) + " of the " + self.name
\ No newline at end of file
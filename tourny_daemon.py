@@ -1,6 +1,17 @@
+import archive
+import cassette
+import clock
 import datetime
+import deadlines
+import functools
+import metrics
+import notifier
 import os
+import profiling
 import queue
+import ratings
+import results
+import scheduler
 import threading as thrd
 import time
 import tournament as tnmt
@@ -13,6 +24,14 @@ with warnings.catch_warnings():
     
 from config_bot import *
 
+class _Failed:
+  '''
+    Put on answerQ in place of the answer of a task that raised, so that the
+    caller waiting for the answer re-raises the error instead of blocking.
+  '''
+  def __init__(self, error):
+    self.error = error
+
 class TDaemon:
   '''
     Daemon that takes care of the actual management, eg creating posts,
@@ -25,17 +44,103 @@ class TDaemon:
         tasks to daemon q.
       d: [threading.Thread] that executes tasks placed in its queue by either
         the main thread or the watcher thread.
-      q: daemon's [queue.Queue]
+      q: daemon's [scheduler.TaskQueue], which runs interactive queries before
+        round events before bulk work.
       answerQ: [queue.Queue] to pull and return queries from
+      metrics: [metrics.TaskMetrics] with the latency and queue depth stats of
+        every task run by d.
+      profiler: [profiling.TaskProfiler] that can be armed at runtime to
+        cProfile upcoming tasks.
+      clock: [clock.Clock] the current time is read from.
+      results: [results.ResultIngester] of the current tournament's match
+        results, or None if there's no tournament.
+      ratings: [ratings.RatingStore] of every player's rating, kept across
+        tournaments and used for seeding.
+      notifier: [notifier.Notifier] private messages to players are sent
+        through.
+      notified: [Dict] of outbox status -> [Int] number of messages, as last
+        reported by the notifier.
+      changes: [Int] number of tasks run so far, so observers (e.g.
+        apiserver.ApiServer) can tell when the state may have changed.
+      deadlines: [deadlines.DeadlineIndex] of the reminders and expiries of
+        the pending matches, swept by _sweepQ() as they come due.
+      swept: [Dict] of action ('reminders', 'awarded', 'double losses') ->
+        [Int] number taken by deadline sweeps.
   '''
-  def __init__(self):
+  # Q methods that put an answer on answerQ for a caller waiting on it
+  ANSWERING = ('_getTNameQ', '_getRoundStrQ', '_seedPlayersQ')
+
+  def __init__(self, reddit = None, clock = clock.Clock(), load = True,
+               resultsDb = os.path.join('docs', 'results.db'),
+               ratingsDb = os.path.join('docs', 'ratings.db'),
+               archiveDir = archive.ARCHIVE_DIR,
+               statusFile = os.path.join('docs', 'status.txt'),
+               outboxDb = os.path.join('docs', 'outbox.db'),
+               notifyRate = notifier.RATE, maxQueued = 10000,
+               cassettePath = None, replay = False, replaySpeed = 1.0,
+               fence = None):
     '''
       Initializes the daemon's settings.
+
+      Arguments:
+        reddit: reddit instance to use instead of connecting to reddit (e.g.
+          simulation.FakeReddit).
+        clock: [clock.Clock] to read the current time from and sleep on.
+          Simulations pass a [clock.VirtualClock].
+        load: [bool] flag indicating if a running tournament should be loaded
+          from statusFile.
+        resultsDb: [String] path of the SQLite database match results are
+          kept in.
+        ratingsDb: [String] path of the SQLite database player ratings are
+          kept in.
+        archiveDir: [String] directory finished tournaments are archived to,
+          or None to not archive them.
+        statusFile: [String] path the tournament's settings are saved to
+          (see tournament.Tournament.save()) and loaded from, or None to not
+          save them.
+        outboxDb: [String] path of the SQLite outbox of private messages.
+        notifyRate: [Float] private messages per second the notifier may
+          send.
+        maxQueued: [Int] number of queued tasks at which producers of bulk
+          tasks block until the daemon catches up.
+        cassettePath: [String] path of a cassette every reddit call is
+          recorded to (see cassette.py), or None to not record.
+        replay: [bool] flag indicating if reddit should be replayed from
+          cassettePath instead of going to the network.
+        replaySpeed: [Float] factor recorded call durations are divided by in
+          replay. 0 replays without delays.
+        fence: callable wrapping the reddit instance before anything (the
+          notifier included) uses it, e.g. to fence it off with an epoch (see
+          standby.fence()), or None.
     '''
     self.t = None
-    self.r = self._newReddit()
+    self.results = None
+    self.resultsDb = resultsDb
+    self.ratings = ratings.RatingStore(ratingsDb)
+    self.archiveDir = archiveDir
+    self.statusFile = statusFile
+    self.clock = clock
+    self.cassettePath = cassettePath
+    self.replay = replay
+    self.replaySpeed = replaySpeed
+    self.r = reddit if reddit != None else self._newReddit()
+    if fence != None: self.r = fence(self.r)
+    self.metrics = metrics.TaskMetrics()
+    self.profiler = profiling.TaskProfiler()
+    self.notified = {}
+    self.changes = 0
+    self.deadlines = deadlines.DeadlineIndex()
+    self.swept = {}
+    self._sweeping = False
+    self._reportsQueued = 0
+    self._reportsLock = thrd.Lock()
+    self._progress = {}
+    self._progressQueued = False
+    self._progressLock = thrd.Lock()
+    self.notifier = notifier.Notifier(self.r, outboxDb, notifyRate,
+                                      progress = self._notifyProgress)
     
-    self.q = queue.Queue()
+    self.q = scheduler.TaskQueue(maxQueued)
     self.d = thrd.Thread(target = self._worker, name = "daemon")
     self.d.daemon = True
     self.d.start()
@@ -46,14 +151,15 @@ class TDaemon:
     
     self.answerQ = queue.Queue()
     
-    if os.path.isfile(os.path.join('docs', 'status.txt')):
-      self.q.put(self._loadTQ())
+    if load and statusFile != None and os.path.isfile(statusFile):
+      self._putTask(self._loadTQ, scheduler.ROUND)
 
   ##############################################################################
   ## Callable methods from outside. These put the Q method into daemon's      ##
   ## queue, then waits for the answer to appear in the answerQ and returns it ##
   ##############################################################################
-  def initT(self, name, startdt, rlength, maxP = 0, started = False):
+  def initT(self, name, startdt, rlength, maxP = 0, started = False,
+            numRounds = 0):
     '''
       Initializes a Tournament object.
             
@@ -65,15 +171,18 @@ class TDaemon:
         maxP: maximum number of players allowed to join as an
           [int]. 0 means no max.
         started: [bool] flag indicating if the tourny has started.
+        numRounds: number of rounds as an [int]. 0 means as many as a single
+          elimination bracket of maxP needs.
     '''
-    self.q.put(self._initTQ(name, startdt, rlength, maxP, started))
-    self.q.put(self._saveTQ())
+    self._putTask(functools.partial(self._initTQ, name, startdt, rlength, maxP,
+                                    started, numRounds), scheduler.INTERACTIVE)
+    self._putTask(self._saveTQ, scheduler.INTERACTIVE)
   
   def saveT(self):
     '''
       Saves the status of the tournament to an external file.
     '''
-    self.q.put(self._saveTQ())
+    self._putTask(self._saveTQ, scheduler.INTERACTIVE)
   
   def getTName(self):
     '''
@@ -82,10 +191,8 @@ class TDaemon:
       
       Returns: [String] of the Tournament's name if one exists, else [Bool = F]
     '''
-    self.q.put(self._getTNameQ())
-    ans = self.answerQ.get(block = True)
-    self.answerQ.task_done()
-    return ans
+    self._putTask(self._getTNameQ, scheduler.INTERACTIVE)
+    return self._getAnswer()
     
   def getRoundStr(self):
     '''
@@ -94,55 +201,415 @@ class TDaemon:
       
       Returns: [String] 
     '''
-    self.q.put(self.t.getRoundStr())
-    ans = self.answerQ.get(block = True)
-    self.answerQ.task_done()
-    return ans
+    self._putTask(self._getRoundStrQ, scheduler.INTERACTIVE)
+    return self._getAnswer()
     
   def startT(self):
     '''
       Starts the tournament by posting a thread with matchups.
     '''
     pass
+
+  def reportResults(self, comments):
+    '''
+      Ingests a batch of match report comments: agreeing reports are
+      confirmed and applied to the standings together, disagreeing ones are
+      queued for judges. Queued as bulk work, so producers are held back
+      while the queue is full; deadline sweeps wait for the batches queued
+      before them (see _sweepQ()).
+
+      Arguments:
+        comments: iterable of comments (with author, body, id and
+          created_utc attributes).
+    '''
+    with self._reportsLock: self._reportsQueued += 1
+    self._putTask(functools.partial(self._reportResultsQ, list(comments)))
+
+  def resolveMatch(self, player1, player2, winner):
+    '''
+      Records a judge's ruling on a disputed match.
+
+      Arguments:
+        player1, player2: [String] names of the match's players.
+        winner: [String] name of the player awarded the match, one of the
+          two. Raises ValueError otherwise.
+    '''
+    if winner.lower() not in (player1.lower(), player2.lower()):
+      raise ValueError('{} is not a player of the match of {} and {}'.format(
+                       winner, player1, player2))
+    self._putTask(functools.partial(self._resolveMatchQ, player1, player2,
+                                    winner))
+
+  def notifyPairings(self, round, pairs, byes = ()):
+    '''
+      Messages every player of a round their opponent. The messages are sent
+      in the background; a round's pairings are only ever sent once per
+      player, even if this is called again.
+
+      Arguments:
+        round: [Int] round number.
+        pairs: iterable of ([String], [String]) player pairs.
+        byes: iterable of [String] names of the players with a bye.
+    '''
+    self._putTask(functools.partial(self._notifyPairingsQ, round, list(pairs),
+                                    list(byes)), scheduler.ROUND)
+
+  def addPairings(self, round, pairs, byes = ()):
+    '''
+      Registers a round's pairings as pending matches, due by the end of the
+      round. Players of matches still unreported get reminded before then,
+      and the matches are settled once it passes (see _sweepQ()). The first
+      round's players size a tournament with no max.
+
+      Arguments:
+        round: [Int] round number.
+        pairs: iterable of ([String], [String]) player pairs.
+        byes: iterable of [String] names of the players with a bye.
+    '''
+    self._putTask(functools.partial(self._addPairingsQ, round, list(pairs),
+                                    list(byes)), scheduler.ROUND)
+
+  def restoreT(self, state):
+    '''
+      Takes over a tournament from a copy of another daemon's state (see
+      standby.py), replacing any current tournament.
+
+      Arguments:
+        state: [Dict] with 't' (the tournament's settings, see
+          standby.captureState()), 'matches', 'standings' and 'claims'
+          rows.
+    '''
+    self._putTask(functools.partial(self._restoreTQ, state), scheduler.ROUND)
+
+  def archiveT(self, decks = None, archetypes = None):
+    '''
+      Archives the tournament (players, results, standings and decklists) so
+      it can still be queried once the next tournament replaces it. Finished
+      tournaments are archived automatically, without decklists; calling this
+      again replaces that partition.
+
+      Arguments:
+        decks: [Dict] of player -> [decklist.Decklist].
+        archetypes: [Dict] of player -> [Int] archetype id.
+    '''
+    self._putTask(functools.partial(self._archiveTQ, decks, archetypes))
+
+  def seedPlayers(self, players):
+    '''
+      Orders players for seeding by their rating from past tournaments, best
+      first.
+
+      Arguments:
+        players: iterable of [String] names.
+
+      Returns: [List] of [String]
+    '''
+    self._putTask(functools.partial(self._seedPlayersQ, list(players)),
+                  scheduler.INTERACTIVE)
+    return self._getAnswer()
+
+  def getMetricsLines(self):
+    '''
+      Returns the daemon's task metrics formatted for display. This reads the
+      metrics directly instead of going through the queue so that it still
+      answers quickly when the queue is backed up.
+
+      Returns: [List] of [String]
+    '''
+    self._setDepths()
+    lines = self.metrics.lines()
+    if self.q.blocked:
+      lines.append('Backpressure: producers blocked {} times'.format(
+                   self.q.blocked))
+    if self.notified:
+      lines.append('Notifications: ' + ', '.join('{} {}'.format(n, s) for s, n
+                                                 in sorted(self.notified.items())))
+    if self.swept:
+      lines.append('Deadlines: ' + ', '.join('{} {}'.format(n, s) for s, n
+                                             in sorted(self.swept.items())))
+    return lines
+
+  def profileTasks(self, count = 1, match = None):
+    '''
+      Profiles the next count tasks run by the daemon, writing a .pstats and a
+      .collapsed stack file for each to docs/profiles. Takes effect right away,
+      without going through the queue.
+
+      Arguments:
+        count: [Int] of the number of tasks to profile. 0 turns profiling off.
+        match: [String] regular expression a task's name must contain to be
+          profiled, e.g. '_saveTQ'. None profiles any task.
+    '''
+    self.profiler.arm(count, match)
     
   ##############################################################################
   ## Q methods to be placed in daemon's queue. These perform the actual tasks.##
   ##############################################################################
-  def _initTQ(self, name, startdt, rlength, maxP, started):
+  def _initTQ(self, name, startdt, rlength, maxP, started, numRounds):
     '''
       Q method for initT()
     '''
     if self.t == None:
-      self.t = tnmt.Tournament(name, startdt, rlength, maxP, started)
+      self.t = tnmt.Tournament(name, startdt, rlength, maxP, started,
+                               numRounds, self.clock)
+      self.results = results.ResultIngester(name, self.resultsDb)
+      self._indexDeadlines()
+
+  def _restoreTQ(self, state):
+    '''
+      Q method for restoreT()
+    '''
+    s = state['t']
+    self.t = tnmt.Tournament(s['name'],
+                             datetime.datetime.fromisoformat(s['start']),
+                             datetime.timedelta(seconds = s['rlength']),
+                             s['maxplayers'], s['started'], s['numrounds'],
+                             self.clock)
+    self.results = results.ResultIngester(self.t.name, self.resultsDb)
+    self.results.restore(state['matches'], state['standings'],
+                         state.get('claims', ()))
+    self._indexDeadlines()
 
   def _saveTQ(self):
     '''
       Q method for saveT()
     '''
-    pass#with open(os.path.join('docs', 'status.txt'), 'w') as f:
-      #f.write()
+    if self.t != None and self.statusFile != None:
+      self.t.save(self.statusFile)
     
   def _loadTQ(self):
     '''
       Loads up a currently running tournament (e.g. after a crash).
     '''
-    with open(os.path.join('docs', 'status.txt'), 'r') as f: s = f.read()
+    with open(self.statusFile, 'r') as f: s = f.read()
     s = s.split('\n')
     dt = [int(x) for x in s[1].split(' ')]
     tz = datetime.timezone(datetime.timedelta(hours = dt[5]))
     sdate = datetime.datetime(year = dt[0], month = dt[1], day = dt[2],
                               hour = dt[3], minute = dt[4], tzinfo = tz)
-    today = datetime.datetime.now(TZ_OFFSET)                          
+    today = self.clock.now()
+    nrounds = int(s[4]) if len(s) > 4 and s[4] else 0
     self.t =  tnmt.Tournament(s[0], sdate, datetime.timedelta(days = int(s[2])),
-                         int(s[3]), today > sdate)
+                         int(s[3]), today > sdate, nrounds, self.clock)
+    self.results = results.ResultIngester(self.t.name, self.resultsDb)
+    self._indexDeadlines()
+
+  def _reportResultsQ(self, comments):
+    '''
+      Q method for reportResults()
+    '''
+    with self._reportsLock: self._reportsQueued -= 1
+    if self.results == None: return
+    self.results.ingestComments(comments)
+    self._rateSettled()
+
+  def _resolveMatchQ(self, player1, player2, winner):
+    '''
+      Q method for resolveMatch()
+    '''
+    if self.results == None: return
+    self.results.resolve(player1, player2, winner)
+    self._rateSettled()
+
+  def _deadline(self, round):
+    '''
+      Returns: [datetime.datetime] by which a round's matches must be reported
+    '''
+    return self.t.roundEnd(round)
+
+  def _indexDeadlines(self):
+    '''
+      Rebuilds the deadline index from the current tournament's pending
+      matches, e.g. after loading it.
+    '''
+    self.deadlines.rebuild((((self.t.name, m.round) + m.players,
+                             self._deadline(m.round))
+                            for m in self.results.pending.values()),
+                           self.clock.now())
+
+  def _addPairingsQ(self, round, pairs, byes = ()):
+    '''
+      Q method for addPairings()
+    '''
+    if self.t == None or self.results == None: return
+    if round == 1 and self.t.numrounds == 0:
+      self.t.sizeRounds(2 * len(pairs) + len(byes))
+      self._saveTQ()
+    self.results.addPairings(round, pairs)
+    now = self.clock.now()
+    deadline = self._deadline(round)
+    for a, b in pairs:
+      self.deadlines.add((self.t.name, round, a.lower(), b.lower()), deadline,
+                         now)
+
+  def _sweepQ(self, deferred = False):
+    '''
+      Takes the reminders and expiries that came due from the deadline index.
+      Entries of matches reported since (or of another tournament) are
+      dropped. Still unreported players are reminded, and expired matches are
+      settled (see results.ResultIngester.expire()) in one transaction, then
+      every message of the sweep is handed to the notifier in one batch.
+
+      Sweeps are queued at round priority and so can overtake report batches
+      (bulk). A sweep that finds batches still queued moves itself to the
+      back of the bulk queue once, behind all of them, so that no match is
+      expired while its reports wait in the queue.
+
+      Arguments:
+        deferred: [bool] flag indicating the sweep was already moved back.
+    '''
+    with self._reportsLock: waiting = self._reportsQueued
+    if waiting and not deferred:
+      self._putTask(functools.partial(self._sweepQ, True))
+      return
+    self._sweeping = False
+    due = self.deadlines.popDue(self.clock.now())
+    res = self.results
+    if self.t == None or res == None or not due: return
+    remind, expire = {}, {}
+    for kind, key, when in due:
+      m = res.pending.get((key[1], frozenset(key[2:])))
+      if key[0] != res.tournament or m == None: continue
+      if kind == deadlines.EXPIRE: expire[key] = m
+      else: remind[key] = (m, when)
+    awarded, doubleLosses = res.expire(
+      (m, self._deadline(m.round).timestamp()) for m in expire.values())
+    subject = 'Round {} of the {}'
+    msgs = []
+    for key, (m, when) in remind.items():
+      if key in expire: continue
+      for me, opp in (m.players, m.players[::-1]):
+        if me in m.claims: continue
+        msgs.append(('{}:{}:remind:{}:{}'.format(self.t.name, m.round,
+                                                  when.isoformat(), me), me,
+                     subject.format(m.round, self.t.name),
+                     "Your match against /u/{} hasn't been reported yet. "
+                     'Please report it by {:%Y-%m-%d %H:%M}.'.format(opp,
+                     self._deadline(m.round))))
+    reminders = len(msgs)
+    for m, winner in awarded:
+      for me, opp in (m.players, m.players[::-1]):
+        msgs.append(('{}:{}:expired:{}'.format(self.t.name, m.round, me), me,
+                     subject.format(m.round, self.t.name),
+                     "Your match against /u/{} wasn't confirmed by the "
+                     'deadline, so it was settled on the only report: /u/{} '
+                     'wins.'.format(opp, winner)))
+    for m in doubleLosses:
+      for me, opp in (m.players, m.players[::-1]):
+        msgs.append(('{}:{}:expired:{}'.format(self.t.name, m.round, me), me,
+                     subject.format(m.round, self.t.name),
+                     'Neither you nor /u/{} reported your match by the '
+                     'deadline, so it counts as a loss for both of '
+                     'you.'.format(opp)))
+    if msgs: self.notifier.send(msgs)
+    for action, n in (('reminders', reminders),
+                      ('awarded', len(awarded)),
+                      ('double losses', len(doubleLosses))):
+      if n: self.swept[action] = self.swept.get(action, 0) + n
+    self._rateSettled()
+
+  def _notifyPairingsQ(self, round, pairs, byes):
+    '''
+      Q method for notifyPairings()
+    '''
+    if self.t == None: return
+    subject = 'Round {} of the {}'.format(round, self.t.name)
+    key = '{}:{}:'.format(self.t.name, round)
+    msgs = []
+    for a, b in pairs:
+      for me, opp in ((a, b), (b, a)):
+        msgs.append((key + me.lower(), me, subject, 'Your opponent this round '
+                     'is /u/{}. Good luck!'.format(opp)))
+    for p in byes:
+      msgs.append((key + p.lower(), p, subject, 'You have a bye this round.'))
+    self.notifier.send(msgs)
+
+  def _notifyProgress(self, counts):
+    '''
+      Called from the notifier's thread after every batch of messages it
+      sends; hands the delivery progress over to the daemon's worker. Never
+      blocks the notifier: updates are coalesced so at most one is queued,
+      and it goes in at round priority when the queue is full.
+    '''
+    with self._progressLock:
+      self._progress = counts
+      if self._progressQueued: return
+      self._progressQueued = True
+    try:
+      self.q.put(self._notifyProgressQ, block = False)
+    except queue.Full:
+      self._putTask(self._notifyProgressQ, scheduler.ROUND)
+
+  def _notifyProgressQ(self):
+    '''
+      Records the notifier's latest delivery progress.
+    '''
+    with self._progressLock:
+      self.notified = self._progress
+      self._progressQueued = False
+
+  def _archiveTQ(self, decks = None, archetypes = None):
+    '''
+      Q method for archiveT()
+    '''
+    if self.t != None and self.results != None and self.archiveDir != None:
+      archive.archiveTournament(self.t, self.results, decks, archetypes,
+                                self.archiveDir)
+
+  def _seedPlayersQ(self, players):
+    '''
+      Q method for seedPlayers()
+    '''
+    self.answerQ.put(self.ratings.seed(players))
+
+  def _rateSettled(self):
+    '''
+      Rates, in order, every round of the tournament whose matches are all
+      settled (confirmed or double losses) and that wasn't rated yet.
+      Called after anything that settles matches, so a round is rated as
+      soon as its last match is confirmed, resolved or expired. Stops at the
+      first round with a match still pending or disputed so periods are
+      rated chronologically.
+    '''
+    res = self.results
+    unsettled = {m.round for d in (res.pending, res.disputes)
+                 for m in d.values()}
+    for (round,) in res.conn.execute('SELECT DISTINCT round FROM matches '
+                                     'WHERE tournament = ? ORDER BY round',
+                                     (res.tournament,)).fetchall():
+      if round in unsettled: return
+      if (res.tournament, round) not in self.ratings.rated:
+        self._rateRound(round)
+
+  def _rateRound(self, round):
+    '''
+      Updates every player's rating with the confirmed results and double
+      losses of a settled round, as a single rating period.
+    '''
+    res = self.results
+    games = res.conn.execute("SELECT player1, player2, winner FROM matches "
+                             "WHERE tournament = ? AND round = ? AND status IN "
+                             "('confirmed', 'double loss')",
+                             (res.tournament, round))
+    won, doubleLosses = ratings.splitResults(games)
+    self.ratings.ratePeriod(won, doubleLosses = doubleLosses,
+                            period = (res.tournament, round))
 
   def _getTNameQ(self):
     '''
       Q method for getTName()
     '''
-    if self.t != None: answer = self.t.name
+    if self.t != None: ans = self.t.name
     else: ans = False
     self.answerQ.put(ans)
+
+  def _getRoundStrQ(self):
+    '''
+      Q method for getRoundStr()
+    '''
+    if self.t != None: ans = self.t.getRoundStr()
+    else: ans = "No tournament"
+    self.answerQ.put(ans)
   
   ##############################################################################
   ## Other initialization methods, mostly used with the object is first init. ##
@@ -150,21 +617,109 @@ class TDaemon:
   def _eventWatcher(self):
     '''
       Waits for datetime-based events to start (i.e. when the starting
-      datetime is reached) and passes relevant tasks to the daemon's queue.
+      datetime is reached or a round ends) and passes relevant tasks to the
+      daemon's queue.
+      Also queues a deadline sweep whenever a match reminder or expiry is due.
+      Everything is queued at round priority, which never blocks, so a backed
+      up queue can't hold up round starts or sweeps.
+      Sleeps until the tournament's next timeline event or deadline action (at
+      most a second at a time, so a newly created tournament is picked up
+      quickly).
     '''
+    lastRound = None
     while True:
-      now = datetime.datetime.now(TZ_OFFSET)
+      now = self.clock.now()
+      wait = 1
+      due = self.deadlines.next()
+      if due != None and due <= now:
+        if not self._sweeping:
+          self._sweeping = True
+          self._putTask(self._sweepQ, scheduler.ROUND)
+      elif due != None:
+        wait = min(wait, (due - now).total_seconds())
       if self.t != None:
-        if self.t.startdt >= now and not self.t.started: self.q.put(self.startT)
+        r = self.t.getRound(now)
+        if r >= 1 and not self.t.started:
+          self.t.started = True
+          self._putTask(self.startT, scheduler.ROUND)
+        if (lastRound != None and 0 < self.t.numrounds and
+            lastRound <= self.t.numrounds < r):
+          self._putTask(self._archiveTQ, scheduler.ROUND)
+        lastRound = r
+        nxt = self.t.nextEvent(now)
+        if nxt != None: wait = min(wait, (nxt - now).total_seconds())
+      self.metrics.saveIfDue()
+      self.clock.sleep(max(wait, 0))
+
+  def _putTask(self, task, priority = scheduler.BULK):
+    '''
+      Places a task in the daemon's queue. The queue stamps it with the time
+      it was queued so the worker can tell how long it waited. Bulk tasks
+      block while the queue is full.
+
+      Arguments:
+        task: callable taking no arguments.
+        priority: [Int] scheduler.INTERACTIVE, scheduler.ROUND or
+          scheduler.BULK.
+    '''
+    self.q.put(task, priority)
+
+  def _setDepths(self):
+    '''
+      Updates the depth gauges of every priority of q and of answerQ.
+    '''
+    for name, depth in zip(scheduler.PRIORITIES, self.q.depths()):
+      self.metrics.setDepth('q ' + name, depth)
+    self.metrics.setDepth('answerQ', self.answerQ.qsize())
+
+  def _getAnswer(self):
+    '''
+      Waits for the answer of the ANSWERING task just queued.
+
+      Returns: the answer, or raises the error the task raised
+    '''
+    ans = self.answerQ.get(block = True)
+    self.answerQ.task_done()
+    if isinstance(ans, _Failed): raise ans.error
+    return ans
+
+  def _taskName(self, task):
+    '''
+      Returns a readable name for a queued task, looking through
+      functools.partial wrappers.
+
+      Returns: [String]
+    '''
+    while isinstance(task, functools.partial): task = task.func
+    return getattr(task, '__name__', type(task).__name__)
       
   def _worker(self):
     '''
       Worker function put inside of a new Thread and given queue q of tasks.
+      Records how long each task waited in the queue, how long it ran and
+      whether it raised, per task and per priority, along with the depths of
+      q and answerQ. When an ANSWERING task raises, the error is handed to
+      the caller waiting on answerQ.
     '''
     while True:
-      task = self.q.get()
-      task()
-      self.q.task_done()
+      task, priority, queued = self.q.get()
+      self._setDepths()
+      name = self._taskName(task)
+      start = time.perf_counter()
+      error = None
+      try:
+        if self.profiler.wants(name): self.profiler.run(name, task)
+        else: task()
+      except Exception as e:
+        error = e
+        if name in self.ANSWERING: self.answerQ.put(_Failed(e))
+      finally:
+        end = time.perf_counter()
+        self.metrics.record(name, start - queued, end - start, error)
+        self.metrics.recordPriority(scheduler.PRIORITIES[priority],
+                                    start - queued, end - start)
+        self.changes += 1
+        self.q.task_done()
 
   def _isLoggedInReddit(self):
     '''
@@ -181,12 +736,21 @@ class TDaemon:
   def _newReddit(self):
     '''
       Creates and returns a new reddit instance, passing the bot's user_agent
-      string.
+      string. When a cassette is set the instance records every call to it,
+      or is replaced by the cassette in replay.
             
-      Returns: [praw.__init__.BaseReddit]
+      Returns: [praw.__init__.BaseReddit], [cassette.Recorder] or
+        [cassette.Player]
     '''
+    if self.cassettePath != None and self.replay:
+      r = cassette.Player(self.cassettePath, self.replaySpeed)
+      r.Reddit(user_agent = user_agent)
+      return r
     try:
-      return praw.Reddit(user_agent = user_agent)
+      r = praw.Reddit(user_agent = user_agent)
+      if self.cassettePath == None: return r
+      return cassette.Recorder(r, self.cassettePath,
+                               {'user_agent': user_agent})
     except urllib.error.URLError:
       time.sleep(time_delay)
       return self._newReddit()
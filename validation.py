@@ -0,0 +1,260 @@
+import attacks
+import cardex
+import collections
+import hashlib
+import json
+import numpy as np
+import species
+import sqlite3
+import threading as thrd
+
+# Default deck construction rules. The species rules ban legendary Pokemon,
+# Pokemon outside a list of generations and Pokemon with two types.
+RULES = {'deckSize': 60, 'maxCopies': 4, 'minBasics': 1,
+         'noLegendaries': False, 'generations': None, 'noDualTypes': False}
+
+BASIC_POKEMON = 1  # `categories`.`id`
+BASIC_ENERGY = 201
+
+def written(entry):
+  '''
+    Returns: [String] of a decklist line's card as the player wrote it, set
+      code and number included
+  '''
+  parts = (entry.name, entry.setCode, entry.number)
+  return ' '.join(p for p in parts if p != None)
+
+def deckKey(deck, fmt, rules, version):
+  '''
+    Canonical hash of everything a validation result depends on: the sorted
+    (set_id, number, quantity) multiset of the deck, the lines that couldn't
+    be resolved or were resolved inexactly, the format, the rules and the card
+    database version. Decks written in a different order or with split lines
+    hash the same.
+
+    Arguments:
+      deck: [decklist.Decklist] to validate.
+      fmt: [String] format identifier (`formats`.`identifier`).
+      rules: [Dict] of deck construction rules (see RULES).
+      version: [Int] cardex.dataVersion() the validator was built from.
+
+    Returns: [String] hex digest
+  '''
+  cards = sorted((s, n, q) for (s, n), q in deck.counts().items())
+  unresolved = sorted((e.name.lower(), e.quantity) for e in deck.unresolved)
+  inexact = sorted((written(e), e.card[0], e.card[1], e.quantity)
+                   for e in deck.entries if e.card != None and not e.exact)
+  canon = json.dumps([cards, unresolved, inexact, fmt, sorted(rules.items()),
+                      version], separators = (',', ':'))
+  return hashlib.blake2b(canon.encode('utf-8'), digest_size = 16).hexdigest()
+
+class Validator:
+  '''
+    Checks decklists against a format's legal sets and the deck construction
+    rules. Everything needed is loaded from the card database once.
+
+    Attributes:
+      version: [Int] cardex.dataVersion() the validator was built from.
+      names: [Dict] of ([Int] set_id, [Int] number) -> [String] card name,
+        English when there is one.
+      categories: [Dict] of ([Int] set_id, [Int] number) -> [Int] category.
+      formats: [Dict] of format identifier -> [Dict] of legal set_id ->
+        ([Int] first, [Int] last) legal numbers (None for no limit).
+      legalNames: [Dict] of format identifier -> [Set] of the names that have
+        a legal printing. Older printings of those are legal too.
+      species: [species.SpeciesTable] for the species rules.
+  '''
+  def __init__(self, conn = None):
+    '''
+      Loads the card names, categories and format sets.
+
+      Arguments:
+        conn: [sqlite3.Connection] to the card database. Defaults to
+          cardex.connect().
+    '''
+    if conn == None: conn = cardex.connect()
+    self.version = cardex.dataVersion(conn)
+    self.names = {}
+    for setId, number, lang, name in conn.execute(
+        'SELECT set_id, number, local_language_id, name FROM cards_names'):
+      if lang == cardex.ENGLISH or (setId, number) not in self.names:
+        self.names[(setId, number)] = name
+    self.categories = {(s, n): c for s, n, c in conn.execute(
+                       'SELECT set_id, number, category_id FROM cards')}
+    self.formats = {}
+    for ident, setId, first, last in conn.execute(
+        'SELECT f.identifier, s.set_id, s.number_start, s.number_end FROM '
+        'formats f JOIN format_sets s ON s.format_id = f.id'):
+      self.formats.setdefault(ident, {})[setId] = (first, last)
+    self.legalNames = {}
+    for fmt, legal in self.formats.items():
+      self.legalNames[fmt] = {name for card, name in self.names.items()
+                              if self._inFormat(card, legal)}
+    self.species = species.SpeciesTable(conn)
+
+  def _inFormat(self, card, legal):
+    '''
+      Returns: [Boolean] indicating the printing is in one of a format's sets
+    '''
+    if card[0] not in legal: return False
+    first, last = legal[card[0]]
+    return ((first == None or card[1] >= first) and
+            (last == None or card[1] <= last))
+
+  def validate(self, deck, fmt = 'expanded', rules = RULES):
+    '''
+      Validates a deck.
+
+      Arguments:
+        deck: [decklist.Decklist] to validate.
+        fmt: [String] format identifier (`formats`.`identifier`).
+        rules: [Dict] of deck construction rules (see RULES).
+
+      Returns: [List] of [String] problems, empty if the deck is legal
+    '''
+    problems = ['Unknown card: {} {}'.format(e.quantity, e.name)
+                for e in deck.unresolved]
+    problems += ['Inexact match: {} {} read as {}'.format(e.quantity,
+                 written(e), self.names.get(e.card, '?'))
+                 for e in deck.entries if e.card != None and not e.exact]
+    counts = deck.counts()
+    total = deck.total()
+    if total != rules['deckSize']:
+      problems.append('Deck has {} cards instead of {}'.format(total,
+                      rules['deckSize']))
+    legal = self.formats.get(fmt)
+    if legal == None: problems.append('Unknown format: ' + fmt)
+    copies = {}
+    basics = 0
+    for (setId, number), qty in sorted(counts.items()):
+      name = self.names.get((setId, number), '?')
+      category = self.categories.get((setId, number))
+      if category == BASIC_POKEMON: basics += qty
+      if category != BASIC_ENERGY: copies[name] = copies.get(name, 0) + qty
+      if legal == None or category == BASIC_ENERGY: continue
+      if (not self._inFormat((setId, number), legal) and
+          name not in self.legalNames[fmt]):
+        problems.append('Not legal in {}: {}'.format(fmt, name))
+    for name, qty in sorted(copies.items()):
+      if qty > rules['maxCopies']:
+        problems.append('{} copies of {} (at most {})'.format(qty, name,
+                        rules['maxCopies']))
+    if basics < rules['minBasics']:
+      problems.append('Deck needs at least {} Basic Pokemon'.format(
+                      rules['minBasics']))
+    return problems + self._speciesProblems(sorted(counts), rules)
+
+  def _speciesProblems(self, cards, rules):
+    '''
+      Checks the species rules, as masks over the deck's rows of the species
+      table.
+
+      Arguments:
+        cards: [List] of ([Int] set_id, [Int] number) in the deck.
+        rules: [Dict] of deck construction rules (see RULES).
+
+      Returns: [List] of [String] problems
+    '''
+    sp = self.species
+    checks = []
+    if rules.get('noLegendaries'):
+      checks.append((sp.legendary, 'Legendary Pokemon not allowed: {}'))
+    if rules.get('generations'):
+      checks.append((sp.outsideGenerations(rules['generations']),
+                     'Only generations {} allowed: {{}}'.format(
+                     ', '.join(str(g) for g in rules['generations']))))
+    if rules.get('noDualTypes'):
+      checks.append((sp.dualType(), 'Dual-type Pokemon not allowed: {}'))
+    if not checks or not cards: return []
+    keys = attacks.cardKey([c[0] for c in cards], [c[1] for c in cards])
+    idx, found = sp.rows(keys)
+    problems = []
+    for mask, msg in checks:
+      for i in np.flatnonzero(mask[idx] & found):
+        problems.append(msg.format(self.names.get(cards[i], '?')))
+    return problems
+
+class ValidationCache:
+  '''
+    LRU cache of validation results keyed by deckKey(), so resubmitted lists
+    and identical netdecks are validated only once. An optional SQLite file
+    keeps results across restarts. Entries never go stale: a card database
+    refresh changes the version in the key.
+
+    Attributes:
+      validator: [Validator] used on a miss.
+      size: [Int] maximum number of results held in memory.
+      entries: [collections.OrderedDict] of key -> [List] of problems, least
+        recently used first.
+      conn: [sqlite3.Connection] to the on-disk tier, or None.
+      hits: [Int] lookups answered from memory.
+      diskHits: [Int] lookups answered from the on-disk tier.
+      misses: [Int] lookups that ran the validator.
+  '''
+  def __init__(self, validator = None, size = 4096, db = None):
+    '''
+      Initializes the cache.
+
+      Arguments:
+        validator: [Validator] used on a miss. Defaults to Validator().
+        size: [Int] maximum number of results held in memory.
+        db: [String] path of the SQLite on-disk tier, or None for memory only.
+    '''
+    self.validator = validator if validator != None else Validator()
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.conn = None
+    if db != None:
+      self.conn = sqlite3.connect(db, check_same_thread = False)
+      with self.conn:
+        self.conn.execute('CREATE TABLE IF NOT EXISTS validations (key TEXT '
+                          'PRIMARY KEY, problems TEXT)')
+    self.hits = self.diskHits = self.misses = 0
+    self.lock = thrd.Lock()
+
+  def validate(self, deck, fmt = 'expanded', rules = RULES):
+    '''
+      Validates a deck, using a cached result if there is one.
+
+      Arguments:
+        deck: [decklist.Decklist] to validate.
+        fmt: [String] format identifier (`formats`.`identifier`).
+        rules: [Dict] of deck construction rules (see RULES).
+
+      Returns: [List] of [String] problems, empty if the deck is legal
+    '''
+    key = deckKey(deck, fmt, rules, self.validator.version)
+    with self.lock:
+      problems = self.entries.get(key)
+      if problems != None:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return list(problems)
+      row = None
+      if self.conn != None:
+        row = self.conn.execute('SELECT problems FROM validations WHERE '
+                                'key = ?', (key,)).fetchone()
+      if row != None:
+        problems = json.loads(row[0])
+        self.diskHits += 1
+      else:
+        problems = self.validator.validate(deck, fmt, rules)
+        self.misses += 1
+        if self.conn != None:
+          with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO validations VALUES '
+                              '(?, ?)', (key, json.dumps(problems)))
+      self.entries[key] = problems
+      if len(self.entries) > self.size: self.entries.popitem(last = False)
+      return list(problems)
+
+  def lines(self):
+    '''
+      Returns: [List] of [String] describing the hit rate
+    '''
+    total = self.hits + self.diskHits + self.misses
+    return ['Validation cache: {} lookups, {} hits, {} disk hits, {} misses '
+            '({:.0%} hit rate), {} entries'.format(total, self.hits,
+            self.diskHits, self.misses,
+            (self.hits + self.diskHits) / total if total else 0,
+            len(self.entries))]